@@ -0,0 +1,56 @@
+"""
+Продакшн-запуск шлюза:
+
+    python -m app --workers 4 --port 8080
+
+Мастер один раз создаёт схему (init_db, включает WAL) и поднимает N воркеров uvicorn (uvloop + httptools).
+Воркерам init_db на старте уже не нужен — им передаётся DB_INIT_ON_STARTUP=false.
+Сигналы мастеру: SIGHUP — поочерёдный плавный рестарт воркеров, SIGTTIN/SIGTTOU — ±1 воркер,
+SIGTERM/SIGINT — плавная остановка (воркер дорабатывает запросы не дольше --graceful-timeout).
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+
+import uvicorn
+
+from .settings import settings
+from .db import init_db
+
+
+def _pick(module: str, preferred: str) -> str:
+    # uvloop/httptools ставятся из requirements.txt; на платформах без них uvicorn берёт asyncio/h11
+    return preferred if importlib.util.find_spec(module) else "auto"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m app", description="Run the gateway with pre-forked uvicorn workers")
+    ap.add_argument("--host", default=settings.HOST)
+    ap.add_argument("--port", type=int, default=settings.PORT)
+    ap.add_argument("--workers", type=int, default=settings.WORKERS)
+    ap.add_argument("--graceful-timeout", type=int, default=settings.GRACEFUL_TIMEOUT_SEC,
+                    help="сколько секунд воркер дорабатывает запросы при остановке/рестарте")
+    ap.add_argument("--log-level", default=settings.LOG_LEVEL.lower())
+    args = ap.parse_args()
+
+    asyncio.run(init_db())
+    # воркеры (spawn) читают настройки из окружения заново; при --workers 1 приложение живёт в этом же процессе
+    os.environ["DB_INIT_ON_STARTUP"] = "false"
+    settings.DB_INIT_ON_STARTUP = False
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=max(1, args.workers),
+        loop=_pick("uvloop", "uvloop"),
+        http=_pick("httptools", "httptools"),
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level=args.log_level,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
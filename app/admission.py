@@ -0,0 +1,192 @@
+# Контроль допуска запросов воркера: ограничение одновременных запросов с приоритетами классов и сброс лишнего
+# ответом 503 + Retry-After, пока очередь к провайдерам и SQLite не развалила латентность для всех.
+#
+# Классы по пути (меньше — важнее): webhook (вебхуки провайдеров) > pay (/pay, /refund, /payout) >
+# status (/status, /qr_form) > admin (/admin/*). Прочие пути (health, metrics, пакеты выплат) идут мимо.
+# Класс допускается сразу, если в работе меньше ADMISSION_MAX_INFLIGHT * ADMISSION_SHARE[класс] запросов и
+# его не ждёт запрос того же или более важного класса; иначе ждёт в очереди по приоритету не дольше
+# ADMISSION_MAX_WAIT_MS[класс] (и не дольше дедлайна запроса) и получает 503.
+# Цель по латентности: если EWMA длительности pay/status выше ADMISSION_LATENCY_TARGET_MS, лимит для всех
+# классов, кроме вебхуков, сжимается пропорционально target / ewma — лишнее отсекается до того, как встанет в очередь.
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .settings import settings
+from .metrics import Counter, Gauge, Histogram
+from . import deadline
+
+CLASSES = ("webhook", "pay", "status", "admin")
+_PRIORITY = {c: i for i, c in enumerate(CLASSES)}
+_PAY_PATHS = frozenset(("/pay", "/refund", "/payout"))
+_LATENCY_CLASSES = frozenset(("pay", "status"))  # админка (профиль, выгрузки) долгая по природе — в EWMA не идёт
+_EWMA_ALPHA = 0.1
+
+ADMISSION_INFLIGHT = Gauge("gateway_admission_inflight", "Requests admitted and not yet finished")
+ADMISSION_QUEUED = Gauge("gateway_admission_queued", "Requests waiting for admission")
+ADMISSION_WAIT_SECONDS = Histogram(
+    "gateway_admission_wait_seconds",
+    "Time spent waiting for admission",
+    ("class",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+ADMISSION_SHED = Counter(
+    "gateway_admission_shed_total",
+    "Requests rejected with 503 by admission control",
+    ("class", "reason"),
+)
+ADMISSION_LATENCY_EWMA = Gauge("gateway_admission_latency_ewma_seconds", "EWMA of pay/status request duration")
+
+
+def classify(path: str) -> Optional[str]:
+    if path in _PAY_PATHS:
+        return "pay"
+    if path == "/status" or path.startswith("/qr_form/"):
+        return "status"
+    if path.startswith("/provider/") and path.endswith("/webhook"):
+        return "webhook"
+    if path.startswith("/admin/"):
+        return "admin"
+    return None
+
+
+class Shed(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        limit: int,
+        shares: Dict[str, float],
+        max_wait_ms: Dict[str, int],
+        latency_target_ms: int,
+        max_queue: int,
+    ):
+        self.limit = max(1, limit)
+        self.shares = {c: shares.get(c, 1.0) for c in CLASSES}
+        self.max_wait = {c: max_wait_ms.get(c, 0) / 1000 for c in CLASSES}
+        self.target = latency_target_ms / 1000
+        self.max_queue = max_queue
+        self.inflight = 0
+        self.ewma = 0.0
+        # (приоритет, порядковый номер, класс, future); отменённые ожидания вычищаются лениво
+        self._heap: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    def capacity(self, cls: str) -> float:
+        cap = self.limit * self.shares[cls]
+        if cls != "webhook" and self.target and self.ewma > self.target:
+            cap *= self.target / self.ewma
+        return max(1.0, cap)
+
+    def _top(self) -> Optional[Tuple[int, int, str, asyncio.Future]]:
+        while self._heap and self._heap[0][3].done():
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    async def acquire(self, cls: str) -> float:
+        """Ждёт допуска; возвращает время ожидания в секундах или бросает Shed."""
+        prio = _PRIORITY[cls]
+        top = self._top()
+        if (top is None or top[0] > prio) and self.inflight < self.capacity(cls):
+            self.inflight += 1
+            return 0.0
+
+        wait = self.max_wait[cls]
+        left = deadline.remaining()
+        if left is not None:
+            wait = min(wait, left - deadline.RESERVE_SEC)
+        if wait <= 0:
+            raise Shed("overload")
+        if len(self._heap) >= self.max_queue:
+            raise Shed("queue_full")
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (prio, next(self._seq), cls, fut))
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(fut, wait)
+        except asyncio.TimeoutError:
+            raise Shed("queue_timeout")
+        except asyncio.CancelledError:
+            # клиент ушёл, но слот ему уже успели выдать — возвращаем
+            if fut.done() and not fut.cancelled():
+                self.release(cls, None)
+            raise
+        return time.perf_counter() - t0
+
+    def release(self, cls: str, duration: Optional[float]) -> None:
+        self.inflight -= 1
+        if duration is not None and cls in _LATENCY_CLASSES:
+            self.ewma = duration if not self.ewma else self.ewma + _EWMA_ALPHA * (duration - self.ewma)
+        # освободившиеся слоты — самым важным из ждущих; доли классов убывают с приоритетом,
+        # так что если не проходит верхний, остальные тоже не пройдут
+        while True:
+            top = self._top()
+            if top is None or self.inflight >= self.capacity(top[2]):
+                break
+            heapq.heappop(self._heap)
+            self.inflight += 1
+            top[3].set_result(None)
+
+    def queued(self) -> int:
+        return sum(1 for w in self._heap if not w[3].done())
+
+
+controller = AdmissionController(
+    settings.ADMISSION_MAX_INFLIGHT,
+    settings.ADMISSION_SHARE,
+    settings.ADMISSION_MAX_WAIT_MS,
+    settings.ADMISSION_LATENCY_TARGET_MS,
+    settings.ADMISSION_MAX_QUEUE,
+)
+
+_SHED_BODY = json.dumps({"detail": "Service overloaded, retry later"}).encode()
+
+
+class AdmissionMiddleware:
+    """ASGI-мидлварь допуска: запросы известных классов проходят через controller, лишние получают 503."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        cls = classify(scope["path"]) if scope["type"] == "http" else None
+        if cls is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            waited = await controller.acquire(cls)
+        except Shed as e:
+            ADMISSION_SHED.labels(cls, e.reason).inc()
+            ADMISSION_QUEUED.labels().set(controller.queued())
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(settings.ADMISSION_RETRY_AFTER_SEC).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": _SHED_BODY})
+            return
+
+        ADMISSION_WAIT_SECONDS.labels(cls).observe(waited)
+        ADMISSION_INFLIGHT.labels().set(controller.inflight)
+        ADMISSION_QUEUED.labels().set(controller.queued())
+        t0 = time.perf_counter()
+        duration = None
+        try:
+            await self.app(scope, receive, send)
+            duration = time.perf_counter() - t0
+        finally:
+            controller.release(cls, duration)
+            ADMISSION_INFLIGHT.labels().set(controller.inflight)
+            ADMISSION_QUEUED.labels().set(controller.queued())
+            ADMISSION_LATENCY_EWMA.labels().set(controller.ewma)
@@ -0,0 +1,229 @@
+# Операционная аналитика без сканов mappings: конверсия, время до оплаты и объём по провайдеру, методу и часу.
+#
+# Агрегаты ведутся инкрементально в точках, где транзакция и так пишется: /pay заводит маппинг (created, volume),
+# машина состояний (app/txstatus.py) записала переход вперёд (approved | declined | refunded, время от created_at
+# маппинга до approved). В памяти воркера — приращения по ключу (час события, провайдер, метод): счётчики и
+# гистограмма задержки с фиксированными корзинами APPROVAL_BUCKETS, которая складывается между воркерами.
+# Раз в ANALYTICS_FLUSH_SEC приращения прибавляются к analytics_hourly / analytics_latency одним UPSERT.
+# GET /admin/analytics читает только эти таблицы (часы × провайдеры × методы строк) плюс неотправленное своего
+# воркера — приращения остальных воркеров видны с задержкой до ANALYTICS_FLUSH_SEC.
+# Час — час события: approved в 10:05 по оплате, заведённой в 09:58, считается в 10:00, поэтому конверсия
+# отдельного часа приблизительна, а за окно в несколько часов — точна с точностью до краёв окна.
+# Ручные правки статуса админкой (/admin/update_status, bulk) машину состояний обходят и сюда не попадают.
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from .settings import settings
+from .db import add_analytics, get_analytics, prune_analytics
+from .deadline import detach
+
+logger = logging.getLogger(__name__)
+
+# Корзины времени от /pay до approved, секунды (верхние границы; последняя корзина — всё, что дольше)
+APPROVAL_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 21600, 86400)
+
+_HOUR = 3600
+# Порядок счётчиков в строке приращений — как колонки analytics_hourly после (hour, provider, method)
+_FIELDS = ("created", "approved", "declined", "refunded", "volume", "approved_volume", "latency_sum", "latency_count")
+_IDX = {name: i for i, name in enumerate(_FIELDS)}
+_OUTCOMES = ("approved", "declined", "refunded")
+
+_Key = Tuple[int, str, str]
+
+
+def _key(provider: Optional[str], method: Optional[str], now: float) -> _Key:
+    return int(now) // _HOUR * _HOUR, provider or "unknown", (method or "").upper()
+
+
+def _amount(amount: Any) -> int:
+    try:
+        return int(amount or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Aggregator:
+    def __init__(self):
+        self._counts: Dict[_Key, List[float]] = {}
+        self._latency: Dict[Tuple[_Key, int], int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._pruned_hour = 0
+
+    def _row(self, key: _Key) -> List[float]:
+        row = self._counts.get(key)
+        if row is None:
+            row = self._counts[key] = [0] * len(_FIELDS)
+            if self._task is None or self._task.done():
+                self._task = asyncio.ensure_future(self._flush_loop())
+        return row
+
+    # ---- запись (синхронно, O(1): только словари в памяти) ----
+    def record_pay(self, provider: str, method: Optional[str], amount: Any, result: Any) -> None:
+        """Маппинг заведён /pay; финальный ответ уже на /pay (declined сразу) считается переходом с задержкой 0."""
+        now = time.time()
+        key = _key(provider, method, now)
+        row = self._row(key)
+        row[_IDX["created"]] += 1
+        row[_IDX["volume"]] += _amount(amount)
+        if str(result) in _OUTCOMES:
+            self._outcome(key, row, str(result), amount, 0.0)
+
+    def record_transition(self, provider: str, state: Any, row: Dict[str, Any]) -> None:
+        """Записанный переход вперёд; row — created_at, method, amount маппинга (compare_and_set_status)."""
+        now = time.time()
+        key = _key(provider, row.get("method"), now)
+        created_at = row.get("created_at")
+        # created_at = 0 — строка до миграции, время оплаты неизвестно
+        latency = max(0.0, now - created_at) if created_at else None
+        self._outcome(key, self._row(key), str(state), row.get("amount"), latency)
+
+    def _outcome(self, key: _Key, row: List[float], outcome: str, amount: Any, latency: Optional[float]) -> None:
+        if outcome not in _OUTCOMES:
+            return
+        row[_IDX[outcome]] += 1
+        if outcome != "approved":
+            return
+        row[_IDX["approved_volume"]] += _amount(amount)
+        if latency is not None:
+            row[_IDX["latency_sum"]] += latency
+            row[_IDX["latency_count"]] += 1
+            b = (key, bisect_left(APPROVAL_BUCKETS, latency))
+            self._latency[b] = self._latency.get(b, 0) + 1
+
+    # ---- сброс в БД ----
+    async def flush(self) -> None:
+        if not self._counts:
+            return
+        counts, latency = self._counts, self._latency
+        self._counts, self._latency = {}, {}
+        try:
+            await add_analytics([(*k, *row) for k, row in counts.items()], [(*k, b, n) for (k, b), n in latency.items()])
+        except Exception:
+            # запись не удалась — приращения возвращаются к накопленным за это время
+            self._merge(counts, latency)
+            raise
+        hour = int(time.time()) // _HOUR * _HOUR
+        if hour != self._pruned_hour:
+            self._pruned_hour = hour
+            await prune_analytics(hour - settings.ANALYTICS_RETENTION_DAYS * 86400)
+
+    def _merge(self, counts: Dict[_Key, List[float]], latency: Dict[Tuple[_Key, int], int]) -> None:
+        for k, row in counts.items():
+            cur = self._counts.setdefault(k, [0] * len(_FIELDS))
+            for i, v in enumerate(row):
+                cur[i] += v
+        for b, n in latency.items():
+            self._latency[b] = self._latency.get(b, 0) + n
+
+    async def _flush_loop(self) -> None:
+        detach()
+        while self._counts:
+            await asyncio.sleep(settings.ANALYTICS_FLUSH_SEC)
+            try:
+                await self.flush()
+            except Exception:
+                # приращения остались в памяти и уйдут следующим тиком
+                logger.exception("analytics flush failed")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def pending(self) -> Tuple[Dict[_Key, List[float]], Dict[Tuple[_Key, int], int]]:
+        return self._counts, self._latency
+
+
+analytics = _Aggregator()
+
+
+def _quantile(buckets: List[int], q: float) -> Optional[float]:
+    """Квантиль по корзинам APPROVAL_BUCKETS: линейно внутри корзины; хвост за последней границей — её граница."""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank, seen = q * total, 0
+    for i, n in enumerate(buckets):
+        if n and seen + n >= rank:
+            if i >= len(APPROVAL_BUCKETS):
+                return float(APPROVAL_BUCKETS[-1])
+            lo = APPROVAL_BUCKETS[i - 1] if i else 0
+            return round(lo + (APPROVAL_BUCKETS[i] - lo) * (rank - seen) / n, 1)
+        seen += n
+    return float(APPROVAL_BUCKETS[-1])
+
+
+def _summary(row: Dict[str, Any], buckets: List[int]) -> Dict[str, Any]:
+    created, approved = row["created"], row["approved"]
+    count = row.pop("latency_count")
+    latency_sum = row.pop("latency_sum")
+    return {
+        **row,
+        "conversion": round(approved / created, 4) if created else None,
+        "approval_latency_sec": {
+            "count": count,
+            "avg": round(latency_sum / count, 1) if count else None,
+            "p50": _quantile(buckets, 0.5),
+            "p90": _quantile(buckets, 0.9),
+            "p99": _quantile(buckets, 0.99),
+        },
+    }
+
+
+async def report(hours: int, provider: Optional[str] = None, method: Optional[str] = None) -> Dict[str, Any]:
+    """Агрегаты за последние hours часов (включая текущий): по часам и итог за окно по провайдеру и методу."""
+    now = time.time()
+    since = int(now) // _HOUR * _HOUR - (hours - 1) * _HOUR
+    method = method.upper() if method is not None else None
+    counts_rows, latency_rows = await get_analytics(since, provider, method)
+
+    counts: Dict[_Key, List[float]] = {tuple(r[:3]): list(r[3:]) for r in counts_rows}
+    latency: Dict[Tuple[_Key, int], int] = {(tuple(r[:3]), r[3]): r[4] for r in latency_rows}
+    # неотправленные приращения своего воркера
+    mine, mine_latency = analytics.pending()
+
+    def wanted(k: _Key) -> bool:
+        return k[0] >= since and (not provider or k[1] == provider) and (method is None or k[2] == method)
+
+    for k, row in mine.items():
+        if wanted(k):
+            cur = counts.setdefault(k, [0] * len(_FIELDS))
+            for i, v in enumerate(row):
+                cur[i] += v
+    for (k, b), n in mine_latency.items():
+        if wanted(k):
+            latency[(k, b)] = latency.get((k, b), 0) + n
+
+    n_buckets = len(APPROVAL_BUCKETS) + 1
+    hist: Dict[_Key, List[int]] = {}
+    for (k, b), n in latency.items():
+        hist.setdefault(k, [0] * n_buckets)[b] += n
+
+    rows, totals, total_hist = [], {}, {}
+    for k in sorted(counts):
+        row = dict(zip(_FIELDS, counts[k]))
+        buckets = hist.get(k, [0] * n_buckets)
+        rows.append({
+            "hour": time.strftime("%Y-%m-%dT%H:00:00Z", time.gmtime(k[0])),
+            "provider": k[1],
+            "method": k[2],
+            **_summary(dict(row), buckets),
+        })
+        t = totals.setdefault(k[1:], dict.fromkeys(_FIELDS, 0))
+        for f, v in row.items():
+            t[f] += v
+        th = total_hist.setdefault(k[1:], [0] * n_buckets)
+        for i, n in enumerate(buckets):
+            th[i] += n
+
+    return {
+        "since": time.strftime("%Y-%m-%dT%H:00:00Z", time.gmtime(since)),
+        "hours": hours,
+        "flush_lag_sec": settings.ANALYTICS_FLUSH_SEC,
+        "totals": [{"provider": p, "method": m, **_summary(t, total_hist[(p, m)])} for (p, m), t in totals.items()],
+        "rows": rows,
+    }
@@ -0,0 +1,73 @@
+# Очередь коллбэков в RP для массовых операций админки: отправка в фоне, не быстрее
+# CALLBACK_QUEUE_RATE_PER_SEC и не больше CALLBACK_QUEUE_CONCURRENCY одновременно — чтобы разбор инцидента
+# на тысячи транзакций не положил RP и не съел пул соединений боевого трафика.
+# Очередь в памяти воркера: при рестарте неотправленные коллбэки теряются, задание остаётся running.
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+from ..settings import settings
+from ..deadline import detach
+from ..jobs import Job
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackQueue:
+    def __init__(self, rate_per_sec: float, concurrency: int):
+        self.rate = rate_per_sec
+        self.concurrency = max(1, concurrency)
+        self._queue: "asyncio.Queue[Tuple[Job, Dict[str, Any]]]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._next_at = 0.0
+
+    def submit(self, job: Job, txs: Iterable[Dict[str, Any]]) -> int:
+        """Ставит коллбэки по транзакциям в очередь; возвращает сколько поставлено."""
+        n = 0
+        for tx in txs:
+            if tx.get("callback_url"):
+                self._queue.put_nowait((job, tx))
+                n += 1
+        job.add_pending(n)
+        if n and not self._workers:
+            self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+        return n
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def _throttle(self) -> None:
+        # равномерный темп: каждый воркер занимает следующий слот 1/rate
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        at = max(now, self._next_at)
+        self._next_at = at + 1 / self.rate
+        if at > now:
+            await asyncio.sleep(at - now)
+
+    async def _worker(self) -> None:
+        detach()  # коллбэки переживают запрос админки, который их поставил
+        from .rp_client import send_callback_to_rp
+
+        while True:
+            job, tx = await self._queue.get()
+            try:
+                await self._throttle()
+                await send_callback_to_rp(tx)
+                job.inc("callbacks_sent")
+            except Exception as e:
+                job.inc("callbacks_failed")
+                logger.warning("queued RP callback for %s failed: %s", tx.get("rp_token"), e)
+            finally:
+                job.step_done()
+                self._queue.task_done()
+
+    def stop(self) -> None:
+        for w in self._workers:
+            w.cancel()
+        self._workers = []
+
+
+callback_queue = CallbackQueue(settings.CALLBACK_QUEUE_RATE_PER_SEC, settings.CALLBACK_QUEUE_CONCURRENCY)
@@ -1,16 +1,24 @@
 import json
-import httpx
-import jwt
-from Crypto.Cipher import AES
+import logging
+import time
 from base64 import b64encode
 from typing import Dict, Any
 from app.settings import settings
-from ..utils.http import client, retry_policy
+from ..utils.http import shared_client, retry_policy
+from ..deadline import cap
 from ..settings import settings
 from ..utils.security import hmac_sha256_b64
+from ..metrics import observe_rp_callback
+from ..tracing import span
+from ..loopmon import run_cpu
 
+logger = logging.getLogger(__name__)
 
+
+# jwt и Crypto импортируются при первом вызове: ручные коллбэки из админки редки, а импорт стоит ~50 мс старта
 def encrypt_secure_block(data: Dict[str, Any], key: str) -> str:
+    from Crypto.Cipher import AES
+
     raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
     key_bytes = key.encode("utf-8")
     if len(key_bytes) < 32:
@@ -26,6 +34,8 @@ def encrypt_secure_block(data: Dict[str, Any], key: str) -> str:
 
 
 def make_jwt(payload: Dict[str, Any], secret: str) -> str:
+    import jwt
+
     return jwt.encode(payload, secret, algorithm="HS512")
 
 
@@ -43,7 +53,7 @@ async def send_callback_to_rp(tx: dict):
         "currency": tx.get("currency"),
         # ... другие поля ...
     }
-    encrypted_secure = encrypt_secure_block(secure_block, settings.RP_CALLBACK_SIGNING_SECRET)
+    encrypted_secure = await run_cpu(encrypt_secure_block, secure_block, settings.RP_CALLBACK_SIGNING_SECRET)
     payload = {
         "token": tx.get("rp_token"),
         "gateway_token": tx.get("provider_operation_id"),
@@ -53,14 +63,20 @@ async def send_callback_to_rp(tx: dict):
         "secure": encrypted_secure,
         # ... другие поля ...
     }
-    jwt_token = make_jwt(payload, settings.RP_CALLBACK_SIGNING_SECRET)
+    jwt_token = await run_cpu(make_jwt, payload, settings.RP_CALLBACK_SIGNING_SECRET)
     headers = {
         "Authorization": f"Bearer {jwt_token}",
         "Content-Type": "application/json"
     }
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(callback_url, json=payload, headers=headers)
-        print("RP callback response:", resp.status_code, resp.text)
+    t0 = time.perf_counter()
+    code = None
+    try:
+        with span("rp_callback"):
+            resp = await shared_client().post(callback_url, json=payload, headers=headers, timeout=cap(5, "callback"))
+            code = resp.status_code
+    finally:
+        observe_rp_callback(callback_url, t0, code)
+    logger.info("RP callback response: %s %s", resp.status_code, resp.text[:200])
 
 
 class RPCallbackClient:
@@ -75,16 +91,27 @@ class RPCallbackClient:
     HMAC-подпись (опционально): заголовок X-RP-Signature (base64(HMAC-SHA256)).
     """
 
-    @retry_policy(max_attempts=settings.RP_CALLBACK_RETRY_MAX)
-    async def send_callback(self, url: str, payload: Dict[str, Any]) -> int:
+    @staticmethod
+    def _encode(payload: Dict[str, Any]):
         body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
         headers = {"Content-Type": "application/json"}
 
         if settings.RP_CALLBACK_SIGNING_SECRET and settings.RP_CALLBACK_SIGNING_SECRET != "replace_me":
             signature = hmac_sha256_b64(settings.RP_CALLBACK_SIGNING_SECRET, body)
             headers["X-RP-Signature"] = signature
+        return body, headers
+
+    @retry_policy(max_attempts=settings.RP_CALLBACK_RETRY_MAX)
+    async def send_callback(self, url: str, payload: Dict[str, Any]) -> int:
+        body, headers = await run_cpu(self._encode, payload)
 
-        async with client(timeout_sec=15) as c:
-            resp = await c.post(url, content=body, headers=headers)
-            resp.raise_for_status()
-            return resp.status_code
+        t0 = time.perf_counter()
+        code = None
+        try:
+            with span("rp_callback"):
+                resp = await shared_client().post(url, content=body, headers=headers, timeout=cap(15, "callback"))
+                code = resp.status_code
+        finally:
+            observe_rp_callback(url, t0, code)
+        resp.raise_for_status()
+        return resp.status_code
@@ -0,0 +1,282 @@
+# Запись реального трафика для офлайн-прогонов (python -m bench.replay): входящие запросы RP и вебхуки провайдеров
+# и внутри каждого — обмены с провайдером из _post/_get адаптеров. Строка NDJSON на входящий запрос.
+#
+# Выборка — по транзакции: crc32(rp_token) против CAPTURE_SAMPLE_RATE, поэтому /pay, опросы /status и вебхуки
+# одной транзакции попадают в запись вместе и одинаково во всех воркерах. rp_token привязывают /pay и TxContext;
+# запрос, не дошедший до транзакции (400, неизвестный токен), выбирается по crc тела.
+# Секреты вырезаются до записи: заголовки авторизации и подписи и ключи из CAPTURE_REDACT_KEYS на любой глубине
+# тела запроса и ответа. Каждый воркер пишет свои сегменты capture-<время>-<pid>-<n>.ndjson в CAPTURE_DIR,
+# новый сегмент — по CAPTURE_SEGMENT_MAX_BYTES / CAPTURE_SEGMENT_MAX_SEC, больше CAPTURE_MAX_SEGMENTS —
+# старые удаляются. Выключено по умолчанию (CAPTURE_ENABLED): без него мидлварь не ставится, а хуки в адаптерах
+# сводятся к чтению contextvar.
+import json
+import logging
+import os
+import time
+import zlib
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .settings import settings
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+ENABLED = settings.CAPTURE_ENABLED
+
+REDACTED = "***"
+_REDACT_KEYS = frozenset(k.lower() for k in settings.CAPTURE_REDACT_KEYS)
+_REDACT_HEADERS = frozenset(("authorization", "x-signature", "x-admin-secret", "x-api-key", "cookie", "set-cookie"))
+_SKIP_HEADERS = frozenset(("host", "content-length", "connection", "accept-encoding", "transfer-encoding"))
+
+CAPTURE = Counter(
+    "gateway_capture_total",
+    "Captured inbound requests",
+    ("result",),  # written | sampled_out | failed
+)
+
+
+def redact(value: Any) -> Any:
+    """Копия JSON-значения с REDACTED вместо значений ключей из CAPTURE_REDACT_KEYS (на любой глубине)."""
+    if isinstance(value, dict):
+        return {k: (REDACTED if str(k).lower() in _REDACT_KEYS else redact(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+
+def _decode_body(raw: bytes, content_type: str) -> Dict[str, Any]:
+    """{"body": JSON | текст} с вырезанными секретами; больше CAPTURE_MAX_BODY_BYTES — усечённый текст."""
+    if len(raw) > settings.CAPTURE_MAX_BODY_BYTES:
+        return {"body": raw[:settings.CAPTURE_MAX_BODY_BYTES].decode("utf-8", "replace"), "body_truncated": True}
+    if not raw:
+        return {"body": None}
+    if "json" in content_type:
+        try:
+            return {"body": redact(json.loads(raw))}
+        except ValueError:
+            pass
+    return {"body": raw.decode("utf-8", "replace")}
+
+
+def _sampled(key: bytes) -> bool:
+    rate = settings.CAPTURE_SAMPLE_RATE
+    return rate >= 1 or zlib.crc32(key) % 10_000 < rate * 10_000
+
+
+class _Record:
+    __slots__ = ("data", "tx", "body", "response", "closed")
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self.tx: Optional[str] = None
+        self.body = bytearray()
+        self.response = bytearray()
+        self.closed = False
+
+
+_current: ContextVar[Optional[_Record]] = ContextVar("capture_record", default=None)
+
+
+def bind(rp_token: Optional[str]) -> None:
+    """Привязывает текущий входящий запрос к транзакции: по ней решается выборка."""
+    rec = _current.get()
+    if rec is not None and rec.tx is None and rp_token:
+        rec.tx = str(rp_token)
+
+
+class _ProviderCall:
+    __slots__ = ("rec", "entry", "t0")
+
+    def __init__(self, rec: _Record, entry: Dict[str, Any]):
+        self.rec = rec
+        self.entry = entry
+        self.t0 = time.perf_counter()
+
+    def __enter__(self) -> "_ProviderCall":
+        return self
+
+    def response(self, resp: httpx.Response) -> None:
+        self.entry["status"] = resp.status_code
+        self.entry.update(_decode_body(resp.content, resp.headers.get("content-type", "")))
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.entry["duration_ms"] = round((time.perf_counter() - self.t0) * 1000, 3)
+        if exc is not None:
+            # попытка упала до ответа (таймаут, обрыв) — её повторяет retry_policy, replay воспроизводит обрыв
+            self.entry["error"] = type(exc).__name__
+        if not self.rec.closed:
+            self.rec.data["provider_calls"].append(self.entry)
+
+
+class _NoCall:
+    def __enter__(self) -> "_NoCall":
+        return self
+
+    def response(self, resp: httpx.Response) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NO_CALL = _NoCall()
+
+
+def provider_call(provider: str, method: str, base_url: str, path: str, body: Any = None):
+    """
+    Контекст одной попытки запроса к провайдеру (внутри retry_policy — каждая попытка отдельно):
+        with capture.provider_call(self.name, "POST", self.base_url, path, json_payload) as call:
+            resp = await ...
+            call.response(resp)
+    Вне записываемого запроса — пустышка.
+    """
+    rec = _current.get()
+    if rec is None or rec.closed:
+        return _NO_CALL
+    return _ProviderCall(rec, {
+        "t": time.time(),
+        "provider": provider,
+        "method": method,
+        "base_url": base_url,
+        "path": path,
+        "request": redact(body),
+    })
+
+
+class _SegmentWriter:
+    def __init__(self, directory: str, max_bytes: int, max_sec: float, max_segments: int):
+        self.dir = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_sec = max_sec
+        self.max_segments = max_segments
+        self._fh = None
+        self._opened_at = 0.0
+        self._size = 0
+        self._n = 0
+        self._pid: Optional[int] = None
+
+    def _rotate(self, now: float) -> None:
+        if self._fh is not None:
+            self._fh.close()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._n += 1
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now))
+        # line buffering: строка уходит в файл целиком, упавший воркер оставляет валидный NDJSON
+        self._fh = open(self.dir / f"capture-{stamp}-{os.getpid()}-{self._n:04d}.ndjson", "a",
+                        encoding="utf-8", buffering=1)
+        self._opened_at, self._size, self._pid = now, 0, os.getpid()
+        segments = sorted(self.dir.glob("capture-*.ndjson"))
+        for old in segments[:max(0, len(segments) - self.max_segments)]:
+            old.unlink(missing_ok=True)
+
+    def write(self, data: Dict[str, Any]) -> None:
+        line = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        now = time.time()
+        if (self._fh is None or self._pid != os.getpid() or self._size >= self.max_bytes
+                or now - self._opened_at >= self.max_sec):
+            self._rotate(now)
+        self._fh.write(line)
+        self._size += len(line)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+writer = _SegmentWriter(
+    settings.CAPTURE_DIR, settings.CAPTURE_SEGMENT_MAX_BYTES, settings.CAPTURE_SEGMENT_MAX_SEC,
+    settings.CAPTURE_MAX_SEGMENTS,
+)
+
+
+def _wanted(path: str) -> bool:
+    # "/pay" — ровно путь, "/provider/" — префикс
+    return any(path.startswith(p) if p.endswith("/") else path == p for p in settings.CAPTURE_PATHS)
+
+
+def _headers(raw: List) -> Dict[str, str]:
+    out = {}
+    for k, v in raw:
+        name = k.decode("latin-1").lower()
+        if name in _SKIP_HEADERS:
+            continue
+        out[name] = REDACTED if name in _REDACT_HEADERS else v.decode("latin-1")
+    return out
+
+
+class CaptureMiddleware:
+    """ASGI-мидлварь записи трафика: тело запроса и ответа копируется по мере чтения и отправки."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _wanted(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        headers = _headers(scope.get("headers") or [])
+        rec = _Record({
+            "t": time.time(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "headers": headers,
+            "provider_calls": [],
+        })
+        limit = settings.CAPTURE_MAX_BODY_BYTES + 1
+        t0 = time.perf_counter()
+        response_type = [""]
+
+        async def _receive():
+            message = await receive()
+            if message["type"] == "http.request" and len(rec.body) < limit:
+                rec.body += message.get("body", b"")[:limit - len(rec.body)]
+            return message
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                rec.data["status"] = message["status"]
+                for k, v in message.get("headers") or []:
+                    if k.lower() == b"content-type":
+                        response_type[0] = v.decode("latin-1")
+            elif message["type"] == "http.response.body" and len(rec.response) < limit:
+                rec.response += message.get("body", b"")[:limit - len(rec.response)]
+            await send(message)
+
+        token = _current.set(rec)
+        try:
+            await self.app(scope, _receive, _send)
+        finally:
+            _current.reset(token)
+            rec.closed = True
+            rec.data["duration_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+            route = scope.get("route")
+            rec.data["route"] = getattr(route, "path", None) or scope["path"]
+            self._finish(rec, headers.get("content-type", ""), response_type[0])
+
+    @staticmethod
+    def _finish(rec: _Record, request_type: str, response_type: str) -> None:
+        if not _sampled((rec.tx or "").encode("utf-8") or bytes(rec.body)):
+            CAPTURE.labels("sampled_out").inc()
+            return
+        data = rec.data
+        data["tx"] = rec.tx
+        data.update(_decode_body(bytes(rec.body), request_type))
+        response = _decode_body(bytes(rec.response), response_type)
+        data["response"] = response["body"]
+        if response.get("body_truncated"):
+            data["response_truncated"] = True
+        try:
+            writer.write(data)
+        except Exception as e:
+            # запись трафика не должна ронять запрос — ответ уже ушёл
+            CAPTURE.labels("failed").inc()
+            logger.warning("capture write failed: %s", e)
+            return
+        CAPTURE.labels("written").inc()
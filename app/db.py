@@ -1,7 +1,17 @@
+import time
 import aiosqlite
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Iterable, Optional, Tuple
+from .settings import settings
+from .metrics import DB_CALL_SECONDS, DB_COMMIT_SECONDS
+from .tracing import span
+from .deadline import cap
+from .shmcache import cache
 
 DB_FILE = "./data/mappings.sqlite3"
+# timeout у sqlite3 — это busy_timeout: писатель ждёт, пока другой воркер отпустит блокировку
+BUSY_TIMEOUT_SEC = settings.DB_BUSY_TIMEOUT_MS / 1000
 
 INIT_SQL = '''
 CREATE TABLE IF NOT EXISTS mappings (
@@ -12,21 +22,166 @@ CREATE TABLE IF NOT EXISTS mappings (
     provider_operation_id TEXT,
     callback_url TEXT NOT NULL,
     status TEXT,
+    amount INTEGER,                         -- payment.amount из RP (сверка с реестрами провайдера)
+    currency TEXT,
+    created_at REAL,                        -- unix time первой записи (pay)
+    updated_at REAL,                        -- unix time последнего изменения
     UNIQUE(rp_token)
 );
-CREATE INDEX IF NOT EXISTS ix_mappings_order_number ON mappings(order_number);
+CREATE INDEX IF NOT EXISTS ix_mappings_provider_operation_id ON mappings(provider_operation_id);
+
+CREATE TABLE IF NOT EXISTS provider_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    rp_token TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    kind TEXT,
+    status_code INTEGER,
+    created_at REAL NOT NULL,               -- unix time
+    body BLOB NOT NULL                      -- zlib(JSON) полного лога запроса/ответа
+);
+CREATE INDEX IF NOT EXISTS ix_provider_logs_rp_token ON provider_logs(rp_token);
+CREATE INDEX IF NOT EXISTS ix_provider_logs_created_at ON provider_logs(created_at);
+
+CREATE TABLE IF NOT EXISTS pay_responses (
+    rp_token TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,              -- хэш значимых полей запроса /pay
+    created_at REAL NOT NULL,
+    body BLOB NOT NULL                      -- zlib(JSON) финального ответа /pay
+);
+CREATE INDEX IF NOT EXISTS ix_pay_responses_created_at ON pay_responses(created_at);
+
+CREATE TABLE IF NOT EXISTS status_snapshots (
+    rp_token TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    captured_at REAL NOT NULL,              -- unix time последнего удачного ответа провайдера
+    status TEXT NOT NULL,                   -- результат RP (pending | approved | ...)
+    provider_status TEXT,
+    amount NUMERIC,                         -- как прислал провайдер (или из запроса /pay)
+    currency TEXT,
+    requisites BLOB,                        -- zlib(JSON) реквизитов, ответ без реквизитов прежние не затирает
+    qr TEXT                                 -- ссылка QR/оплаты, так же не затирается ответом без неё
+);
+CREATE INDEX IF NOT EXISTS ix_status_snapshots_captured_at ON status_snapshots(captured_at);
+
+CREATE TABLE IF NOT EXISTS payout_batches (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    status TEXT NOT NULL,                   -- running | done
+    total INTEGER NOT NULL,
+    owner TEXT,                             -- воркер, который сейчас ведёт пакет
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS ix_payout_batches_status ON payout_batches(status, heartbeat_at);
+
+CREATE TABLE IF NOT EXISTS payout_items (
+    batch_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    payload TEXT NOT NULL,                  -- JSON тела выплаты (как в /payout)
+    status TEXT NOT NULL,                   -- queued | sent | done | failed
+    result_status TEXT,                     -- approved | declined | ...
+    result TEXT,                            -- JSON ответа адаптера
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (batch_id, seq)
+);
+CREATE INDEX IF NOT EXISTS ix_payout_items_status ON payout_items(batch_id, status, seq);
+
+CREATE TABLE IF NOT EXISTS admin_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,                     -- bulk_update_status | ...
+    status TEXT NOT NULL,                   -- running | done
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    progress TEXT NOT NULL                  -- JSON счётчиков
+);
+
+CREATE TABLE IF NOT EXISTS analytics_hourly (
+    hour INTEGER NOT NULL,                  -- unix time начала часа (UTC), когда случилось событие
+    provider TEXT NOT NULL,
+    method TEXT NOT NULL,                   -- payment_method из /pay, '' — неизвестен
+    created INTEGER NOT NULL DEFAULT 0,     -- маппингов заведено (/pay)
+    approved INTEGER NOT NULL DEFAULT 0,
+    declined INTEGER NOT NULL DEFAULT 0,
+    refunded INTEGER NOT NULL DEFAULT 0,
+    volume INTEGER NOT NULL DEFAULT 0,      -- сумма amount заведённых
+    approved_volume INTEGER NOT NULL DEFAULT 0,
+    latency_sum REAL NOT NULL DEFAULT 0,    -- секунд от /pay до approved, сумма по approved с известным created_at
+    latency_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, provider, method)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_latency (
+    hour INTEGER NOT NULL,
+    provider TEXT NOT NULL,
+    method TEXT NOT NULL,
+    bucket INTEGER NOT NULL,                -- индекс корзины app.analytics.APPROVAL_BUCKETS
+    count INTEGER NOT NULL,
+    PRIMARY KEY (hour, provider, method, bucket)
+);
 '''
 
+# Колонки, добавленные после первого релиза: в старых файлах БД их нет, CREATE TABLE IF NOT EXISTS их не создаст
+COLUMN_MIGRATIONS = (
+    ("mappings", "created_at", "REAL"),
+    ("mappings", "updated_at", "REAL"),
+    ("mappings", "amount", "INTEGER"),
+    ("mappings", "currency", "TEXT"),
+    ("mappings", "method", "TEXT"),
+    ("status_snapshots", "qr", "TEXT"),
+)
+
+# То, что опирается на мигрированные колонки, — после миграции
+POST_MIGRATION_SQL = '''
+-- строки до миграции без времени: 0 = «неизвестно», чтобы keyset по (created_at, id) их не терял
+UPDATE mappings SET created_at = 0 WHERE created_at IS NULL;
+CREATE INDEX IF NOT EXISTS ix_mappings_created_at ON mappings(created_at, id);
+-- индексы поиска админки (search_mappings): диапазон страницы и фильтры проверяются по индексу, из таблицы
+-- читаются только подошедшие строки. Индекс по префиксу номера заказа заменяет прежний ix_mappings_order_number (точный поиск
+-- по order_number идёт по его первой колонке)
+CREATE INDEX IF NOT EXISTS ix_mappings_order_search ON mappings(order_number, provider, status, created_at);
+DROP INDEX IF EXISTS ix_mappings_order_number;
+CREATE INDEX IF NOT EXISTS ix_mappings_provider_status ON mappings(provider, status, created_at);
+CREATE INDEX IF NOT EXISTS ix_mappings_provider_created ON mappings(provider, created_at);
+CREATE INDEX IF NOT EXISTS ix_mappings_status_created ON mappings(status, created_at);
+'''
+
+
+@asynccontextmanager
+async def _connect(op: str, critical: bool = False):
+    # op — имя хелпера, метка для gateway_db_call_seconds.
+    # critical — запись итогов уже сделанной работы (маппинг после pay, статус, логи, ответ для идемпотентности):
+    # её не бросаем по дедлайну. Остальное ждёт блокировку не дольше остатка бюджета и не начинается без него.
+    busy_timeout = BUSY_TIMEOUT_SEC if critical else cap(BUSY_TIMEOUT_SEC, "db")
+    t0 = time.perf_counter()
+    with span(f"db.{op}"):
+        async with aiosqlite.connect(DB_FILE, timeout=busy_timeout) as db:
+            yield db
+    DB_CALL_SECONDS.labels(op).observe(time.perf_counter() - t0)
+
+
+async def _commit(db: aiosqlite.Connection, op: str) -> None:
+    t0 = time.perf_counter()
+    await db.commit()
+    DB_COMMIT_SECONDS.labels(op).observe(time.perf_counter() - t0)
 
 
 async def init_db():
     Path("./data").mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with aiosqlite.connect(DB_FILE, timeout=BUSY_TIMEOUT_SEC) as db:
+        # WAL хранится в самом файле БД: читатели не блокируют писателя, воркеры пишут по очереди
+        await db.execute("PRAGMA journal_mode=WAL;")
         # Выполним все стейтменты по одному
         for stmt in INIT_SQL.strip().split(';'):
             s = stmt.strip()
             if s:
                 await db.execute(s + ';')
+        for table, column, decl in COLUMN_MIGRATIONS:
+            async with db.execute(f"PRAGMA table_info({table})") as cur:
+                existing = {r[1] for r in await cur.fetchall()}
+            if column not in existing:
+                await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        await db.executescript(POST_MIGRATION_SQL)
         await db.commit()
 
 
@@ -37,53 +192,55 @@ async def upsert_mapping(
     provider_operation_id: str | None = None,
     status: str | None = None,
     order_number: str | None = None,
+    amount: int | None = None,
+    currency: str | None = None,
+    method: str | None = None,
 ):
-    async with aiosqlite.connect(DB_FILE) as db:
+    now = time.time()
+    async with _connect("upsert_mapping", critical=True) as db:
         await db.execute(
             """
-            INSERT INTO mappings (rp_token, order_number, provider, provider_operation_id, callback_url, status)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO mappings (rp_token, order_number, provider, provider_operation_id, callback_url, status,
+                                  amount, currency, method, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(rp_token) DO UPDATE SET
               order_number=COALESCE(excluded.order_number, mappings.order_number),
               provider=excluded.provider,
               provider_operation_id=COALESCE(excluded.provider_operation_id, mappings.provider_operation_id),
               callback_url=excluded.callback_url,
-              status=COALESCE(excluded.status, mappings.status)
+              status=COALESCE(excluded.status, mappings.status),
+              amount=COALESCE(excluded.amount, mappings.amount),
+              currency=COALESCE(excluded.currency, mappings.currency),
+              method=COALESCE(excluded.method, mappings.method),
+              updated_at=excluded.updated_at
             """,
-            (rp_token, order_number, provider, provider_operation_id, callback_url, status)
+            (rp_token, order_number, provider, provider_operation_id, callback_url, status, amount, currency, method,
+             now, now)
         )
-        await db.commit()
+        await _commit(db, "upsert_mapping")
+    # прежние алиасы (сменившийся operation id) снимаются по записи, найденной в кэше под новыми
+    cache.invalidate(rp_token, order_number, provider_operation_id)
 
 
 async def get_mapping_by_token_any(key: str):
     """
     Универсальный поиск: сначала по rp_token (RP token),
-    если не нашли — по order_number (merchant).
+    если не нашли — по order_number (merchant), затем по provider_operation_id (gateway_token).
+    Горячие маппинги отдаёт общий кэш воркеров (app/shmcache.py), найденное в БД кладётся туда под всеми алиасами.
     """
-    async with aiosqlite.connect(DB_FILE) as db:
-        # rp_token
-        async with db.execute(
-            "SELECT rp_token, order_number, provider, provider_operation_id, callback_url, status FROM mappings WHERE rp_token = ?",
-            (key,)
-        ) as cur:
-            row = await cur.fetchone()
+    mapping = cache.get(key)
+    if mapping is not None:
+        return mapping
+    async with _connect("get_mapping_by_token_any") as db:
+        for column in ("rp_token", "order_number", "provider_operation_id"):
+            async with db.execute(
+                "SELECT rp_token, order_number, provider, provider_operation_id, callback_url, status "
+                f"FROM mappings WHERE {column} = ? LIMIT 1",
+                (key,)
+            ) as cur:
+                row = await cur.fetchone()
             if row:
-                return {
-                    "rp_token": row[0],
-                    "order_number": row[1],
-                    "provider": row[2],
-                    "provider_operation_id": row[3],
-                    "callback_url": row[4],
-                    "status": row[5],
-                }
-        # order_number
-        async with db.execute(
-            "SELECT rp_token, order_number, provider, provider_operation_id, callback_url, status FROM mappings WHERE order_number = ?",
-            (key,)
-        ) as cur:
-            row = await cur.fetchone()
-            if row:
-                return {
+                mapping = {
                     "rp_token": row[0],
                     "order_number": row[1],
                     "provider": row[2],
@@ -91,13 +248,772 @@ async def get_mapping_by_token_any(key: str):
                     "callback_url": row[4],
                     "status": row[5],
                 }
+                cache.put(mapping)
+                return mapping
     return None
 
 
 async def update_status_by_token_any(key: str, status: str):
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _connect("update_status_by_token_any", critical=True) as db:
         # Обновим по rp_token, если не зацепили — по order_number
-        await db.execute("UPDATE mappings SET status=? WHERE rp_token=?", (status, key))
-        await db.execute("UPDATE mappings SET status=? WHERE order_number=?", (status, key))
-        await db.commit()
+        now = time.time()
+        await db.execute("UPDATE mappings SET status=?, updated_at=? WHERE rp_token=?", (status, now, key))
+        await db.execute("UPDATE mappings SET status=?, updated_at=? WHERE order_number=?", (status, now, key))
+        await _commit(db, "update_status_by_token_any")
+        # алиасы обновлённых строк — из БД: в кэше под key записи может уже не быть, а под другим алиасом — остаться
+        async with db.execute(
+            "SELECT rp_token, order_number, provider_operation_id FROM mappings WHERE rp_token=? "
+            "UNION SELECT rp_token, order_number, provider_operation_id FROM mappings WHERE order_number=?",
+            (key, key)
+        ) as cur:
+            rows = await cur.fetchall()
+    cache.invalidate(key)
+    cache.forget({"rp_token": r[0], "order_number": r[1], "provider_operation_id": r[2]} for r in rows)
+
+
+async def compare_and_set_status(rp_token: str, expected: str | None, status: str) -> Optional[Dict[str, Any]]:
+    """
+    Пишет статус, только если в БД всё ещё expected (см. app/txstatus.py). Возвращает created_at, method и amount
+    обновлённой строки (для аналитики переходов) или None — статус успели сменить.
+    """
+    async with _connect("compare_and_set_status", critical=True) as db:
+        async with db.execute(
+            "UPDATE mappings SET status=?, updated_at=? WHERE rp_token=? AND status IS ? "
+            "RETURNING created_at, method, amount",
+            (status, time.time(), rp_token, expected)
+        ) as cur:
+            rows = await cur.fetchall()
+        await _commit(db, "compare_and_set_status")
+    cache.invalidate(rp_token)
+    if not rows:
+        return None
+    return {"created_at": rows[0][0], "method": rows[0][1], "amount": rows[0][2]}
+
+
+MAPPING_EXPORT_COLUMNS = (
+    "id", "rp_token", "order_number", "provider", "provider_operation_id", "status", "created_at", "updated_at"
+)
+
+
+async def iter_mappings(
+    since: float,
+    until: float,
+    provider: Optional[str] = None,
+    status: Optional[str] = None,
+    page_size: int = 1000,
+) -> AsyncIterator[List[Tuple]]:
+    """
+    Страницы маппингов с since <= created_at < until в порядке (created_at, id), не больше page_size строк.
+    Keyset по индексу ix_mappings_created_at: каждая страница — короткий запрос от последнего ключа,
+    без OFFSET и без долгой транзакции чтения, так что писателей и чекпоинты WAL экспорт не держит.
+    """
+    where = "created_at >= ? AND created_at < ?"
+    params: List[Any] = [since, until]
+    if provider:
+        where += " AND provider = ?"
+        params.append(provider)
+    if status:
+        where += " AND status = ?"
+        params.append(status)
+    sql = (
+        f"SELECT {', '.join(MAPPING_EXPORT_COLUMNS)} FROM mappings "
+        f"WHERE {where} AND (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?"
+    )
+    last: Tuple[float, int] = (since, -1)
+    async with _connect("iter_mappings") as db:
+        while True:
+            async with db.execute(sql, (*params, *last, page_size)) as cur:
+                page = await cur.fetchall()
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            last = (page[-1][6], page[-1][0])
+
+
+SEARCH_COLUMNS = (
+    "id", "rp_token", "order_number", "provider", "provider_operation_id", "status", "amount", "currency", "method",
+    "created_at", "updated_at",
+)
+
+
+def _prefix_end(prefix: str) -> Optional[str]:
+    # наименьшая строка больше всех, начинающихся с prefix (BINARY-сравнение): последний символ + 1.
+    # U+10FFFF увеличить нельзя — отбрасываем его и увеличиваем предыдущий; все такие — верхней границы нет (None).
+    # Суррогаты (U+D800..U+DFFF) не кодируются в UTF-8: после U+D7FF следует U+E000
+    while prefix and prefix[-1] == "\U0010ffff":
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+
+async def search_mappings(
+    order_prefix: Optional[str] = None,
+    provider: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    after: Optional[Tuple[Any, int]] = None,
+    limit: int = 50,
+) -> Tuple[str, List[Tuple]]:
+    """
+    Страница поиска маппингов для админки: (порядок, строки SEARCH_COLUMNS), не больше limit строк.
+    С order_prefix — по возрастанию (order_number, id), иначе — новые сначала, по убыванию (created_at, id).
+    after — ключ последней строки прошлой страницы в этом порядке (keyset, без OFFSET): его значение становится
+    границей диапазона по первой колонке сортировки, так что индекс читается с места курсора, а не с начала
+    префикса или окна; сравнение (значение, id) лишь отсекает уже отданные строки с тем же значением.
+    Индекс задан явно (INDEXED BY): фильтры проверяются по нему, и запрос, который не может им воспользоваться,
+    падает, а не превращается в скан таблицы.
+    """
+    where: List[str] = []
+    params: List[Any] = []
+    if order_prefix:
+        order, index = "order_number", "ix_mappings_order_search"
+        where.append("order_number >= ?")
+        params.append(after[0] if after is not None else order_prefix)
+        end = _prefix_end(order_prefix)
+        if end is not None:
+            where.append("order_number < ?")
+            params.append(end)
+    elif provider and status:
+        order, index = "created_at", "ix_mappings_provider_status"
+    elif provider:
+        order, index = "created_at", "ix_mappings_provider_created"
+    elif status:
+        order, index = "created_at", "ix_mappings_status_created"
+    else:
+        order, index = "created_at", "ix_mappings_created_at"
+    if provider:
+        where.append("provider = ?")
+        params.append(provider)
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if since is not None:
+        where.append("created_at >= ?")
+        params.append(since)
+    if after is not None and order == "created_at":
+        # строка курсора прошла фильтр until, так что граница курсора его уже включает
+        where.append("created_at <= ?")
+        params.append(after[0])
+    elif until is not None:
+        where.append("created_at < ?")
+        params.append(until)
+    direction, cmp = ("ASC", ">") if order == "order_number" else ("DESC", "<")
+    if after is not None:
+        where.append(f"({order}, id) {cmp} (?, ?)")
+        params += list(after)
+    sql = (
+        f"SELECT {', '.join(SEARCH_COLUMNS)} FROM mappings INDEXED BY {index} "
+        f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY {order} {direction}, id {direction} LIMIT ?"
+    )
+    async with _connect("search_mappings") as db:
+        async with db.execute(sql, (*params, limit)) as cur:
+            rows = await cur.fetchall()
+    return order, rows
+
+
+MAPPING_COLUMNS = "rp_token, order_number, provider, provider_operation_id, callback_url, status, amount, currency"
+
+
+def _mapping_row(r) -> Dict[str, Any]:
+    return {
+        "rp_token": r[0],
+        "order_number": r[1],
+        "provider": r[2],
+        "provider_operation_id": r[3],
+        "callback_url": r[4],
+        "status": r[5],
+        "amount": r[6],
+        "currency": r[7],
+    }
+
+
+async def bulk_update_status(items: List[Tuple[str, str]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    items: (rp_token или order_number, новый статус). Всё — одной транзакцией через временную таблицу:
+    UPDATE по rp_token, затем по order_number (как update_status_by_token_any, но на весь пакет сразу).
+    Возвращает (обновлённые маппинги, ключи без маппинга).
+    """
+    now = time.time()
+    async with _connect("bulk_update_status", critical=True) as db:
+        await db.execute("CREATE TEMP TABLE bulk_status (key TEXT PRIMARY KEY, status TEXT NOT NULL)")
+        # повтор ключа в пакете — побеждает последний, как при последовательных вызовах
+        await db.executemany("INSERT OR REPLACE INTO temp.bulk_status (key, status) VALUES (?, ?)", items)
+        await db.execute(
+            "UPDATE mappings SET status = (SELECT b.status FROM temp.bulk_status b WHERE b.key = mappings.rp_token), "
+            "updated_at = ? WHERE rp_token IN (SELECT key FROM temp.bulk_status)",
+            (now,)
+        )
+        await db.execute(
+            "UPDATE mappings SET status = (SELECT b.status FROM temp.bulk_status b WHERE b.key = mappings.order_number), "
+            "updated_at = ? WHERE order_number IN (SELECT key FROM temp.bulk_status) "
+            "AND rp_token NOT IN (SELECT key FROM temp.bulk_status)",
+            (now,)
+        )
+        async with db.execute(
+            f"SELECT {MAPPING_COLUMNS} FROM mappings WHERE rp_token IN (SELECT key FROM temp.bulk_status) "
+            f"UNION SELECT {MAPPING_COLUMNS} FROM mappings WHERE order_number IN (SELECT key FROM temp.bulk_status)"
+        ) as cur:
+            updated = [_mapping_row(r) for r in await cur.fetchall()]
+        async with db.execute(
+            "SELECT key FROM temp.bulk_status b WHERE NOT EXISTS (SELECT 1 FROM mappings m WHERE m.rp_token = b.key) "
+            "AND NOT EXISTS (SELECT 1 FROM mappings m WHERE m.order_number = b.key)"
+        ) as cur:
+            not_found = [r[0] for r in await cur.fetchall()]
+        await _commit(db, "bulk_update_status")
+    cache.forget(updated)
+    return updated, not_found
+
+
+# ---------- сверка с реестрами провайдера ----------
+
+SETTLEMENT_SQL = '''
+CREATE TEMP TABLE IF NOT EXISTS settlement (
+    line INTEGER PRIMARY KEY,               -- номер записи в файле реестра
+    op_id TEXT,
+    order_number TEXT,
+    status TEXT,
+    amount TEXT,
+    currency TEXT,
+    mapping_id INTEGER                      -- заполняет match_settlement
+);
+CREATE TEMP TABLE IF NOT EXISTS settlement_corrections (
+    mapping_id INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,                   -- статус провайдера из реестра
+    result TEXT NOT NULL                    -- он же в терминах RP (approved | declined | ...)
+);
+'''
+
+
+@asynccontextmanager
+async def settlement_session():
+    """Одно соединение на всю сверку: реестр лежит во временной таблице этого соединения."""
+    async with _connect("settlement") as db:
+        await db.executescript(SETTLEMENT_SQL)
+        yield db
+
+
+async def load_settlement(db: aiosqlite.Connection, rows: List[Tuple]) -> None:
+    """rows: (line, op_id, order_number, status, amount, currency) — пачка реестра."""
+    await db.executemany(
+        "INSERT INTO temp.settlement (line, op_id, order_number, status, amount, currency) VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    await _commit(db, "load_settlement")
+
+
+async def match_settlement(db: aiosqlite.Connection, provider: str) -> None:
+    """
+    Привязка реестра к маппингам двумя UPDATE внутри SQLite (индексы по provider_operation_id и order_number):
+    сначала по id операции провайдера, для непривязанных — по номеру заказа.
+    """
+    t0 = time.perf_counter()
+    with span("db.match_settlement"):
+        await db.execute(
+            "UPDATE temp.settlement SET mapping_id = ("
+            "  SELECT m.id FROM mappings m WHERE m.provider_operation_id = settlement.op_id AND m.provider = ?"
+            ") WHERE op_id IS NOT NULL",
+            (provider,)
+        )
+        await db.execute(
+            "UPDATE temp.settlement SET mapping_id = ("
+            "  SELECT m.id FROM mappings m WHERE m.order_number = settlement.order_number AND m.provider = ?"
+            ") WHERE mapping_id IS NULL AND order_number IS NOT NULL",
+            (provider,)
+        )
+        await db.execute("CREATE INDEX IF NOT EXISTS temp.ix_settlement_mapping_id ON settlement(mapping_id)")
+        await _commit(db, "match_settlement")
+    DB_CALL_SECONDS.labels("match_settlement").observe(time.perf_counter() - t0)
+
+
+SETTLEMENT_MATCH_COLUMNS = (
+    "line", "op_id", "order_number", "status", "amount", "currency",
+    "mapping_id", "rp_token", "gw_order_number", "gw_op_id", "gw_status", "gw_amount", "gw_currency",
+)
+
+
+async def iter_settlement_matches(db: aiosqlite.Connection, page_size: int) -> AsyncIterator[List[Tuple]]:
+    """Строки реестра с привязанным маппингом (или NULL-ами), страницами в порядке файла."""
+    after = 0
+    while True:
+        async with db.execute(
+            "SELECT s.line, s.op_id, s.order_number, s.status, s.amount, s.currency, "
+            "       m.id, m.rp_token, m.order_number, m.provider_operation_id, m.status, m.amount, m.currency "
+            "FROM temp.settlement s LEFT JOIN mappings m ON m.id = s.mapping_id "
+            "WHERE s.line > ? ORDER BY s.line LIMIT ?",
+            (after, page_size)
+        ) as cur:
+            page = await cur.fetchall()
+        if not page:
+            return
+        yield page
+        after = page[-1][0]
+
+
+async def iter_unsettled_mappings(
+    db: aiosqlite.Connection, provider: str, since: float, until: float, page_size: int
+) -> AsyncIterator[List[Tuple]]:
+    """Маппинги провайдера за период (по created_at), которых нет в реестре: (id, rp_token, order_number, op_id, status)."""
+    after: Tuple[float, int] = (since, -1)
+    while True:
+        async with db.execute(
+            "SELECT m.id, m.rp_token, m.order_number, m.provider_operation_id, m.status, m.created_at FROM mappings m "
+            "WHERE m.created_at >= ? AND m.created_at < ? AND (m.created_at, m.id) > (?, ?) AND m.provider = ? "
+            "AND NOT EXISTS (SELECT 1 FROM temp.settlement s WHERE s.mapping_id = m.id) "
+            "ORDER BY m.created_at, m.id LIMIT ?",
+            (since, until, *after, provider, page_size)
+        ) as cur:
+            page = await cur.fetchall()
+        if not page:
+            return
+        yield page
+        after = (page[-1][5], page[-1][0])
+
+
+async def add_settlement_corrections(db: aiosqlite.Connection, rows: List[Tuple[int, str, str]]) -> None:
+    """rows: (mapping_id, статус провайдера, результат RP)."""
+    await db.executemany(
+        "INSERT OR REPLACE INTO temp.settlement_corrections (mapping_id, status, result) VALUES (?, ?, ?)",
+        rows,
+    )
+    await _commit(db, "add_settlement_corrections")
+
+
+async def apply_settlement_corrections(db: aiosqlite.Connection) -> int:
+    """Все исправления статусов — одним UPDATE в одной транзакции. Возвращает число обновлённых маппингов."""
+    async with db.execute(
+        "UPDATE mappings SET "
+        "  status = (SELECT c.status FROM temp.settlement_corrections c WHERE c.mapping_id = mappings.id), "
+        "  updated_at = ? "
+        "WHERE id IN (SELECT mapping_id FROM temp.settlement_corrections) "
+        "RETURNING rp_token, order_number, provider_operation_id",
+        (time.time(),)
+    ) as cur:
+        updated = [
+            {"rp_token": r[0], "order_number": r[1], "provider_operation_id": r[2]}
+            for r in await cur.fetchall()
+        ]
+    await _commit(db, "apply_settlement_corrections")
+    # как в bulk_update_status: иначе общий кэш отдаёт прежний статус до истечения TTL
+    cache.forget(updated)
+    return len(updated)
+
+
+async def iter_settlement_corrections(db: aiosqlite.Connection, page_size: int) -> AsyncIterator[List[Tuple]]:
+    """Исправленные маппинги для коллбэков: (mapping_id, result, callback_url, provider_operation_id)."""
+    after = -1
+    while True:
+        async with db.execute(
+            "SELECT c.mapping_id, c.result, m.callback_url, m.provider_operation_id "
+            "FROM temp.settlement_corrections c JOIN mappings m ON m.id = c.mapping_id "
+            "WHERE c.mapping_id > ? ORDER BY c.mapping_id LIMIT ?",
+            (after, page_size)
+        ) as cur:
+            page = await cur.fetchall()
+        if not page:
+            return
+        yield page
+        after = page[-1][0]
+
+
+# ---------- provider logs ----------
+
+async def insert_provider_logs(rows: Iterable[Tuple[str, str, str | None, int | None, float, bytes]]) -> List[int]:
+    """
+    rows: (rp_token, provider, kind, status_code, created_at, body).
+    Возвращает id вставленных записей в том же порядке.
+    """
+    ids: List[int] = []
+    async with _connect("insert_provider_logs", critical=True) as db:
+        for row in rows:
+            cur = await db.execute(
+                "INSERT INTO provider_logs (rp_token, provider, kind, status_code, created_at, body) VALUES (?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            ids.append(cur.lastrowid)
+        await _commit(db, "insert_provider_logs")
+    return ids
+
+
+async def get_provider_logs(rp_token: str) -> List[Dict[str, Any]]:
+    async with _connect("get_provider_logs") as db:
+        async with db.execute(
+            "SELECT id, provider, kind, status_code, created_at, body FROM provider_logs WHERE rp_token = ? ORDER BY id",
+            (rp_token,)
+        ) as cur:
+            rows = await cur.fetchall()
+    return [
+        {
+            "id": r[0],
+            "provider": r[1],
+            "kind": r[2],
+            "status_code": r[3],
+            "created_at": r[4],
+            "body": r[5],
+        }
+        for r in rows
+    ]
+
+
+async def prune_provider_logs(older_than: float, max_rows: int) -> None:
+    """Удаляет логи старше older_than и всё, что не влезает в max_rows последних записей."""
+    async with _connect("prune_provider_logs") as db:
+        await db.execute("DELETE FROM provider_logs WHERE created_at < ?", (older_than,))
+        await db.execute(
+            "DELETE FROM provider_logs WHERE id <= (SELECT MAX(id) FROM provider_logs) - ?",
+            (max_rows,)
+        )
+        await _commit(db, "prune_provider_logs")
+
+
+# ---------- pay idempotency ----------
+
+async def get_pay_response(rp_token: str):
+    async with _connect("get_pay_response") as db:
+        async with db.execute(
+            "SELECT fingerprint, created_at, body FROM pay_responses WHERE rp_token = ?",
+            (rp_token,)
+        ) as cur:
+            row = await cur.fetchone()
+    if not row:
+        return None
+    return {"fingerprint": row[0], "created_at": row[1], "body": row[2]}
+
+
+async def save_pay_response(rp_token: str, fingerprint: str, created_at: float, body: bytes) -> None:
+    async with _connect("save_pay_response", critical=True) as db:
+        await db.execute(
+            """
+            INSERT INTO pay_responses (rp_token, fingerprint, created_at, body) VALUES (?, ?, ?, ?)
+            ON CONFLICT(rp_token) DO UPDATE SET
+              fingerprint=excluded.fingerprint,
+              created_at=excluded.created_at,
+              body=excluded.body
+            """,
+            (rp_token, fingerprint, created_at, body)
+        )
+        await _commit(db, "save_pay_response")
+
+
+async def prune_pay_responses(older_than: float) -> None:
+    async with _connect("prune_pay_responses") as db:
+        await db.execute("DELETE FROM pay_responses WHERE created_at < ?", (older_than,))
+        await _commit(db, "prune_pay_responses")
+
+
+async def get_status_snapshot(rp_token: str):
+    async with _connect("get_status_snapshot") as db:
+        async with db.execute(
+            "SELECT provider, captured_at, status, provider_status, amount, currency, requisites, qr "
+            "FROM status_snapshots WHERE rp_token = ?",
+            (rp_token,)
+        ) as cur:
+            row = await cur.fetchone()
+    if not row:
+        return None
+    return {
+        "provider": row[0],
+        "captured_at": row[1],
+        "status": row[2],
+        "provider_status": row[3],
+        "amount": row[4],
+        "currency": row[5],
+        "requisites": row[6],
+        "qr": row[7],
+    }
+
+
+async def save_status_snapshot(
+    rp_token: str,
+    provider: str,
+    captured_at: float,
+    status: str,
+    provider_status: str | None,
+    amount: Any,
+    currency: str | None,
+    requisites: bytes | None,
+    qr: str | None,
+) -> None:
+    async with _connect("save_status_snapshot") as db:
+        await db.execute(
+            """
+            INSERT INTO status_snapshots (rp_token, provider, captured_at, status, provider_status, amount, currency,
+                                          requisites, qr)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(rp_token) DO UPDATE SET
+              provider=excluded.provider,
+              captured_at=excluded.captured_at,
+              status=excluded.status,
+              provider_status=excluded.provider_status,
+              amount=COALESCE(excluded.amount, status_snapshots.amount),
+              currency=COALESCE(excluded.currency, status_snapshots.currency),
+              requisites=COALESCE(excluded.requisites, status_snapshots.requisites),
+              qr=COALESCE(excluded.qr, status_snapshots.qr)
+            WHERE excluded.captured_at >= status_snapshots.captured_at
+            """,
+            (rp_token, provider, captured_at, status, provider_status, amount, currency, requisites, qr)
+        )
+        await _commit(db, "save_status_snapshot")
+
+
+async def prune_status_snapshots(older_than: float) -> None:
+    async with _connect("prune_status_snapshots") as db:
+        await db.execute("DELETE FROM status_snapshots WHERE captured_at < ?", (older_than,))
+        await _commit(db, "prune_status_snapshots")
+
+
+# ---------- payout batches ----------
+
+PAYOUT_ITEM_COLUMNS = "seq, idempotency_key, provider, payload, status, result_status, result"
+
+
+def _payout_item_row(r) -> Dict[str, Any]:
+    return {
+        "seq": r[0],
+        "idempotency_key": r[1],
+        "provider": r[2],
+        "payload": r[3],
+        "status": r[4],
+        "result_status": r[5],
+        "result": r[6],
+    }
+
+
+async def insert_payout_batch(
+    batch_id: str,
+    created_at: float,
+    owner: str,
+    items: List[Tuple[int, str, str, str]],
+) -> None:
+    """items: (seq, idempotency_key, provider, payload_json) — всё в одной транзакции."""
+    async with _connect("insert_payout_batch") as db:
+        await db.execute(
+            "INSERT INTO payout_batches (id, created_at, status, total, owner, heartbeat_at) VALUES (?, ?, 'running', ?, ?, ?)",
+            (batch_id, created_at, len(items), owner, created_at)
+        )
+        await db.executemany(
+            "INSERT INTO payout_items (batch_id, seq, idempotency_key, provider, payload, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+            [(batch_id, seq, key, provider, payload, created_at) for seq, key, provider, payload in items]
+        )
+        await _commit(db, "insert_payout_batch")
+
+
+async def get_payout_batch(batch_id: str):
+    async with _connect("get_payout_batch") as db:
+        async with db.execute(
+            "SELECT id, created_at, status, total, owner, heartbeat_at FROM payout_batches WHERE id = ?",
+            (batch_id,)
+        ) as cur:
+            row = await cur.fetchone()
+        if not row:
+            return None
+        async with db.execute(
+            "SELECT status, COUNT(*) FROM payout_items WHERE batch_id = ? GROUP BY status",
+            (batch_id,)
+        ) as cur:
+            counts = {r[0]: r[1] for r in await cur.fetchall()}
+    return {
+        "batch_id": row[0],
+        "created_at": row[1],
+        "status": row[2],
+        "total": row[3],
+        "owner": row[4],
+        "heartbeat_at": row[5],
+        "items": counts,
+    }
+
+
+async def fetch_unfinished_payout_items(batch_id: str, after_seq: int, limit: int) -> List[Dict[str, Any]]:
+    async with _connect("fetch_unfinished_payout_items") as db:
+        async with db.execute(
+            f"SELECT {PAYOUT_ITEM_COLUMNS} FROM payout_items "
+            "WHERE batch_id = ? AND status IN ('queued', 'sent') AND seq > ? ORDER BY seq LIMIT ?",
+            (batch_id, after_seq, limit)
+        ) as cur:
+            return [_payout_item_row(r) for r in await cur.fetchall()]
+
+
+async def fetch_payout_items(batch_id: str, after_seq: int, limit: int) -> List[Dict[str, Any]]:
+    async with _connect("fetch_payout_items") as db:
+        async with db.execute(
+            f"SELECT {PAYOUT_ITEM_COLUMNS} FROM payout_items WHERE batch_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (batch_id, after_seq, limit)
+        ) as cur:
+            return [_payout_item_row(r) for r in await cur.fetchall()]
+
+
+async def mark_payout_items_sent(batch_id: str, seqs: List[int], now: float) -> None:
+    async with _connect("mark_payout_items_sent") as db:
+        await db.executemany(
+            "UPDATE payout_items SET status='sent', updated_at=? WHERE batch_id=? AND seq=? AND status='queued'",
+            [(now, batch_id, seq) for seq in seqs]
+        )
+        await _commit(db, "mark_payout_items_sent")
+
+
+async def save_payout_results(rows: List[Tuple[str, str, str, float, str, int]]) -> None:
+    """rows: (status, result_status, result_json, updated_at, batch_id, seq) — одной транзакцией."""
+    async with _connect("save_payout_results") as db:
+        await db.executemany(
+            "UPDATE payout_items SET status=?, result_status=?, result=?, updated_at=? WHERE batch_id=? AND seq=?",
+            rows
+        )
+        await _commit(db, "save_payout_results")
+
+
+async def claim_payout_batch(batch_id: str, owner: str, now: float, stale_before: float) -> bool:
+    """Забирает пакет, если его владелец перестал обновлять heartbeat (упал/перезапущен)."""
+    async with _connect("claim_payout_batch") as db:
+        cur = await db.execute(
+            "UPDATE payout_batches SET owner=?, heartbeat_at=? "
+            "WHERE id=? AND status='running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+            (owner, now, batch_id, stale_before)
+        )
+        await _commit(db, "claim_payout_batch")
+        return cur.rowcount == 1
+
+
+async def list_stale_payout_batches(stale_before: float) -> List[str]:
+    async with _connect("list_stale_payout_batches") as db:
+        async with db.execute(
+            "SELECT id FROM payout_batches WHERE status='running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+            (stale_before,)
+        ) as cur:
+            return [r[0] for r in await cur.fetchall()]
+
+
+async def heartbeat_payout_batch(batch_id: str, owner: str, now: float) -> bool:
+    """False — пакет уже не наш (забрал другой процесс) или больше не running."""
+    async with _connect("heartbeat_payout_batch") as db:
+        cur = await db.execute(
+            "UPDATE payout_batches SET heartbeat_at=? WHERE id=? AND owner=? AND status='running'",
+            (now, batch_id, owner)
+        )
+        await _commit(db, "heartbeat_payout_batch")
+        return cur.rowcount == 1
+
+
+async def finish_payout_batch(batch_id: str, owner: str) -> None:
+    async with _connect("finish_payout_batch") as db:
+        await db.execute(
+            "UPDATE payout_batches SET status='done' WHERE id=? AND owner=?",
+            (batch_id, owner)
+        )
+        await _commit(db, "finish_payout_batch")
+
+
+# ---------- фоновые задания админки ----------
+
+async def insert_admin_job(job_id: str, kind: str, created_at: float, progress: str) -> None:
+    async with _connect("insert_admin_job") as db:
+        await db.execute(
+            "INSERT INTO admin_jobs (id, kind, status, created_at, updated_at, progress) VALUES (?, ?, 'running', ?, ?, ?)",
+            (job_id, kind, created_at, created_at, progress)
+        )
+        await _commit(db, "insert_admin_job")
+
+
+async def update_admin_jobs(rows: List[Tuple[str, str, float, str]]) -> None:
+    """rows: (status, progress, updated_at, id) — прогресс всех изменившихся заданий одной транзакцией."""
+    async with _connect("update_admin_jobs", critical=True) as db:
+        await db.executemany("UPDATE admin_jobs SET status=?, progress=?, updated_at=? WHERE id=?", rows)
+        await _commit(db, "update_admin_jobs")
+
+
+async def get_admin_job(job_id: str):
+    async with _connect("get_admin_job") as db:
+        async with db.execute(
+            "SELECT id, kind, status, created_at, updated_at, progress FROM admin_jobs WHERE id = ?",
+            (job_id,)
+        ) as cur:
+            row = await cur.fetchone()
+    if not row:
+        return None
+    return {"job_id": row[0], "kind": row[1], "status": row[2], "created_at": row[3], "updated_at": row[4], "progress": row[5]}
+
+
+# ---------- операционная аналитика ----------
+
+async def add_analytics(
+    counts: List[Tuple[int, str, str, int, int, int, int, int, int, float, int]],
+    latency: List[Tuple[int, str, str, int, int]],
+) -> None:
+    """
+    Прибавляет приращения воркера к часовым агрегатам одной транзакцией.
+    counts: (hour, provider, method, created, approved, declined, refunded, volume, approved_volume, latency_sum,
+    latency_count); latency: (hour, provider, method, bucket, count).
+    """
+    async with _connect("add_analytics", critical=True) as db:
+        await db.executemany(
+            """
+            INSERT INTO analytics_hourly (hour, provider, method, created, approved, declined, refunded, volume,
+                                          approved_volume, latency_sum, latency_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(hour, provider, method) DO UPDATE SET
+              created=created + excluded.created,
+              approved=approved + excluded.approved,
+              declined=declined + excluded.declined,
+              refunded=refunded + excluded.refunded,
+              volume=volume + excluded.volume,
+              approved_volume=approved_volume + excluded.approved_volume,
+              latency_sum=latency_sum + excluded.latency_sum,
+              latency_count=latency_count + excluded.latency_count
+            """,
+            counts
+        )
+        await db.executemany(
+            """
+            INSERT INTO analytics_latency (hour, provider, method, bucket, count) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(hour, provider, method, bucket) DO UPDATE SET count=count + excluded.count
+            """,
+            latency
+        )
+        await _commit(db, "add_analytics")
+
+
+ANALYTICS_COLUMNS = (
+    "hour", "provider", "method", "created", "approved", "declined", "refunded", "volume", "approved_volume",
+    "latency_sum", "latency_count",
+)
+
+
+async def get_analytics(
+    since_hour: int, provider: Optional[str] = None, method: Optional[str] = None
+) -> Tuple[List[Tuple], List[Tuple]]:
+    """
+    Часовые агрегаты с hour >= since_hour и их корзины задержки. Размер ответа — часы × провайдеры × методы,
+    от числа транзакций не зависит (читаются только analytics_*, по первичному ключу).
+    """
+    where = "hour >= ?"
+    params: List[Any] = [since_hour]
+    if provider:
+        where += " AND provider = ?"
+        params.append(provider)
+    if method is not None:
+        where += " AND method = ?"
+        params.append(method)
+    async with _connect("get_analytics") as db:
+        async with db.execute(
+            f"SELECT {', '.join(ANALYTICS_COLUMNS)} FROM analytics_hourly WHERE {where} ORDER BY hour, provider, method",
+            params
+        ) as cur:
+            counts = await cur.fetchall()
+        async with db.execute(
+            f"SELECT hour, provider, method, bucket, count FROM analytics_latency WHERE {where}", params
+        ) as cur:
+            latency = await cur.fetchall()
+    return counts, latency
+
 
+async def prune_analytics(older_than_hour: int) -> None:
+    async with _connect("prune_analytics") as db:
+        await db.execute("DELETE FROM analytics_hourly WHERE hour < ?", (older_than_hour,))
+        await db.execute("DELETE FROM analytics_latency WHERE hour < ?", (older_than_hour,))
+        await _commit(db, "prune_analytics")
@@ -0,0 +1,113 @@
+# Дедлайн запроса: бюджет времени из заголовка RP или из настроек эндпоинта.
+# Каждый шаг (вызов провайдера, пауза ретрая, ожидание блокировки БД, коллбек) урезает свой таймаут
+# до остатка бюджета, а работу, которая уже не успеет, не начинает — RP всё равно перестал ждать ответ.
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import HTTPException
+from tenacity.stop import stop_base
+
+from .metrics import Counter
+from .settings import settings
+
+HEADER = settings.DEADLINE_HEADER.lower().encode("latin-1")
+RESERVE_SEC = settings.DEADLINE_RESERVE_MS / 1000
+MIN_ATTEMPT_SEC = settings.DEADLINE_MIN_ATTEMPT_MS / 1000
+
+DEADLINE_EXCEEDED = Counter(
+    "gateway_deadline_exceeded_total",
+    "Steps abandoned or cut short because the request deadline ran out",
+    ("stage",),
+)
+
+# time.monotonic() момента, к которому запрос должен быть отвечен; None — без дедлайна
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self, stage: str):
+        DEADLINE_EXCEEDED.labels(stage).inc()
+        super().__init__(status_code=504, detail=f"request deadline exceeded ({stage})")
+
+
+def remaining() -> Optional[float]:
+    """Секунд до дедлайна текущего запроса (может быть <= 0); None — дедлайна нет."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def cap(timeout: float, stage: str) -> float:
+    """
+    Таймаут шага, урезанный до остатка бюджета за вычетом DEADLINE_RESERVE_MS (на сборку ответа).
+    Если времени не осталось — DeadlineExceeded: шаг не начинаем.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    left -= RESERVE_SEC
+    if left <= 0:
+        raise DeadlineExceeded(stage)
+    return min(timeout, left)
+
+
+def detach() -> None:
+    """Фоновая задача, порождённая запросом, живёт дольше него: снимаем унаследованный дедлайн."""
+    _deadline.set(None)
+
+
+class stop_at_deadline(stop_base):
+    """Стоп для tenacity: следующая попытка после паузы wait уже не уложится в бюджет запроса."""
+
+    def __init__(self, wait, stage: str):
+        self.wait = wait
+        self.stage = stage
+
+    def __call__(self, retry_state) -> bool:
+        left = remaining()
+        if left is None:
+            return False
+        if left - RESERVE_SEC - self.wait(retry_state) < MIN_ATTEMPT_SEC:
+            DEADLINE_EXCEEDED.labels(self.stage).inc()
+            return True
+        return False
+
+
+def _budget_sec(scope) -> Optional[float]:
+    budget_ms = settings.DEADLINE_ENDPOINT_MS.get(scope["path"]) or settings.DEADLINE_DEFAULT_MS or None
+    for name, value in scope["headers"]:
+        if name == HEADER:
+            try:
+                requested = int(value)
+            except ValueError:
+                break
+            if requested <= 0:
+                # 0 или отрицательное — бюджет истёк бы до начала работы, 504 на каждый запрос; игнорируем
+                break
+            # RP может только сузить бюджет эндпоинта, но не растянуть его
+            budget_ms = min(requested, budget_ms) if budget_ms else min(requested, settings.DEADLINE_MAX_MS)
+            break
+    return None if budget_ms is None else budget_ms / 1000
+
+
+class DeadlineMiddleware:
+    """ASGI-мидлварь: выставляет дедлайн запроса в contextvar на время обработки."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        budget = _budget_sec(scope)
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+        token = _deadline.set(time.monotonic() + budget)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
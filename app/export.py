@@ -0,0 +1,131 @@
+"""
+Выгрузка маппингов для отчётности: NDJSON или CSV, потоком, с фильтром по дате, провайдеру и статусу.
+
+    python -m app.export --since 2026-10-01 --until 2026-10-02 --provider Brusnika_SBP --status approved \
+        --format csv --gzip -o mappings-2026-10-01.csv.gz
+
+Память постоянна при любом числе строк: из БД читаются страницы по EXPORT_PAGE_SIZE (keyset по created_at, id),
+каждая сразу кодируется и (при --gzip) сжимается в поток. Тот же генератор отдаёт GET /admin/export.
+Интервал полуоткрытый: since <= created_at < until; даты — ISO 8601 (без зоны — UTC) или unix time.
+Строки, записанные до появления created_at, имеют created_at=0 и попадают только в выгрузку с --since 0.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+
+from .settings import settings
+from .db import MAPPING_EXPORT_COLUMNS, iter_mappings
+from .loopmon import run_cpu
+
+FORMATS = ("ndjson", "csv")
+
+_TS_COLUMNS = {MAPPING_EXPORT_COLUMNS.index("created_at"), MAPPING_EXPORT_COLUMNS.index("updated_at")}
+
+
+def parse_time(value: str) -> float:
+    """ISO 8601 дата/время (без зоны — UTC) или unix time в секундах."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    if not ts:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _rows(page: List[Tuple]) -> List[List]:
+    return [[_iso(v) if i in _TS_COLUMNS else v for i, v in enumerate(row)] for row in page]
+
+
+def _encode_ndjson(page: List[Tuple]) -> bytes:
+    lines = [json.dumps(dict(zip(MAPPING_EXPORT_COLUMNS, row)), ensure_ascii=False) for row in _rows(page)]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _encode_csv(page: List[Tuple]) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(_rows(page))
+    return buf.getvalue().encode("utf-8")
+
+
+def _csv_header() -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(MAPPING_EXPORT_COLUMNS)
+    return buf.getvalue().encode("utf-8")
+
+
+async def export_stream(
+    since: float,
+    until: float,
+    provider: Optional[str] = None,
+    status: Optional[str] = None,
+    fmt: str = "ndjson",
+    gzip: bool = False,
+) -> AsyncIterator[bytes]:
+    """Чанки выгрузки: по одному на страницу БД (плюс заголовок CSV и хвост gzip)."""
+    encode = _encode_csv if fmt == "csv" else _encode_ndjson
+    # wbits=31 — формат gzip (заголовок + crc), а не голый zlib: файл открывается gunzip/pandas
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    def _out(chunk: bytes) -> bytes:
+        return gz.compress(chunk) if gz is not None else chunk
+
+    def encode_page(page: List[Tuple]) -> bytes:
+        return _out(encode(page))
+
+    if fmt == "csv":
+        yield _out(_csv_header())
+    async for page in iter_mappings(since, until, provider, status, settings.EXPORT_PAGE_SIZE):
+        chunk = await run_cpu(encode_page, page)
+        if chunk:
+            yield chunk
+    if gz is not None:
+        yield gz.flush()
+
+
+def export_filename(fmt: str, gzip: bool) -> str:
+    return f"mappings.{fmt}" + (".gz" if gzip else "")
+
+
+async def _export_to(out, args: argparse.Namespace) -> None:
+    async for chunk in export_stream(
+        parse_time(args.since), parse_time(args.until), args.provider, args.status, args.format, args.gzip
+    ):
+        out.write(chunk)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.export", description="Stream mappings as NDJSON/CSV")
+    ap.add_argument("--since", required=True, help="начало интервала (ISO 8601 или unix time), включительно")
+    ap.add_argument("--until", required=True, help="конец интервала, не включительно")
+    ap.add_argument("--provider")
+    ap.add_argument("--status")
+    ap.add_argument("--format", choices=FORMATS, default="ndjson")
+    ap.add_argument("--gzip", action="store_true")
+    ap.add_argument("-o", "--output", help="файл; по умолчанию stdout")
+    args = ap.parse_args()
+
+    if args.output:
+        with open(args.output, "wb") as f:
+            asyncio.run(_export_to(f, args))
+    else:
+        asyncio.run(_export_to(sys.stdout.buffer, args))
+        sys.stdout.buffer.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
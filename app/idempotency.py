@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .settings import settings
+from .db import get_pay_response, save_pay_response, prune_pay_responses
+from .deadline import detach
+
+logger = logging.getLogger(__name__)
+
+# Чистим таблицу pay_responses раз в N сохранений
+_PRUNE_EVERY = 500
+
+
+def pay_fingerprint(provider: str, payload: Dict[str, Any]) -> str:
+    """Хэш полей, которые не должны меняться при повторе того же rp_token."""
+    raw = f"{provider}|{payload.get('order_number')}|{payload.get('amount')}|{payload.get('currency')}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _is_final(response: Dict[str, Any]) -> bool:
+    # Запоминаем только ответы, где провайдер реально создал операцию.
+    # Сетевые ошибки (gateway_token=None) не кэшируем — повтор должен сходить к провайдеру снова.
+    return bool(response.get("gateway_token"))
+
+
+class PayReplayCache:
+    """
+    Идемпотентность /pay по rp_token:
+      - финальный ответ провайдера запоминается сразу, как вернулся provider.pay, до записи логов: сбой после
+        вызова провайдера не должен приводить ко второму вызову на повторе;
+      - хранится сериализованная копия (zlib(JSON)) в памяти (LRU + TTL) и в таблице pay_responses (для других
+        воркеров/рестартов), каждый повтор получает свою расшифрованную копию;
+      - повтор с тем же rp_token получает сохранённый ответ без вызова провайдера и без логов (провайдера
+        не вызывали, логи исходного вызова — GET /admin/logs/{token});
+      - конкурентные дубли ждут первый вызов, а не запускают свой.
+    """
+
+    def __init__(self, ttl_sec: int, max_entries: int):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str, bytes]]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[str, asyncio.Task]] = {}
+        self._saved_since_prune = 0
+        self._prune_task: Optional[asyncio.Task] = None
+
+    def _get_local(self, key: str, now: float) -> Optional[Tuple[float, str, bytes]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry[0] > self.ttl_sec:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_local(self, key: str, created_at: float, fingerprint: str, body: bytes) -> None:
+        self._entries[key] = (created_at, fingerprint, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _get_stored(self, key: str, now: float) -> Optional[Tuple[float, str, bytes]]:
+        row = await get_pay_response(key)
+        if not row or now - row["created_at"] > self.ttl_sec:
+            return None
+        self._put_local(key, row["created_at"], row["fingerprint"], row["body"])
+        return row["created_at"], row["fingerprint"], row["body"]
+
+    async def _store(self, key: str, fingerprint: str, body: bytes) -> None:
+        now = time.time()
+        self._put_local(key, now, fingerprint, body)
+        try:
+            await save_pay_response(key, fingerprint, now, body)
+        except Exception as e:
+            # повтор в этот воркер всё равно отдастся из памяти — ответ провайдера важнее записи
+            logger.warning("pay response for %s not stored: %s", key, e)
+            return
+
+        self._saved_since_prune += 1
+        if self._saved_since_prune >= _PRUNE_EVERY and (self._prune_task is None or self._prune_task.done()):
+            self._saved_since_prune = 0
+            self._prune_task = asyncio.ensure_future(self._prune(now - self.ttl_sec))
+
+    @staticmethod
+    async def _prune(older_than: float) -> None:
+        detach()
+        try:
+            await prune_pay_responses(older_than)
+        except Exception as e:
+            logger.warning("pay responses prune failed: %s", e)
+
+    @staticmethod
+    def _check_fingerprint(stored: str, fingerprint: str) -> None:
+        if stored != fingerprint:
+            raise HTTPException(status_code=409, detail="payment.token already used with different payment data")
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        call: Callable[[], Awaitable[Dict[str, Any]]],
+        finish: Optional[Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = None,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Возвращает (ответ, replayed). call — вызов провайдера, finish — доводка ответа первого запроса
+        (запись логов); ответ запоминается между ними.
+        """
+        now = time.time()
+        entry = self._get_local(key, now) or await self._get_stored(key, now)
+        if entry is not None:
+            self._check_fingerprint(entry[1], fingerprint)
+            return _decode(entry[2]), True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._check_fingerprint(inflight[0], fingerprint)
+            # shield: отмена дубля (разрыв соединения RP) не должна рвать вызов первого запроса
+            _response, body = await asyncio.shield(inflight[1])
+            return _decode(body), True
+
+        async def _call_and_store() -> Tuple[Dict[str, Any], bytes]:
+            response = await call()
+            body = _encode({**response, "logs": []})
+            if _is_final(response):
+                await self._store(key, fingerprint, body)
+            if finish is not None:
+                response = await finish(response)
+            return response, body
+
+        task = asyncio.ensure_future(_call_and_store())
+        self._inflight[key] = (fingerprint, task)
+        task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        response, _body = await asyncio.shield(task)
+        return response, False
+
+
+def _encode(response: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(response, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _decode(body: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(body).decode("utf-8"))
+
+
+pay_cache = PayReplayCache(
+    ttl_sec=settings.PAY_IDEMPOTENCY_TTL_SEC,
+    max_entries=settings.PAY_IDEMPOTENCY_MAX_ENTRIES,
+)
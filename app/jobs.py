@@ -0,0 +1,114 @@
+# Фоновые задания админки (массовая смена статусов и т.п.): id + счётчики прогресса.
+# Счётчики живут в памяти воркера, который ведёт задание, и раз в JOBS_FLUSH_SEC (и при завершении) пишутся
+# в admin_jobs — поэтому GET /admin/jobs/{id} отвечает любой воркер.
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from .settings import settings
+from .db import insert_admin_job, update_admin_jobs, get_admin_job
+from .deadline import detach
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    __slots__ = ("id", "kind", "status", "progress", "pending", "dirty")
+
+    def __init__(self, job_id: str, kind: str, progress: Dict[str, int]):
+        self.id = job_id
+        self.kind = kind
+        self.status = "running"
+        self.progress = progress
+        self.pending = 0        # сколько фоновых шагов (коллбэков) ещё не завершено
+        self.dirty = False
+
+    def inc(self, name: str, amount: int = 1) -> None:
+        self.progress[name] = self.progress.get(name, 0) + amount
+        self.dirty = True
+
+    def add_pending(self, n: int) -> None:
+        self.pending += n
+        if self.pending == 0:
+            self.finish()
+
+    def step_done(self) -> None:
+        self.pending -= 1
+        if self.pending == 0:
+            self.finish()
+
+    def finish(self) -> None:
+        self.status = "done"
+        self.dirty = True
+        jobs.wake()
+
+
+class _Registry:
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    async def create(self, kind: str, **progress: int) -> Job:
+        job = Job(uuid.uuid4().hex, kind, dict(progress))
+        await insert_admin_job(job.id, kind, time.time(), json.dumps(job.progress))
+        self._jobs[job.id] = job
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._flush_loop())
+        return job
+
+    def wake(self) -> None:
+        # завершение пишем сразу, не дожидаясь очередного тика
+        if self._wake is not None:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        dirty = [j for j in self._jobs.values() if j.dirty]
+        if not dirty:
+            return
+        now = time.time()
+        for j in dirty:
+            j.dirty = False
+        try:
+            await update_admin_jobs([(j.status, json.dumps(j.progress), now, j.id) for j in dirty])
+        except Exception:
+            for j in dirty:
+                j.dirty = True
+            raise
+        for j in dirty:
+            if j.status == "done":
+                self._jobs.pop(j.id, None)
+
+    async def _flush_loop(self) -> None:
+        detach()
+        while self._jobs:
+            try:
+                await asyncio.wait_for(self._wake.wait(), settings.JOBS_FLUSH_SEC)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # прогресс останется в памяти помеченным и уйдёт следующим тиком
+                logger.exception("admin jobs flush failed")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+jobs = _Registry()
+
+
+async def job_status(job_id: str) -> Optional[Dict[str, Any]]:
+    row = await get_admin_job(job_id)
+    if row is None:
+        return None
+    return {**row, "progress": json.loads(row["progress"])}
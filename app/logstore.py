@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+from .settings import settings
+from .db import insert_provider_logs, get_provider_logs, prune_provider_logs
+from .deadline import detach
+
+logger = logging.getLogger(__name__)
+
+VERBOSITY_LEVELS = ("none", "summary", "full")
+
+# Чистим хранилище не на каждой записи, а раз в N вставок
+_PRUNE_EVERY = 500
+_inserted_since_prune = 0
+_prune_task: Optional[asyncio.Task] = None
+
+
+def resolve_verbosity(value: Optional[str]) -> str:
+    v = (value or "").strip().lower()
+    if v in VERBOSITY_LEVELS:
+        return v
+    return settings.PROVIDER_LOGS_VERBOSITY
+
+
+def _preview(value: Any) -> str:
+    limit = settings.PROVIDER_LOGS_PREVIEW_CHARS
+    text = json.dumps(value, ensure_ascii=False, default=str)
+    if len(text) <= limit:
+        return text
+    return text[:limit] + "…"
+
+
+def _summary(entry: Dict[str, Any], log_id: Optional[int]) -> Dict[str, Any]:
+    request = entry.get("request") or {}
+    return {
+        "gateway": entry.get("gateway"),
+        "kind": entry.get("kind"),
+        "status": entry.get("status"),
+        "log_id": log_id,
+        "request": {"url": request.get("url")},
+        "response": {"preview": _preview(entry.get("response"))},
+    }
+
+
+async def offload_logs(
+    logs: Optional[List[Dict[str, Any]]],
+    *,
+    rp_token: Optional[str],
+    provider: str,
+    verbosity: str,
+) -> List[Dict[str, Any]]:
+    """
+    Сохраняет полные логи адаптера в provider_logs и возвращает то,
+    что уходит в ответ RP:
+      - full:    логи как есть (плюс log_id)
+      - summary: url/status/kind + усечённое превью ответа и ссылка log_id
+      - none:    пустой список
+    Вызывается внутри /pay после ответа провайдера, поэтому не падает: если записать не удалось,
+    логи уходят в ответ целиком (без log_id).
+    """
+    global _inserted_since_prune, _prune_task
+
+    if not logs:
+        return []
+    if not rp_token:
+        # Не к чему привязать запись — ничего не сохраняем
+        return _render(logs, [None] * len(logs), verbosity)
+
+    now = time.time()
+    rows = [
+        (
+            rp_token,
+            provider,
+            entry.get("kind"),
+            entry.get("status"),
+            now,
+            zlib.compress(json.dumps(entry, ensure_ascii=False, default=str).encode("utf-8")),
+        )
+        for entry in logs
+    ]
+    try:
+        ids = await insert_provider_logs(rows)
+    except Exception as e:
+        # операция у провайдера уже заведена — ошибка хранилища не должна превращать её в 5xx
+        logger.warning("provider logs for %s not stored: %s", rp_token, e)
+        return _render(logs, [None] * len(logs), "none" if verbosity == "none" else "full")
+
+    _inserted_since_prune += len(rows)
+    if _inserted_since_prune >= _PRUNE_EVERY and (_prune_task is None or _prune_task.done()):
+        _inserted_since_prune = 0
+        _prune_task = asyncio.ensure_future(_prune(now))
+
+    return _render(logs, ids, verbosity)
+
+
+async def _prune(now: float) -> None:
+    detach()
+    try:
+        await prune_provider_logs(
+            older_than=now - settings.PROVIDER_LOGS_RETENTION_DAYS * 86400,
+            max_rows=settings.PROVIDER_LOGS_MAX_ROWS,
+        )
+    except Exception as e:
+        logger.warning("provider logs prune failed: %s", e)
+
+
+def _render(logs: List[Dict[str, Any]], ids: List[Optional[int]], verbosity: str) -> List[Dict[str, Any]]:
+    if verbosity == "none":
+        return []
+    if verbosity == "full":
+        return [{**entry, "log_id": log_id} for entry, log_id in zip(logs, ids)]
+    return [_summary(entry, log_id) for entry, log_id in zip(logs, ids)]
+
+
+async def fetch_logs(rp_token: str) -> List[Dict[str, Any]]:
+    records = await get_provider_logs(rp_token)
+    for r in records:
+        r["body"] = json.loads(zlib.decompress(r["body"]).decode("utf-8"))
+    return records
@@ -0,0 +1,120 @@
+# Монитор event loop:
+#   - лаг: задача спит LOOP_MONITOR_INTERVAL_MS и меряет, на сколько проснулась позже → гистограмма и квантили в /metrics;
+#   - зависания: сторожевой поток видит, что loop давно не отмечался, и логирует стек шага, который его держит;
+#   - run_cpu(): известные CPU-тяжёлые хелперы уходят в пул потоков, пока лаг выше LOOP_OFFLOAD_LAG_MS.
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from functools import partial
+from typing import Any, Callable, Optional
+
+from .settings import settings
+from .metrics import Histogram, Gauge, Counter
+
+logger = logging.getLogger("app.loopmon")
+
+LOOP_LAG_SECONDS = Histogram(
+    "gateway_event_loop_lag_seconds",
+    "Event loop wake-up lag",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LOOP_LAG_QUANTILE = Gauge(
+    "gateway_event_loop_lag_quantile_seconds",
+    "Event loop lag quantiles over the recent window",
+    ("quantile",),
+)
+LOOP_STALLS = Counter("gateway_event_loop_stalls_total", "Task steps that blocked the loop longer than the threshold")
+CPU_OFFLOADS = Counter("gateway_cpu_offloads_total", "CPU-heavy helper calls moved to the thread pool", ("func",))
+
+_QUANTILES = (("0.5", 0.5), ("0.9", 0.9), ("0.99", 0.99))
+_WINDOW = 600  # последние N замеров для квантилей
+_QUANTILES_EVERY = 10  # пересчитывать квантили раз в N замеров
+
+
+class LoopMonitor:
+    def __init__(self, interval: float, stall_threshold: float):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.current_lag = 0.0
+        self._window: "deque[float]" = deque(maxlen=_WINDOW)
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        self._children = {q: LOOP_LAG_QUANTILE.labels(q) for q, _ in _QUANTILES}
+        self._lag_child = LOOP_LAG_SECONDS.labels()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        # отсчёт от старта, а не от импорта: долгий старт (init_db, прогрев) — не зависание цикла
+        self._beat = time.monotonic()
+        self._task = asyncio.ensure_future(self._measure())
+        if self.stall_threshold > 0:
+            self._watchdog = threading.Thread(target=self._watch, name="gateway-loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        n = 0
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - t0 - self.interval)
+            self._beat = time.monotonic()
+            self.current_lag = lag
+            self._lag_child.observe(lag)
+            self._window.append(lag)
+            n += 1
+            if n % _QUANTILES_EVERY == 0:
+                ordered = sorted(self._window)
+                for q, frac in _QUANTILES:
+                    self._children[q].set(ordered[min(len(ordered) - 1, int(frac * len(ordered)))])
+
+    def _watch(self) -> None:
+        # Зависание = loop не отмечался дольше interval + stall_threshold; стек логируем один раз на зависание
+        reported_beat = None
+        limit = self.interval + self.stall_threshold
+        while not self._stop.wait(self.stall_threshold / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < limit or beat == reported_beat:
+                continue
+            reported_beat = beat
+            LOOP_STALLS.labels().inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no frame>"
+            logger.warning("event loop blocked for %.0f ms, current step:\n%s", stalled * 1000, stack)
+
+    def lag_exceeded(self) -> bool:
+        limit = settings.LOOP_OFFLOAD_LAG_MS
+        return limit > 0 and self.current_lag * 1000 >= limit
+
+
+monitor = LoopMonitor(
+    interval=settings.LOOP_MONITOR_INTERVAL_MS / 1000,
+    stall_threshold=settings.LOOP_STALL_THRESHOLD_MS / 1000,
+)
+
+
+async def run_cpu(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Вызов CPU-тяжёлого хелпера (AES, JWT, разбор большого JSON):
+    при нормальном лаге — прямо в loop (без накладных расходов на пул), при перегрузке — в пуле потоков.
+    """
+    if monitor.lag_exceeded():
+        CPU_OFFLOADS.labels(getattr(fn, "__name__", "call")).inc()
+        return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args))
+    return fn(*args)
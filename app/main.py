@@ -1,13 +1,73 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from .settings import settings
-from .routers import rp_endpoints, provider_webhooks, admin
+from .metrics import MetricsMiddleware, render as render_metrics
+from .tracing import TracingMiddleware, ENABLED as TRACING_ENABLED
+from .deadline import DeadlineMiddleware
+from .admission import AdmissionMiddleware
+from .capture import CaptureMiddleware, ENABLED as CAPTURE_ENABLED, writer as capture_writer
+from .loopmon import monitor as loop_monitor
+from .utils.http import prewarm, close_shared_client
+from .jobs import jobs
+from .analytics import analytics
+from .callbacks.queue import callback_queue
+from .providers.registry import provider_base_urls
+from .routers import rp_endpoints, payout_batches, provider_webhooks, admin
 
 app = FastAPI(title=settings.APP_NAME)
+app.add_middleware(MetricsMiddleware)
+if settings.ADMISSION_ENABLED:
+    # внутри DeadlineMiddleware: ожидание допуска тратит бюджет запроса
+    app.add_middleware(AdmissionMiddleware)
+app.add_middleware(DeadlineMiddleware)
+if TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
+if CAPTURE_ENABLED:
+    # снаружи всех: в запись попадают и отказы допуска, и 504 по дедлайну — как их видел RP
+    app.add_middleware(CaptureMiddleware)
 
 app.include_router(rp_endpoints.router, tags=["ReactivePay"])
+app.include_router(payout_batches.router, tags=["ReactivePay"])
 app.include_router(provider_webhooks.router, tags=["Provider Webhooks"])
 app.include_router(admin.router)
 
+@app.on_event("startup")
+async def _start_loop_monitor():
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+
+@app.on_event("startup")
+async def _prewarm_upstreams():
+    # воркер начинает принимать запросы только после прогрева: первый /pay не платит DNS + TLS
+    if settings.HTTP_PREWARM_ENABLED:
+        await prewarm(provider_base_urls(), settings.HTTP_PREWARM_CONNECTIONS, settings.HTTP_PREWARM_TIMEOUT_SEC)
+
+
+@app.on_event("shutdown")
+async def _stop_loop_monitor():
+    loop_monitor.stop()
+
+
+@app.on_event("shutdown")
+async def _stop_admin_jobs():
+    # коллбэки, не успевшие уйти, теряются; прогресс заданий и приращения аналитики записываем как есть
+    callback_queue.stop()
+    await jobs.stop()
+    await analytics.stop()
+    capture_writer.close()
+
+
+@app.on_event("shutdown")
+async def _close_http_pool():
+    await close_shared_client()
+
+
 @app.get("/health", tags=["Ops"])
 async def health():
     return {"status": "ok"}
+
+
+@app.get("/metrics", tags=["Ops"], response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
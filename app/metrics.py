@@ -0,0 +1,267 @@
+# Метрики в текстовом формате Prometheus (GET /metrics).
+# Без внешних зависимостей и без блокировок: всё обновляется из одного event loop,
+# серии (массивы бакетов) создаются один раз на комбинацию меток и дальше только инкрементируются.
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .tracing import span
+
+# Бакеты латентности (секунды): от миллисекунд (SQLite) до таймаута провайдера
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        _REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._children: Dict[Tuple[str, ...], _CounterChild] = {}
+
+    def labels(self, *values: str) -> _CounterChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _CounterChild()
+        return child
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for values, child in self._children.items():
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._children: Dict[Tuple[str, ...], _GaugeChild] = {}
+
+    def labels(self, *values: str) -> _GaugeChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _GaugeChild()
+        return child
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for values, child in self._children.items():
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = buckets
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+
+    def labels(self, *values: str) -> _HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _HistogramChild(self.buckets)
+        return child
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for values, child in self._children.items():
+            acc = 0
+            for bound, n in zip(self.buckets, child.counts):
+                acc += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, values, le)} {acc}")
+            acc += child.counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, values, le)} {acc}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, values)} {child.sum}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, values)} {child.count}")
+        return lines
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def status_class(code: Optional[int]) -> str:
+    if code is None:
+        return "error"
+    return f"{code // 100}xx"
+
+
+# ---------- метрики шлюза ----------
+
+PROVIDER_REQUEST_SECONDS = Histogram(
+    "gateway_provider_request_seconds",
+    "Latency of a single HTTP attempt to the provider",
+    ("provider", "op", "outcome"),
+)
+PROVIDER_RETRIES = Counter(
+    "gateway_provider_retries_total",
+    "Provider call retries scheduled by retry_policy",
+    ("provider", "op"),
+)
+DB_CALL_SECONDS = Histogram(
+    "gateway_db_call_seconds",
+    "SQLite helper duration (connect + statements + commit)",
+    ("op",),
+)
+DB_COMMIT_SECONDS = Histogram(
+    "gateway_db_commit_seconds",
+    "SQLite commit duration",
+    ("op",),
+)
+WEBHOOKS = Counter(
+    "gateway_webhooks_total",
+    "Provider webhooks received",
+    ("provider", "status"),
+)
+RP_CALLBACK_SECONDS = Histogram(
+    "gateway_rp_callback_seconds",
+    "RP callback delivery latency",
+    ("host", "outcome"),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "gateway_http_request_seconds",
+    "Request latency per endpoint",
+    ("route", "method", "status"),
+)
+
+
+def timed_provider_call(op: str) -> Callable:
+    """
+    Декоратор для _post/_get адаптеров: меряет каждую попытку
+    (ставится под retry_policy, чтобы ретраи считались отдельными наблюдениями).
+    """
+    span_name = f"upstream.{op}"
+
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            t0 = time.perf_counter()
+            code = None
+            try:
+                with span(span_name):
+                    resp = await fn(self, *args, **kwargs)
+                code = resp.status_code
+                return resp
+            finally:
+                PROVIDER_REQUEST_SECONDS.labels(self.name, op, status_class(code)).observe(time.perf_counter() - t0)
+        return wrapper
+    return decorator
+
+
+def provider_retry_hook(op: str) -> Callable:
+    """before_sleep для tenacity: первый аргумент обёрнутого метода — адаптер."""
+    def hook(retry_state) -> None:
+        adapter = retry_state.args[0] if retry_state.args else None
+        PROVIDER_RETRIES.labels(getattr(adapter, "name", "unknown"), op).inc()
+    return hook
+
+
+def observe_rp_callback(url: str, t0: float, code: Optional[int]) -> None:
+    host = urlsplit(url).hostname or "unknown"
+    RP_CALLBACK_SECONDS.labels(host, status_class(code)).observe(time.perf_counter() - t0)
+
+
+class MetricsMiddleware:
+    """ASGI-мидлварь латентности запросов; метка route — шаблон пути FastAPI (без значений параметров)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        status_holder = [None]
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(path, scope["method"], status_class(status_holder[0])).observe(
+                time.perf_counter() - t0
+            )
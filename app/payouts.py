@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .settings import settings
+from .providers.registry import get_provider_by_name
+from .deadline import detach
+from .db import (
+    insert_payout_batch,
+    get_payout_batch,
+    fetch_unfinished_payout_items,
+    fetch_payout_items,
+    mark_payout_items_sent,
+    save_payout_results,
+    claim_payout_batch,
+    list_stale_payout_batches,
+    heartbeat_payout_batch,
+    finish_payout_batch,
+)
+
+logger = logging.getLogger(__name__)
+
+# Идентификатор процесса-владельца пакетов (для resume после падения воркера)
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Сколько позиций читаем из БД за раз при диспатче/стриминге
+_CHUNK = 500
+_STREAM_POLL_SEC = 0.25
+_FINISHED = ("done", "failed")
+
+
+def _provider_for(item: Dict[str, Any]):
+    settings_in = (item.get("params", {}).get("settings") or item.get("settings") or {}) or {}
+    prov = get_provider_by_name(settings_in.get("provider")) or get_provider_by_name(settings.DEFAULT_PROVIDER)
+    return prov
+
+
+def _idempotency_key(batch_id: str, seq: int, item: Dict[str, Any]) -> str:
+    payment = (item.get("params", {}).get("payment") or item.get("payment") or {}) or {}
+    return str(item.get("idempotency_key") or payment.get("token") or f"{batch_id}:{seq}")
+
+
+def parse_batch_file(raw: bytes) -> List[Dict[str, Any]]:
+    """Файл пакета: JSON-массив или NDJSON (по объекту выплаты на строку)."""
+    text = raw.decode("utf-8-sig").strip()
+    try:
+        if text.startswith("["):
+            return json.loads(text)
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch file: {e}")
+
+
+class _ResultWriter:
+    """Групповая запись результатов: всё, что накопилось в очереди, пишем одной транзакцией."""
+
+    def __init__(self):
+        self._queue: "asyncio.Queue[Optional[Tuple[str, str, str, float, str, int]]]" = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._loop())
+
+    def put(self, row: Tuple[str, str, str, float, str, int]) -> None:
+        self._queue.put_nowait(row)
+
+    async def close(self) -> None:
+        self._queue.put_nowait(None)
+        await self._task
+
+    async def _loop(self) -> None:
+        while True:
+            row = await self._queue.get()
+            rows, done = ([row] if row is not None else []), row is None
+            while not self._queue.empty():
+                nxt = self._queue.get_nowait()
+                if nxt is None:
+                    done = True
+                else:
+                    rows.append(nxt)
+            if rows:
+                await save_payout_results(rows)
+            if done:
+                return
+
+
+class PayoutDispatcher:
+    """
+    Диспатч пакетных выплат через адаптеры:
+      - лимит параллельных вызовов на провайдера (PAYOUT_CONCURRENCY_*);
+      - каждая позиция уходит с _idempotency_key, поэтому повторная отправка после падения безопасна;
+      - пакет «принадлежит» процессу, пока тот обновляет heartbeat; брошенные пакеты подхватываются resume-циклом.
+    """
+
+    def __init__(self):
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._resume_task: Optional[asyncio.Task] = None
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        sem = self._semaphores.get(provider)
+        if sem is None:
+            limit = settings.PAYOUT_CONCURRENCY_PER_PROVIDER.get(provider, settings.PAYOUT_CONCURRENCY_DEFAULT)
+            sem = self._semaphores[provider] = asyncio.Semaphore(max(1, limit))
+        return sem
+
+    def start(self, batch_id: str) -> None:
+        if batch_id in self._running:
+            return
+        task = asyncio.ensure_future(self._run(batch_id))
+        self._running[batch_id] = task
+        task.add_done_callback(lambda _t: self._running.pop(batch_id, None))
+
+    async def _heartbeat(self, batch_id: str, run: asyncio.Task) -> None:
+        """
+        Продлевает владение пакетом. Ошибка записи — повтор на следующем тике; владение потеряно (пакет забрал
+        другой процесс) или не продлевалось дольше PAYOUT_BATCH_STALE_SEC — диспатч останавливается, иначе
+        позиции ушли бы провайдеру дважды.
+        """
+        interval = max(1.0, settings.PAYOUT_BATCH_STALE_SEC / 3)
+        last_ok = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                owned = await heartbeat_payout_batch(batch_id, OWNER, time.time())
+            except Exception as e:
+                logger.warning("payout batch %s heartbeat failed: %s", batch_id, e)
+                if time.monotonic() - last_ok < settings.PAYOUT_BATCH_STALE_SEC - interval:
+                    continue
+                owned = False
+            if not owned:
+                logger.warning("payout batch %s ownership lost, stopping dispatch", batch_id)
+                run.cancel()
+                return
+            last_ok = time.monotonic()
+
+    async def _run(self, batch_id: str) -> None:
+        detach()  # пакет переживает запрос, который его создал
+        heartbeat = asyncio.ensure_future(self._heartbeat(batch_id, asyncio.current_task()))
+        writer = _ResultWriter()
+        try:
+            after = -1
+            while True:
+                items = await fetch_unfinished_payout_items(batch_id, after, _CHUNK)
+                if not items:
+                    break
+                after = items[-1]["seq"]
+                await mark_payout_items_sent(batch_id, [i["seq"] for i in items if i["status"] == "queued"], time.time())
+                await asyncio.gather(*(self._dispatch(batch_id, item, writer) for item in items))
+        finally:
+            await writer.close()
+            heartbeat.cancel()
+        await finish_payout_batch(batch_id, OWNER)
+
+    async def _dispatch(self, batch_id: str, item: Dict[str, Any], writer: _ResultWriter) -> None:
+        provider = get_provider_by_name(item["provider"])
+        payload = {**json.loads(item["payload"]), "_idempotency_key": item["idempotency_key"]}
+        async with self._semaphore(item["provider"]):
+            try:
+                if not provider:
+                    raise RuntimeError(f"provider {item['provider']} is not available")
+                result = await provider.payout(payload)
+                row = ("done", str(result.get("status") or "pending"), json.dumps(result, ensure_ascii=False, default=str))
+            except Exception as e:
+                row = ("failed", "declined", json.dumps({"error": str(e)}, ensure_ascii=False))
+        writer.put((*row, time.time(), batch_id, item["seq"]))
+
+    async def resume_stale(self) -> None:
+        now = time.time()
+        stale_before = now - settings.PAYOUT_BATCH_STALE_SEC
+        for batch_id in await list_stale_payout_batches(stale_before):
+            if batch_id not in self._running and await claim_payout_batch(batch_id, OWNER, now, stale_before):
+                self.start(batch_id)
+
+    async def _resume_loop(self) -> None:
+        while True:
+            try:
+                await self.resume_stale()
+            except Exception:
+                pass
+            await asyncio.sleep(settings.PAYOUT_RESUME_SCAN_SEC)
+
+    def start_resume_loop(self) -> None:
+        if self._resume_task is None:
+            self._resume_task = asyncio.ensure_future(self._resume_loop())
+
+
+dispatcher = PayoutDispatcher()
+
+
+async def create_batch(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="batch must be a non-empty array of payouts")
+    if len(items) > settings.PAYOUT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"batch is limited to {settings.PAYOUT_BATCH_MAX_ITEMS} items")
+
+    batch_id = uuid.uuid4().hex
+    rows: List[Tuple[int, str, str, str]] = []
+    for seq, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail=f"item {seq}: payout object expected")
+        provider = _provider_for(item)
+        if not provider:
+            raise HTTPException(status_code=400, detail=f"item {seq}: provider not found")
+        rows.append((seq, _idempotency_key(batch_id, seq, item), provider.name, json.dumps(item, ensure_ascii=False)))
+
+    await insert_payout_batch(batch_id, time.time(), OWNER, rows)
+    dispatcher.start(batch_id)
+    return {"batch_id": batch_id, "total": len(rows)}
+
+
+async def batch_progress(batch_id: str) -> Optional[Dict[str, Any]]:
+    return await get_payout_batch(batch_id)
+
+
+async def stream_results(batch_id: str, total: int, after_seq: int = -1) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Отдаёт результаты позиций в порядке seq по мере их завершения.
+    after_seq — для продолжения стрима после обрыва. Стрим заканчивается, когда пакет перестал быть running,
+    даже если часть позиций так и не завершилась (их видно в GET /payout/batch/{batch_id}).
+    """
+    last = after_seq
+    batch_over = False
+    while last < total - 1:
+        rows = await fetch_payout_items(batch_id, last, _CHUNK)
+        progressed = False
+        for row in rows:
+            if row["status"] not in _FINISHED:
+                break
+            last = row["seq"]
+            progressed = True
+            yield {
+                "seq": row["seq"],
+                "idempotency_key": row["idempotency_key"],
+                "provider": row["provider"],
+                "status": row["result_status"],
+                "result": json.loads(row["result"]) if row["result"] else None,
+            }
+        if not progressed:
+            if batch_over:
+                return
+            batch = await get_payout_batch(batch_id)
+            # результаты пишутся до смены статуса пакета — после неё нужен ещё один проход
+            batch_over = batch is None or batch["status"] != "running"
+            if not batch_over:
+                await asyncio.sleep(_STREAM_POLL_SEC)
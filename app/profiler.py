@@ -0,0 +1,136 @@
+# Сэмплирующий профайлер event loop для /admin/profile.
+# Отдельный поток раз в interval снимает стек потока event loop (sys._current_frames) и помечает
+# сэмпл именем текущей asyncio-задачи, так что время раскладывается по корутинам адаптеров, БД и коллбэков.
+# Поток живёт только на время снятия профиля — в выключенном состоянии ничего не работает.
+import asyncio
+import marshal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# (filename, firstlineno, funcname) — тот же ключ функции, что у cProfile/pstats
+FuncKey = Tuple[str, int, str]
+
+MAX_SECONDS = 60.0
+MIN_INTERVAL_SEC = 0.001
+MAX_DEPTH = 128
+
+_IDLE = ("<asyncio>", 0, "<event-loop-idle>")
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float, max_depth: int = MAX_DEPTH):
+        self.loop = loop
+        self.interval = max(MIN_INTERVAL_SEC, interval)
+        self.max_depth = max_depth
+        self.samples: "Counter[Tuple[FuncKey, ...]]" = Counter()
+        self.total_samples = 0
+        self.duration = 0.0
+        self._thread_id = threading.get_ident()  # создаём из потока event loop
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _task_root(self) -> FuncKey:
+        task = asyncio.current_task(self.loop)
+        if task is None:
+            return _IDLE
+        coro = task.get_coro()
+        return ("<asyncio>", 0, f"task:{getattr(coro, '__qualname__', task.get_name())}")
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return
+        stack: List[FuncKey] = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        stack.append(self._task_root())
+        stack.reverse()
+        self.samples[tuple(stack)] += 1
+        self.total_samples += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        if not _lock.acquire(blocking=False):
+            raise ProfilerBusy("profiler is already running")
+        self._thread = threading.Thread(target=self._run, name="gateway-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            _lock.release()
+
+    # ---- выгрузка ----
+    def collapsed(self) -> str:
+        """Формат flamegraph.pl / speedscope: «root;frame;...;leaf count»."""
+        lines = []
+        for stack, count in self.samples.most_common():
+            lines.append(";".join(_label(f) for f in stack) + f" {count}")
+        return "\n".join(lines) + "\n"
+
+    def pstats_bytes(self) -> bytes:
+        """marshal-дамп в формате pstats (pstats.Stats(path)); время = число сэмплов × interval."""
+        stats: Dict[FuncKey, list] = {}
+        callers: Dict[FuncKey, Dict[FuncKey, list]] = {}
+        for stack, count in self.samples.items():
+            weight = count * self.interval
+            seen = set()
+            for i, func in enumerate(stack):
+                entry = stats.setdefault(func, [0, 0, 0.0, 0.0])
+                if func not in seen:
+                    seen.add(func)
+                    entry[0] += count  # cc
+                    entry[1] += count  # nc
+                    entry[3] += weight  # ct
+                if i == len(stack) - 1:
+                    entry[2] += weight  # tt
+                if i > 0:
+                    edge = callers.setdefault(func, {}).setdefault(stack[i - 1], [0, 0, 0.0, 0.0])
+                    edge[0] += count
+                    edge[1] += count
+                    edge[3] += weight
+                    if i == len(stack) - 1:
+                        edge[2] += weight
+        out = {
+            func: (v[0], v[1], v[2], v[3], {c: tuple(e) for c, e in callers.get(func, {}).items()})
+            for func, v in stats.items()
+        }
+        return marshal.dumps(out)
+
+
+def _label(func: FuncKey) -> str:
+    filename, lineno, name = func
+    if filename == "<asyncio>":
+        return name
+    short = filename.rsplit("/site-packages/", 1)[-1]
+    return f"{name} ({short}:{lineno})"
+
+
+async def profile_for(seconds: float, interval: float) -> SamplingProfiler:
+    """Снимает профиль текущего event loop в течение seconds (не больше MAX_SECONDS)."""
+    profiler = SamplingProfiler(asyncio.get_running_loop(), interval)
+    profiler.start()
+    started = time.monotonic()
+    try:
+        await asyncio.sleep(min(max(seconds, 0.0), MAX_SECONDS))
+    finally:
+        profiler.stop()
+    profiler.duration = time.monotonic() - started
+    return profiler
@@ -1,12 +1,98 @@
 from typing import Dict, Any, Optional
-import httpx
-import re
 from ...settings import settings
-from ...utils.http import client, retry_policy
-from ...db import upsert_mapping, get_mapping_by_token_any
-
-
-class BrusnikaAdapter:
+from ..framework import EndpointSpec, ProviderSpec, RequisiteRule, SpecAdapter, compile_requisite_rules
+
+
+def _sbp(f: Dict[str, Any]):
+    return (
+        {"pan": f["digits"] or f["number"] or f["number_add"], "holder": f["holder"], "bank_name": f["bank_name"]},
+        {
+            "qr": f["qr"],
+            "pan": f["digits"] or f["number"],
+            "phone": f["digits"] or f["number"],
+            "holder": f["holder"],
+            "bank_name": f["bank_name"],
+        },
+    )
+
+
+def _card(f: Dict[str, Any]):
+    card = f["digits"] or f["number"]
+    return (
+        {"card": card, "holder": f["holder"], "bank_name": f["bank_name"]},
+        {"qr": f["qr"], "card": card, "holder": f["holder"], "bank_name": f["bank_name"]},
+    )
+
+
+def _account(f: Dict[str, Any]):
+    account = f["digits"] or f["number"]
+    return (
+        {"account": account, "holder": f["holder"], "bank_name": f["bank_name"]},
+        {"qr": f["qr"], "account": account, "holder": f["holder"], "bank_name": f["bank_name"]},
+    )
+
+
+def _link(f: Dict[str, Any]):
+    return (
+        {"link": {"url": f["deeplink"]}, "holder": f["holder"], "bank_name": f["bank_name"]},
+        {"qr": f["qr"], "link": f["deeplink"], "holder": f["holder"], "bank_name": f["bank_name"]},
+    )
+
+
+def _unknown(f: Dict[str, Any]):
+    # ничего уверенного — provider_response остаётся как есть (без requisites)
+    return None, {"qr": f["qr"], "holder": f["holder"], "bank_name": f["bank_name"]}
+
+
+# Приоритет: метод → эвристика по номеру (первое подошедшее правило)
+_requisites = compile_requisite_rules(
+    (
+        RequisiteRule("sbp", _sbp, methods=("sbp", "tophone", "to_phone"), when="is_qr_phone"),
+        RequisiteRule("card", _card, methods=("tocard", "to_card"), when="is_card"),
+        RequisiteRule("account", _account, methods=("toaccount", "to_account"), when="is_account"),
+        RequisiteRule("link", _link, when="deeplink"),
+    ),
+    fallback=_unknown,
+)
+
+SPEC = ProviderSpec(
+    gateway="brusnika",
+    pay=EndpointSpec(
+        "POST",
+        "/host2host/payin",
+        {
+            "token": ("id", "idPlatform"),
+            "status": ("status", "^result.status"),
+            "payment_details": ("paymentDetailsData",),
+            "redirect_url": ("deeplink",),
+        },
+        defaults={"status": "pending"},
+    ),
+    status=EndpointSpec(
+        "GET",
+        "/operation/operation/platform/{op_id}",
+        {
+            "status": ("status", "^result.status"),
+            "amount": ("amount", "amountInitial"),
+            "currency": ("currency",),
+            "payment_details": ("paymentDetailsData",),
+            "redirect_url": ("deeplink",),
+        },
+        block_fallback_root=True,  # у некоторых ответов статус лежит прямо в корне
+    ),
+    statuses={
+        "approved": ("approved", "success", "succeeded", "completed", "paid", "confirmed"),
+        "declined": ("declined", "failed", "error", "canceled", "cancelled", "expired"),
+        "refunded": ("refunded", "refund", "reversed"),
+    },
+    auth_setting="BRUSNIKA_API_KEY",
+    log_mask={"integrationMerhcnatData": {"webHook": "***"}},
+    missing_op_details="no platform id in mapping",
+    null_currencies=("NOTSET",),
+)
+
+
+class BrusnikaAdapter(SpecAdapter):
     """
     Brusnika H2H (SBP-first):
     - POST /host2host/payin
@@ -16,45 +102,14 @@ class BrusnikaAdapter:
     """
 
     name = "Brusnika_SBP"
+    spec = SPEC
 
     def __init__(self):
-        self.base_url = settings.BRUSNIKA_BASE_URL.rstrip("/")
-
-    def _api_key(self, payload: Dict[str, Any]) -> str:
-        override = payload.get("_provider_auth")
-        return override or settings.BRUSNIKA_API_KEY
-
-    @retry_policy()
-    async def _post(self, path: str, json_payload: Dict[str, Any], api_key: str) -> httpx.Response:
-        async with client() as c:
-            return await c.post(
-                f"{self.base_url}{path}",
-                json=json_payload,
-                headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-            )
-
-    @retry_policy()
-    async def _get(self, path: str, api_key: str) -> httpx.Response:
-        async with client() as c:
-            return await c.get(
-                f"{self.base_url}{path}",
-                headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-            )
+        super().__init__(settings.BRUSNIKA_BASE_URL)
 
     # ---- Utils ----
-    def _status_map(self, s: Optional[str]) -> str:
-        sl = (s or "").lower()
-        if sl in {"approved", "success", "succeeded", "completed", "paid", "confirmed"}:
-            return "approved"
-        if sl in {"declined", "failed", "error", "canceled", "cancelled", "expired"}:
-            return "declined"
-        if sl in {"refunded", "refund", "reversed"}:
-            return "refunded"
-        return "pending"
-
     def _digits(self, v: Any) -> str:
-        s = str(v or "")
-        return "".join(ch for ch in s if ch.isdigit())
+        return "".join(filter(str.isdigit, str(v or "")))
 
     def _build_requisites_and_provider_data(
         self, payment_details: Dict[str, Any], deeplink: Optional[str]
@@ -64,62 +119,42 @@ class BrusnikaAdapter:
           - requisites (строго по типам: SBP | CARD | ACCOUNT | LINK)
           - provider_response_data (с доп. полями: qr/phone и т.п.)
         """
-        provider_response: Dict[str, Any] = {}
-        requisites: Optional[Dict[str, Any]] = None
-
         if not isinstance(payment_details, dict):
             if deeplink:
-                requisites = {"link": {"url": deeplink}, "holder": "", "bank_name": ""}
-                provider_response = {"link": deeplink}
-            return {"requisites": requisites, "provider_response_data": provider_response}
+                return {
+                    "requisites": {"link": {"url": deeplink}, "holder": "", "bank_name": ""},
+                    "provider_response_data": {"link": deeplink},
+                }
+            return {"requisites": None, "provider_response_data": {}}
+        if not payment_details and not deeplink:
+            # частый случай статуса: реквизитов нет вовсе
+            return {"requisites": None, "provider_response_data": {"qr": "", "holder": "", "bank_name": ""}}
 
-        method = (payment_details.get("paymentMethod") or "").lower()
-        bank_name = payment_details.get("bankName") or ""
-        holder = payment_details.get("nameMediator") or payment_details.get("holder") or ""
         number = payment_details.get("number") or ""
         number_add = payment_details.get("numberAdditional") or ""
-        qr = payment_details.get("qRcode") or payment_details.get("qrCode") or ""
-
         digits = self._digits(number or number_add)
-        is_card = bool(digits) and 13 <= len(digits) <= 19
-        is_account = bool(digits) and len(digits) >= 20
+        qr = payment_details.get("qRcode") or payment_details.get("qrCode") or ""
         is_phone = bool(digits) and (len(digits) in (10, 11) or digits.startswith("7"))
-
-        # Приоритет: метод → эвристика по номеру
-        if method in {"sbp", "tophone", "to_phone"} or (qr and is_phone):
-            # SBP
-            requisites = {"pan": digits or number or number_add, "holder": holder, "bank_name": bank_name}
-            provider_response = {
-                "qr": qr or "",
-                "pan": digits or number,
-                "phone": digits or number,
-                "holder": holder,
-                "bank_name": bank_name,
-            }
-        elif method in {"tocard", "to_card"} or is_card:
-            # CARD
-            requisites = {"card": digits or number, "holder": holder, "bank_name": bank_name}
-            provider_response = {"qr": qr or "", "card": digits or number, "holder": holder, "bank_name": bank_name}
-        elif method in {"toaccount", "to_account"} or is_account:
-            # ACCOUNT
-            requisites = {"account": digits or number, "holder": holder, "bank_name": bank_name}
-            provider_response = {"qr": qr or "", "account": digits or number, "holder": holder, "bank_name": bank_name}
-        elif deeplink:
-            # LINK
-            requisites = {"link": {"url": deeplink}, "holder": holder, "bank_name": bank_name}
-            provider_response = {"qr": qr or "", "link": deeplink, "holder": holder, "bank_name": bank_name}
-        else:
-            # ничего уверенного — provider_response остаётся как есть (без requisites)
-            provider_response = {"qr": qr or "", "holder": holder, "bank_name": bank_name}
-
+        facts = {
+            "number": number,
+            "number_add": number_add,
+            "digits": digits,
+            "holder": payment_details.get("nameMediator") or payment_details.get("holder") or "",
+            "bank_name": payment_details.get("bankName") or "",
+            "qr": qr,
+            "deeplink": deeplink,
+            "is_card": bool(digits) and 13 <= len(digits) <= 19,
+            "is_account": bool(digits) and len(digits) >= 20,
+            "is_qr_phone": bool(qr) and is_phone,
+        }
+        method = (payment_details.get("paymentMethod") or "").lower()
+        requisites, provider_response = _requisites(method, facts)
         return {"requisites": requisites, "provider_response_data": provider_response}
 
-    # ---- Adapter API ----
-    async def pay(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        api_key = self._api_key(payload)
-
+    # ---- хуки SpecAdapter ----
+    def _pay_body(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         # Тело запроса к Brusnika (минимальное и валидное)
-        body = {
+        return {
             "clientID": (payload.get("customer") or {}).get("client_id") or "rp-client",
             "clientIP": (payload.get("customer") or {}).get("client_ip") or "127.0.0.1",
             "clientDateCreated": None,
@@ -131,161 +166,5 @@ class BrusnikaAdapter:
             }
         }
 
-        logs = [{
-            "gateway": "brusnika",
-            "request": {"url": "/host2host/payin", "params": {**body, "integrationMerhcnatData": {"webHook": "***"}}},
-            "status": None,
-            "response": None,
-            "kind": "pay",
-        }]
-
-        try:
-            resp = await self._post("/host2host/payin", json_payload=body, api_key=api_key)
-            try:
-                js = resp.json()
-            except Exception:
-                js = {"raw_text": resp.text or ""}
-            logs[-1]["status"] = resp.status_code
-            logs[-1]["response"] = js
-        except Exception as e:
-            logs[-1]["status"] = 599
-            logs[-1]["response"] = {"error": str(e)}
-            return {
-                "status": "OK",
-                "gateway_token": None,
-                "result": "declined",
-                "requisites": {},
-                "redirectRequest": {"url": None, "type": "post_iframes", "iframes": []},
-                "with_external_format": True,
-                "provider_response_data": {},
-                "logs": logs,
-            }
-
-        data_block = js.get("data") or {}
-        result_block = js.get("result") or {}
-
-        gateway_token = str(data_block.get("id") or data_block.get("idPlatform") or "")
-        provider_status = (data_block.get("status") or result_block.get("status") or "pending")
-        result_norm = self._status_map(provider_status)
-
-        payment_details = data_block.get("paymentDetailsData") or {}
-        deeplink = data_block.get("deeplink") or None
-
-        # Сохраняем маппинг для последующих вызовов
-        await upsert_mapping(
-            rp_token=payload["rp_token"],
-            order_number=payload["order_number"],
-            provider=self.name,
-            callback_url=payload["callback_url"],
-            provider_operation_id=gateway_token,
-            status=provider_status,
-        )
-
-        built = self._build_requisites_and_provider_data(payment_details, deeplink)
-        requisites = built.get("requisites") or {}
-        provider_response_data = built.get("provider_response_data") or {}
-
-        redirect_request = {"url": None, "type": "post_iframes", "iframes": []}
-        if deeplink:
-            redirect_request = {"url": deeplink, "type": "redirect", "iframes": []}
-
-        return {
-            "status": "OK",
-            "gateway_token": gateway_token or None,
-            "result": result_norm,
-            "requisites": requisites,                       # <-- строго по типу (SBP/CARD/ACCOUNT/LINK)
-            "redirectRequest": redirect_request,            # <-- camelCase + ожидаемые type
-            "with_external_format": True,                   # <-- флаг, который RP использует
-            "provider_response_data": provider_response_data,  # <-- НЕ null
-            "logs": logs,
-        }
-
-    async def status(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        api_key = self._api_key(payload)
-        key = payload.get("gateway_token") or payload.get("rp_token") or payload.get("order_number")
-        mapping = await get_mapping_by_token_any(key) if key else None
-        if not mapping or not mapping.get("provider_operation_id"):
-            return {
-                "result": "OK",
-                "status": "pending",
-                "details": "no platform id in mapping",
-                "amount": None,
-                "currency": None,
-                "logs": [],
-            }
-
-        platform_id = mapping["provider_operation_id"]
-        logs = [{
-            "gateway": "brusnika",
-            "request": {"url": f"/operation/operation/platform/{platform_id}", "params": {"id": platform_id}},
-            "status": None,
-            "response": None,
-            "kind": "status",
-        }]
-
-        try:
-            resp = await self._get(f"/operation/operation/platform/{platform_id}", api_key=api_key)
-            try:
-                js = resp.json()
-            except Exception:
-                js = {"raw_text": resp.text or ""}
-            logs[-1]["status"] = resp.status_code
-            logs[-1]["response"] = js
-        except Exception as e:
-            logs[-1]["status"] = 599
-            logs[-1]["response"] = {"error": str(e)}
-            return {
-                "result": "OK",
-                "status": "pending",
-                "details": f"Gateway unreachable: {e}",
-                "amount": None,
-                "currency": None,
-                "logs": logs,
-            }
-
-        data_block = js.get("data") or js  # у некоторых ответов статус лежит прямо в data
-        provider_status = data_block.get("status") or (js.get("result") or {}).get("status")
-        status_norm = self._status_map(provider_status)
-
-        payment_details = data_block.get("paymentDetailsData") or {}
-        deeplink = data_block.get("deeplink") or None
-        built = self._build_requisites_and_provider_data(payment_details, deeplink)
-
-        # Статус-ответ для RP (status endpoint у RP использует другой «внешний» формат)
-        amount = data_block.get("amount") or data_block.get("amountInitial")
-        currency = data_block.get("currency")
-        if isinstance(currency, str) and currency.upper() == "NOTSET":
-            currency = None
-
-        return {
-            "result": "OK",
-            "status": status_norm,
-            "details": f"Transaction status: {status_norm}",
-            "amount": amount,
-            "currency": currency,
-            "logs": logs,
-            # на всякий добавим, чтобы RP мог обновить gateway_details при опросе
-            "with_external_format": True,
-            "provider_response_data": built.get("provider_response_data") or {},
-            "requisites": built.get("requisites") or {},
-        }
-
-    async def refund(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        return {
-            "result": "ERROR",
-            "status": "declined",
-            "details": "Refund not supported by provider",
-            "amount": None,
-            "currency": None,
-            "logs": [],
-        }
-
-    async def payout(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        return {
-            "result": "ERROR",
-            "status": "declined",
-            "details": "Payout not implemented for this provider",
-            "amount": None,
-            "currency": None,
-            "logs": [],
-        }
+    def _output(self, block: Dict[str, Any], fields: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Any]:
+        return self._build_requisites_and_provider_data(fields["payment_details"] or {}, fields["redirect_url"])
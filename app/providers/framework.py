@@ -0,0 +1,471 @@
+"""
+Декларативные адаптеры провайдеров.
+
+Провайдер описывается ProviderSpec: эндпойнты (метод, путь, что писать в лог), пути полей ответа,
+таблица статусов и правила реквизитов. Спецификация компилируется один раз при импорте модуля адаптера:
+  - пути полей эндпойнта → функция-экстрактор с заранее разобранными путями (без разбора строк на каждый ответ);
+  - таблица статусов → StatusTable (app/txstatus.py): «статус провайдера в нижнем регистре → TxState»;
+  - правила реквизитов → проверка по порядку: frozenset методов и булевы факты, первое подошедшее побеждает.
+SpecAdapter реализует общий конвейер pay/status: тело → лог → вызов → разбор → статус → маппинг → реквизиты;
+адаптеру остаются тело запроса, сборка реквизитов и редирект.
+
+Синтаксис путей: "a.b" — от блока данных эндпойнта (обычно data), "^a.b" — от корня ответа.
+Несколько путей поля — альтернативы через `or`, как в цепочках `x.get(..) or y.get(..)`.
+"""
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import httpx
+
+from ..settings import settings
+from ..utils.http import shared_client, retry_policy
+from ..metrics import timed_provider_call, provider_retry_hook
+from ..loopmon import run_cpu
+from ..deadline import DeadlineExceeded, cap, detach
+from ..db import upsert_mapping
+from ..txstatus import StatusTable
+from ..txcontext import mapping_for
+from ..snapshots import snapshots, degraded_status
+from ..analytics import analytics
+from .. import capture
+
+logger = logging.getLogger(__name__)
+
+Extractor = Callable[[Dict[str, Any]], Tuple[Dict[str, Any], Dict[str, Any]]]
+
+PROVIDER_TIMEOUT_SEC = 15.0  # на одну попытку; внутри дедлайна запроса — не дольше его остатка
+
+_E: Dict[str, Any] = {}  # пустой блок для промежуточных шагов пути; только чтение
+_NO_DEFAULT = object()
+
+
+def _path_getter(path: str) -> Callable[[Dict[str, Any], Dict[str, Any]], Any]:
+    """Путь → `get(js, block)`; ключи разбираются здесь, на ответ — только .get() по готовому кортежу."""
+    from_root = path.startswith("^")
+    keys = path.lstrip("^").split(".")
+    head, last = tuple(keys[:-1]), keys[-1]
+    # короткие пути (почти все поля) — без цикла
+    if not head:
+        if from_root:
+            return lambda js, block: js.get(last)
+        return lambda js, block: block.get(last)
+    if len(head) == 1:
+        (first,) = head
+        if from_root:
+            return lambda js, block: (js.get(first) or _E).get(last)
+        return lambda js, block: (block.get(first) or _E).get(last)
+
+    def get(js: Dict[str, Any], block: Dict[str, Any]) -> Any:
+        d = js if from_root else block
+        for k in head:
+            d = d.get(k) or _E
+        return d.get(last)
+
+    return get
+
+
+def compile_extractor(
+    block: Optional[str],
+    fields: Dict[str, Sequence[str]],
+    defaults: Optional[Dict[str, Any]] = None,
+    block_fallback_root: bool = False,
+) -> Extractor:
+    """
+    Собирает `extract(js) -> (block, {поле: значение})`.
+    block — путь блока данных от корня (None — весь ответ); block_fallback_root — пустой блок заменяется корнем.
+    """
+    defaults = defaults or {}
+    get_block = _path_getter("^" + block) if block is not None else None
+    plan = [
+        (name, tuple(_path_getter(p) for p in paths), defaults.get(name, _NO_DEFAULT))
+        for name, paths in fields.items()
+    ]
+
+    def extract(js: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        if get_block is None:
+            blk = js
+        else:
+            blk = get_block(js, js) or (js if block_fallback_root else {})
+        out: Dict[str, Any] = {}
+        for name, getters, default in plan:
+            # альтернативы — как `a or b`: первое истинное, иначе последнее значение
+            value = None
+            for get in getters:
+                value = get(js, blk)
+                if value:
+                    break
+            if not value and default is not _NO_DEFAULT:
+                value = default
+            out[name] = value
+        return blk, out
+
+    return extract
+
+
+class RequisiteRule:
+    """
+    Правило реквизитов: срабатывает, если метод провайдера из methods или истинен факт when (имя ключа facts).
+    build(facts) → (requisites | None, provider_response_data).
+    """
+
+    __slots__ = ("kind", "methods", "when", "build")
+
+    def __init__(
+        self,
+        kind: str,
+        build: Callable[[Dict[str, Any]], Tuple[Optional[Dict[str, Any]], Dict[str, Any]]],
+        methods: Iterable[str] = (),
+        when: Optional[str] = None,
+    ):
+        self.kind = kind
+        self.build = build
+        self.methods = frozenset(m.lower() for m in methods)
+        self.when = when
+
+
+def compile_requisite_rules(
+    rules: Sequence[RequisiteRule],
+    fallback: Callable[[Dict[str, Any]], Tuple[Optional[Dict[str, Any]], Dict[str, Any]]],
+) -> Callable[[str, Dict[str, Any]], Tuple[Optional[Dict[str, Any]], Dict[str, Any]]]:
+    """Правила → `apply(method, facts)`: правила проверяются по порядку, первое подошедшее побеждает."""
+    plan = [(r.methods, r.when, r.build) for r in rules]
+
+    def apply(method: str, facts: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        for methods, when, build in plan:
+            if (methods and method in methods) or (when and facts[when]) or (not methods and not when):
+                return build(facts)
+        return fallback(facts)
+
+    return apply
+
+
+class EndpointSpec:
+    """Эндпойнт провайдера: path/log_url — шаблоны с {op_id}; fields/defaults компилируются в extract."""
+
+    __slots__ = ("method", "path", "log_url", "extract")
+
+    def __init__(
+        self,
+        method: str,
+        path: str,
+        fields: Dict[str, Sequence[str]],
+        *,
+        log_url: Optional[str] = None,
+        block: Optional[str] = "data",
+        block_fallback_root: bool = False,
+        defaults: Optional[Dict[str, Any]] = None,
+    ):
+        self.method = method
+        self.path = path
+        self.log_url = log_url or path
+        self.extract = compile_extractor(block, fields, defaults, block_fallback_root)
+
+
+class ProviderSpec:
+    """
+    Описание провайдера для SpecAdapter.
+    pay.fields обязаны содержать token и status; status.fields — status, amount, currency.
+    """
+
+    def __init__(
+        self,
+        *,
+        gateway: str,
+        pay: EndpointSpec,
+        status: EndpointSpec,
+        statuses: Dict[str, Iterable[str]],
+        auth_setting: str,
+        auth_format: str = "Bearer {token}",
+        log_mask: Optional[Dict[str, Any]] = None,
+        missing_op_details: str = "no operation id in mapping",
+        external_on_error: bool = False,
+        null_currencies: Iterable[str] = (),
+        refund_details: str = "Refund not supported by provider",
+        payout_details: str = "Payout not implemented for this provider",
+    ):
+        self.gateway = gateway
+        self.pay = pay
+        self.status = status
+        self.status_map = StatusTable(statuses)
+        self.auth_setting = auth_setting
+        self.auth_format = auth_format
+        self.log_mask = log_mask or {}
+        self.missing_op_details = missing_op_details
+        self.external_on_error = external_on_error
+        self.null_currencies = frozenset(c.upper() for c in null_currencies)
+        self.refund_details = refund_details
+        self.payout_details = payout_details
+
+
+# Паузы фоновых повторов записи маппинга после ответа провайдера на pay
+_MAPPING_RETRY_DELAYS = (0.5, 1.0, 2.0, 5.0, 10.0)
+_mapping_retries: Set[asyncio.Task] = set()
+
+
+async def save_pay_mapping(**fields: Any) -> None:
+    """
+    Маппинг по ответу провайдера на pay. Операция у провайдера уже создана: ошибка записи (блокировка,
+    дедлайн) не должна уронить /pay — такой ответ не попал бы в идемпотентность, и повтор RP создал бы
+    вторую операцию. Неудавшаяся запись повторяется фоном.
+    """
+    try:
+        await upsert_mapping(**fields)
+    except Exception as e:
+        logger.warning("mapping for %s not saved, retrying in background: %s", fields.get("rp_token"), e)
+        task = asyncio.ensure_future(_retry_mapping(fields))
+        _mapping_retries.add(task)
+        task.add_done_callback(_mapping_retries.discard)
+
+
+async def _retry_mapping(fields: Dict[str, Any]) -> None:
+    detach()
+    error: Optional[Exception] = None
+    for delay in _MAPPING_RETRY_DELAYS:
+        await asyncio.sleep(delay)
+        try:
+            await upsert_mapping(**fields)
+            return
+        except Exception as e:
+            error = e
+    logger.error("mapping for %s not saved: %s", fields.get("rp_token"), error)
+
+
+def _log_entry(gateway: str, url: str, params: Dict[str, Any], kind: str) -> Dict[str, Any]:
+    return {"gateway": gateway, "request": {"url": url, "params": params}, "status": None, "response": None, "kind": kind}
+
+
+class SpecAdapter(ABC):
+    """
+    Общий конвейер адаптера по ProviderSpec. Подкласс задаёт name, spec и реализует (без абстрактных хуков
+    адаптер не создаётся):
+      _pay_body(payload) — тело запроса pay;
+      _output(block, fields, payload) — {"requisites", "provider_response_data"};
+      _redirect(payload, gateway_token, fields, built) — redirectRequest (по умолчанию — fields["redirect_url"]).
+    """
+
+    name: str
+    spec: ProviderSpec
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self._status_map = self.spec.status_map
+
+    # ---- транспорт ----
+    def _auth_token(self, payload: Dict[str, Any]) -> str:
+        override = payload.get("_provider_auth")
+        return override or getattr(settings, self.spec.auth_setting)
+
+    def _headers(self, token: str) -> Dict[str, str]:
+        if not token:
+            # "Bearer " без ключа h11 отвергает локально (LocalProtocolError) — пусть лучше ответит провайдер
+            return {"Content-Type": "application/json"}
+        return {"Authorization": self.spec.auth_format.format(token=token), "Content-Type": "application/json"}
+
+    @retry_policy(before_sleep=provider_retry_hook("pay"))
+    @timed_provider_call("pay")
+    async def _post(self, path: str, json_payload: Dict[str, Any], headers: Dict[str, str]) -> httpx.Response:
+        with capture.provider_call(self.name, "POST", self.base_url, path, json_payload) as call:
+            resp = await shared_client().post(
+                f"{self.base_url}{path}", json=json_payload, headers=headers,
+                timeout=cap(PROVIDER_TIMEOUT_SEC, "provider"),
+            )
+            call.response(resp)
+        return resp
+
+    @retry_policy(before_sleep=provider_retry_hook("status"))
+    @timed_provider_call("status")
+    async def _get(self, path: str, headers: Dict[str, str]) -> httpx.Response:
+        with capture.provider_call(self.name, "GET", self.base_url, path) as call:
+            resp = await shared_client().get(
+                f"{self.base_url}{path}", headers=headers, timeout=cap(PROVIDER_TIMEOUT_SEC, "provider")
+            )
+            call.response(resp)
+        return resp
+
+    @staticmethod
+    async def _parse(resp: httpx.Response) -> Dict[str, Any]:
+        try:
+            return await run_cpu(resp.json)
+        except Exception:
+            return {"raw_text": resp.text or ""}
+
+    # ---- хуки провайдера ----
+    @abstractmethod
+    def _pay_body(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def _output(self, block: Dict[str, Any], fields: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    def _redirect(
+        self, payload: Dict[str, Any], gateway_token: str, fields: Dict[str, Any], built: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        url = fields.get("redirect_url")
+        if url:
+            return {"url": url, "type": "redirect", "iframes": []}
+        return {"url": None, "type": "post_iframes", "iframes": []}
+
+    # ---- ответы ----
+    def _status_error(self, details: str, logs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        out = {
+            "result": "OK",
+            "status": "pending",
+            "details": details,
+            "amount": None,
+            "currency": None,
+            "logs": logs,
+        }
+        if self.spec.external_on_error:
+            out.update({"with_external_format": True, "provider_response_data": {}, "requisites": {}})
+        return out
+
+    # ---- Adapter API ----
+    async def pay(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        spec = self.spec
+        token = self._auth_token(payload)
+        body = self._pay_body(payload)
+        logs = [_log_entry(spec.gateway, spec.pay.log_url, {**body, **spec.log_mask}, "pay")]
+
+        try:
+            resp = await self._post(spec.pay.path, json_payload=body, headers=self._headers(token))
+            js = await self._parse(resp)
+            logs[-1]["status"] = resp.status_code
+            logs[-1]["response"] = js
+        except DeadlineExceeded:
+            # новый вызов провайдера уже не начинали — RP получит 504 и может повторить /pay
+            raise
+        except Exception as e:
+            logs[-1]["status"] = 599
+            logs[-1]["response"] = {"error": str(e)}
+            return {
+                "status": "OK",
+                "gateway_token": None,
+                "result": "declined",
+                "requisites": {},
+                "redirectRequest": {"url": None, "type": "post_iframes", "iframes": []},
+                "with_external_format": True,
+                "provider_response_data": {},
+                "logs": logs,
+            }
+
+        block, fields = spec.pay.extract(js)
+        gateway_token = str(fields["token"] or "")
+        provider_status = fields["status"]
+
+        # Провайдер ответил — дальше ничего не должно падать: ответ с gateway_token уйдёт в идемпотентность
+        # Сохраняем маппинг для статусов/вебхуков
+        await save_pay_mapping(
+            rp_token=payload["rp_token"],
+            order_number=payload["order_number"],
+            provider=self.name,
+            callback_url=payload["callback_url"],
+            provider_operation_id=gateway_token,
+            status=provider_status,
+            amount=payload.get("amount"),
+            currency=payload.get("currency"),
+            method=payload.get("_provider_method"),
+        )
+
+        try:
+            built = self._output(block, fields, payload)
+            redirect = self._redirect(payload, gateway_token, fields, built)
+        except Exception:
+            # ошибка хука адаптера: операция есть, отдаём её без реквизитов, а не 500 с повтором у провайдера
+            logger.exception("%s pay output failed for %s", self.name, payload["rp_token"])
+            built, redirect = {}, {"url": None, "type": "post_iframes", "iframes": []}
+        result = self._status_map(provider_status)
+        analytics.record_pay(self.name, payload.get("_provider_method"), payload.get("amount"), result)
+        requisites = built.get("requisites") or {}
+        provider_response_data = built.get("provider_response_data") or {}
+        await snapshots.capture(
+            payload["rp_token"], self.name,
+            status=result, provider_status=provider_status,
+            amount=payload.get("amount"), currency=payload.get("currency"),
+            requisites=requisites, provider_response_data=provider_response_data,
+        )
+        return {
+            "status": "OK",
+            "gateway_token": gateway_token or None,
+            "result": result,
+            "requisites": requisites,
+            "redirectRequest": redirect,
+            "with_external_format": True,
+            "provider_response_data": provider_response_data,
+            "logs": logs,
+        }
+
+    async def status(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        spec = self.spec
+        token = self._auth_token(payload)
+        mapping = await mapping_for(payload)
+        if not mapping or not mapping.get("provider_operation_id"):
+            return self._status_error(spec.missing_op_details, [])
+
+        op_id = mapping["provider_operation_id"]
+        logs = [_log_entry(spec.gateway, spec.status.log_url.format(op_id=op_id), {"id": op_id}, "status")]
+
+        try:
+            resp = await self._get(spec.status.path.format(op_id=op_id), headers=self._headers(token))
+            js = await self._parse(resp)
+            logs[-1]["status"] = resp.status_code
+            logs[-1]["response"] = js
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logs[-1]["status"] = 599
+            logs[-1]["response"] = {"error": str(e)}
+            # провайдер недоступен — последний известный ответ (stale) вместо голого pending без реквизитов
+            degraded = await degraded_status(mapping["rp_token"], f"Gateway unreachable: {e}", logs)
+            return degraded or self._status_error(f"Gateway unreachable: {e}", logs)
+
+        block, fields = spec.status.extract(js)
+        status_norm = self._status_map(fields["status"])
+        built = self._output(block, fields, payload)
+
+        currency = fields["currency"]
+        if spec.null_currencies and isinstance(currency, str) and currency.upper() in spec.null_currencies:
+            currency = None
+        requisites = built.get("requisites") or {}
+        provider_response_data = built.get("provider_response_data") or {}
+        await snapshots.capture(
+            mapping["rp_token"], self.name,
+            status=status_norm, provider_status=fields["status"],
+            amount=fields["amount"], currency=currency,
+            requisites=requisites, provider_response_data=provider_response_data,
+        )
+
+        return {
+            "result": "OK",
+            "status": status_norm,
+            "details": f"Transaction status: {status_norm}",
+            "amount": fields["amount"],
+            "currency": currency,
+            "logs": logs,
+            # чтобы RP мог обновить gateway_details при опросе
+            "with_external_format": True,
+            "provider_response_data": provider_response_data,
+            "requisites": requisites,
+        }
+
+    async def refund(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "result": "ERROR",
+            "status": "declined",
+            "details": self.spec.refund_details,
+            "amount": None,
+            "currency": None,
+            "logs": [],
+        }
+
+    async def payout(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "result": "ERROR",
+            "status": "declined",
+            "details": self.spec.payout_details,
+            "amount": None,
+            "currency": None,
+            "logs": [],
+        }
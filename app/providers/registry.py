@@ -1,11 +1,18 @@
+from ..settings import settings
 from .brusnika.adapter import BrusnikaAdapter
 from .forta.adapter import FortaAdapter
+from .stub.adapter import StubAdapter
+from .sandbox.adapter import SandboxAdapter
 
 # Инициализируем адаптеры
 _registry = {
     "Brusnika_SBP": BrusnikaAdapter(),
     "Forta_SBP_ECOM": FortaAdapter(),
 }
+if settings.STUB_PROVIDER_ENABLED:
+    _registry["Stub_Local"] = StubAdapter()
+if settings.SANDBOX_ENABLED:
+    _registry["Sandbox"] = SandboxAdapter()
 
 # Алиасы имён провайдеров → канонические ключи реестра
 _aliases = {
@@ -19,6 +26,13 @@ _aliases = {
     "forta_sbp": "Forta_SBP_ECOM",
     "forta_sbp_ecom": "Forta_SBP_ECOM",
     "sbp_ecom": "Forta_SBP_ECOM",
+
+    # Stub
+    "stub": "Stub_Local",
+    "stub_local": "Stub_Local",
+
+    # Sandbox
+    "sandbox": "Sandbox",
 }
 
 def get_provider_by_name(name: str | None):
@@ -27,6 +41,10 @@ def get_provider_by_name(name: str | None):
     key = _aliases.get(name.strip().lower(), name)
     return _registry.get(key)
 
+def provider_base_urls() -> list[str]:
+    """base_url сетевых адаптеров — для прогрева пула соединений на старте."""
+    return [a.base_url for a in _registry.values() if getattr(a, "base_url", None)]
+
 def resolve_provider_by_payment_method(payment_method: str | None):
     if not payment_method:
         return None
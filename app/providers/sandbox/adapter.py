@@ -0,0 +1,313 @@
+import asyncio
+import itertools
+import math
+import random
+import time
+from typing import Dict, Any, Optional, List, Set, Tuple
+import httpx
+from ...settings import settings
+from ...utils.http import retry_policy
+from ...metrics import timed_provider_call, provider_retry_hook
+from ...loopmon import run_cpu
+from ...deadline import DeadlineExceeded, cap, detach
+from ...txstatus import StatusTable
+from ...txcontext import mapping_for
+from ...snapshots import snapshots, degraded_status
+from ...analytics import analytics
+from ... import capture
+from ..framework import save_pay_mapping
+
+
+class SandboxAdapter:
+    """
+    Песочница для стенда (SANDBOX_ENABLED): ведёт себя как провайдер, но без сети.
+      - «вызов провайдера» проходит через тот же retry_policy/метрики, что и у боевых адаптеров;
+      - латентность — логнормальная (SANDBOX_LATENCY_MEDIAN_MS, SANDBOX_LATENCY_SIGMA);
+      - ошибки/таймауты — SANDBOX_ERROR_RATE / SANDBOX_TIMEOUT_RATE (httpx-исключения → ретраи);
+      - после pay сам шлёт вебхуки в шлюз (INPROGRESS → PAID|CANCELED) с задержкой,
+        дублями (SANDBOX_WEBHOOK_DUPLICATE_RATE) и перестановкой (SANDBOX_WEBHOOK_OUT_OF_ORDER_RATE).
+    """
+
+    name = "Sandbox"
+
+    def __init__(self):
+        self._rng = random.Random(settings.SANDBOX_SEED)
+        self._ids = itertools.count(1)
+        # op_id → {"status", "final", "amount", "currency", "order_id", "final_at"}
+        self._ops: Dict[str, Dict[str, Any]] = {}
+        self._webhook_client: Optional[httpx.AsyncClient] = None
+        # держим ссылки на фоновые рассыльщики вебхуков, иначе GC может снять задачу посреди рассылки
+        self._webhook_tasks: Set[asyncio.Task] = set()
+
+    # ---- симуляция провайдера ----
+    def _latency_sec(self) -> float:
+        median = settings.SANDBOX_LATENCY_MEDIAN_MS / 1000
+        if median <= 0:
+            return 0.0
+        return self._rng.lognormvariate(math.log(median), settings.SANDBOX_LATENCY_SIGMA)
+
+    async def _simulate(self, method: str, path: str, body: Optional[Dict[str, Any]]) -> httpx.Response:
+        request = httpx.Request(method, f"https://sandbox.local{path}")
+        roll = self._rng.random()
+        # как у настоящего клиента: таймаут попытки не дольше остатка дедлайна запроса
+        timeout = cap(settings.SANDBOX_TIMEOUT_SEC, "provider")
+        if roll < settings.SANDBOX_TIMEOUT_RATE:
+            await asyncio.sleep(timeout)
+            raise httpx.ReadTimeout("sandbox: injected timeout", request=request)
+        latency = self._latency_sec()
+        if latency > timeout:
+            await asyncio.sleep(timeout)
+            raise httpx.ReadTimeout("sandbox: latency exceeds timeout", request=request)
+        await asyncio.sleep(latency)
+        if roll < settings.SANDBOX_TIMEOUT_RATE + settings.SANDBOX_ERROR_RATE:
+            raise httpx.ConnectError("sandbox: injected connection error", request=request)
+        if method == "POST":
+            return httpx.Response(200, json=self._create_op(body or {}), request=request)
+        return httpx.Response(200, json=self._op_status(path.rsplit("/", 1)[-1]), request=request)
+
+    def _create_op(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        op_id = f"sbx-{next(self._ids)}"
+        if len(self._ops) >= settings.SANDBOX_MAX_OPS:
+            # самые старые операции забываем — песочница не должна расти бесконечно
+            self._ops.pop(next(iter(self._ops)))
+        final = "PAID" if self._rng.random() < settings.SANDBOX_APPROVE_RATE else "CANCELED"
+        self._ops[op_id] = {
+            "status": "INPROGRESS",
+            "final": final,
+            "amount": body.get("amount"),
+            "currency": body.get("currency") or "RUB",
+            "order_id": body.get("orderId"),
+            "final_at": time.time() + settings.SANDBOX_WEBHOOK_DELAY_MS / 1000,
+        }
+        return {
+            "data": {
+                "id": op_id,
+                "status": "INPROGRESS",
+                "amount": body.get("amount"),
+                "qrCodeLink": f"https://qr.nspk.ru/sandbox/{op_id}",
+                "receiverName": "Sandbox Receiver",
+                "receiverBank": "Sandbox Bank",
+                "receiverPhone": "79990000000",
+            }
+        }
+
+    def _op_status(self, op_id: str) -> Dict[str, Any]:
+        op = self._ops.get(op_id)
+        if not op:
+            return {"data": None}
+        if op["status"] == "INPROGRESS" and time.time() >= op["final_at"]:
+            op["status"] = op["final"]
+        return {"data": {"id": op_id, "status": op["status"], "amount": op["amount"], "currency": op["currency"]}}
+
+    @retry_policy(before_sleep=provider_retry_hook("pay"))
+    @timed_provider_call("pay")
+    async def _post(self, path: str, json_payload: Dict[str, Any]) -> httpx.Response:
+        with capture.provider_call(self.name, "POST", "https://sandbox.local", path, json_payload) as call:
+            resp = await self._simulate("POST", path, json_payload)
+            call.response(resp)
+        return resp
+
+    @retry_policy(before_sleep=provider_retry_hook("status"))
+    @timed_provider_call("status")
+    async def _get(self, path: str) -> httpx.Response:
+        with capture.provider_call(self.name, "GET", "https://sandbox.local", path) as call:
+            resp = await self._simulate("GET", path, None)
+            call.response(resp)
+        return resp
+
+    # ---- вебхуки песочницы в шлюз ----
+    def _webhook_plan(self, op_id: str) -> List[Tuple[float, Dict[str, Any]]]:
+        """(задержка от pay в секундах, событие), по возрастанию задержки."""
+        op = self._ops[op_id]
+        delay = settings.SANDBOX_WEBHOOK_DELAY_MS / 1000
+        progress = {"operationId": op_id, "orderId": op["order_id"], "amount": op["amount"], "status": "INPROGRESS"}
+        final = {**progress, "status": op["final"]}
+        plan = [(0.0, progress), (delay, final)]
+        if self._rng.random() < settings.SANDBOX_WEBHOOK_OUT_OF_ORDER_RATE:
+            # промежуточный статус опаздывает и приходит уже после финального
+            plan = [(delay, final), (delay * 1.5, progress)]
+        if self._rng.random() < settings.SANDBOX_WEBHOOK_DUPLICATE_RATE:
+            plan.append((delay * 2, dict(final)))
+        return plan
+
+    async def _emit_webhooks(self, op_id: str) -> None:
+        detach()
+        if self._webhook_client is None:
+            self._webhook_client = httpx.AsyncClient(timeout=15)
+        elapsed = 0.0
+        for at, event in self._webhook_plan(op_id):
+            await asyncio.sleep(at - elapsed)
+            elapsed = at
+            op = self._ops.get(op_id)
+            if op is not None and event["status"] != "INPROGRESS":
+                op["status"] = event["status"]
+            try:
+                await self._webhook_client.post(settings.SANDBOX_WEBHOOK_URL, json=event)
+            except httpx.HTTPError:
+                pass
+
+    # ---- Utils ----
+    _status_map = StatusTable({"approved": ("PAID",), "declined": ("CANCELED", "FAILED")})
+
+    def _build_output(self, data_block: Dict[str, Any]) -> Dict[str, Any]:
+        link = data_block.get("qrCodeLink")
+        holder = data_block.get("receiverName") or ""
+        bank_name = data_block.get("receiverBank") or ""
+        requisites = {"link": {"url": link}, "holder": holder, "bank_name": bank_name} if link else {}
+        return {"requisites": requisites, "provider_response_data": {**data_block}}
+
+    # ---- Adapter API ----
+    async def pay(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        body = {"orderId": payload["order_number"], "amount": int(payload["amount"]), "currency": payload.get("currency")}
+        logs = [{
+            "gateway": "sandbox",
+            "request": {"url": "/payin", "params": body},
+            "status": None,
+            "response": None,
+            "kind": "pay",
+        }]
+
+        try:
+            resp = await self._post("/payin", json_payload=body)
+            js = await run_cpu(resp.json)
+            logs[-1]["status"] = resp.status_code
+            logs[-1]["response"] = js
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logs[-1]["status"] = 599
+            logs[-1]["response"] = {"error": str(e)}
+            return {
+                "status": "OK",
+                "gateway_token": None,
+                "result": "declined",
+                "requisites": {},
+                "redirectRequest": {"url": None, "type": "post_iframes", "iframes": []},
+                "with_external_format": True,
+                "provider_response_data": {},
+                "logs": logs,
+            }
+
+        data_block = js.get("data") or {}
+        gateway_token = str(data_block.get("id") or "")
+        provider_status = data_block.get("status")
+
+        # провайдер ответил — сбой записи маппинга не должен уронить /pay (см. save_pay_mapping)
+        await save_pay_mapping(
+            rp_token=payload["rp_token"],
+            order_number=payload["order_number"],
+            provider=self.name,
+            callback_url=payload["callback_url"],
+            provider_operation_id=gateway_token,
+            status=provider_status,
+            amount=payload.get("amount"),
+            currency=payload.get("currency"),
+            method=payload.get("_provider_method"),
+        )
+        task = asyncio.ensure_future(self._emit_webhooks(gateway_token))
+        self._webhook_tasks.add(task)
+        task.add_done_callback(self._webhook_tasks.discard)
+
+        built = self._build_output(data_block)
+        link = data_block.get("qrCodeLink")
+        result = self._status_map(provider_status)
+        analytics.record_pay(self.name, payload.get("_provider_method"), payload.get("amount"), result)
+        await snapshots.capture(
+            payload["rp_token"], self.name,
+            status=result, provider_status=provider_status,
+            amount=payload.get("amount"), currency=payload.get("currency"),
+            requisites=built["requisites"], provider_response_data=built["provider_response_data"],
+        )
+        return {
+            "status": "OK",
+            "gateway_token": gateway_token or None,
+            "result": result,
+            "requisites": built["requisites"],
+            "redirectRequest": {"url": link, "type": "redirect", "iframes": []} if link
+            else {"url": None, "type": "post_iframes", "iframes": []},
+            "with_external_format": True,
+            "provider_response_data": built["provider_response_data"],
+            "logs": logs,
+        }
+
+    async def status(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        mapping = await mapping_for(payload)
+        if not mapping or not mapping.get("provider_operation_id"):
+            return {
+                "result": "OK",
+                "status": "pending",
+                "details": "no operation id in mapping",
+                "amount": None,
+                "currency": None,
+                "logs": [],
+            }
+
+        op_id = mapping["provider_operation_id"]
+        logs = [{
+            "gateway": "sandbox",
+            "request": {"url": f"/operation/{op_id}", "params": {"id": op_id}},
+            "status": None,
+            "response": None,
+            "kind": "status",
+        }]
+        try:
+            resp = await self._get(f"/operation/{op_id}")
+            js = await run_cpu(resp.json)
+            logs[-1]["status"] = resp.status_code
+            logs[-1]["response"] = js
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logs[-1]["status"] = 599
+            logs[-1]["response"] = {"error": str(e)}
+            degraded = await degraded_status(mapping["rp_token"], f"Gateway unreachable: {e}", logs)
+            if degraded:
+                return degraded
+            return {
+                "result": "OK",
+                "status": "pending",
+                "details": f"Gateway unreachable: {e}",
+                "amount": None,
+                "currency": None,
+                "logs": logs,
+            }
+
+        data_block = js.get("data") or {}
+        status_norm = self._status_map(data_block.get("status"))
+        await snapshots.capture(
+            mapping["rp_token"], self.name,
+            status=status_norm, provider_status=data_block.get("status"),
+            amount=data_block.get("amount"), currency=data_block.get("currency"),
+            requisites={}, provider_response_data=data_block,
+        )
+        return {
+            "result": "OK",
+            "status": status_norm,
+            "details": f"Transaction status: {status_norm}",
+            "amount": data_block.get("amount"),
+            "currency": data_block.get("currency"),
+            "logs": logs,
+            "with_external_format": True,
+            "provider_response_data": data_block,
+            "requisites": {},
+        }
+
+    async def refund(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "result": "ERROR",
+            "status": "declined",
+            "details": "Refund not supported by sandbox",
+            "amount": None,
+            "currency": None,
+            "logs": [],
+        }
+
+    async def payout(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "result": "ERROR",
+            "status": "declined",
+            "details": "Payout not implemented for sandbox",
+            "amount": None,
+            "currency": None,
+            "logs": [],
+        }
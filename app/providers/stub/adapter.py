@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+from typing import Dict, Any
+from ...settings import settings
+
+
+class StubAdapter:
+    """
+    Локальный провайдер-заглушка без сетевых вызовов (включается STUB_PROVIDER_ENABLED).
+    Нужен для проверки пакетных выплат и прогонов на стенде:
+      - payout идемпотентен по _idempotency_key (повтор отдаёт тот же результат);
+      - amount > 0 → approved, иначе declined;
+      - задержка ответа — STUB_PROVIDER_LATENCY_MS.
+    """
+
+    name = "Stub_Local"
+
+    def __init__(self):
+        self._payouts: Dict[str, Dict[str, Any]] = {}
+
+    async def _latency(self) -> None:
+        if settings.STUB_PROVIDER_LATENCY_MS > 0:
+            await asyncio.sleep(settings.STUB_PROVIDER_LATENCY_MS / 1000)
+
+    def _token(self, key: str) -> str:
+        return "stub-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    async def pay(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        await self._latency()
+        return {
+            "status": "OK",
+            "gateway_token": self._token(str(payload.get("rp_token"))),
+            "result": "pending",
+            "requisites": {},
+            "redirectRequest": {"url": None, "type": "post_iframes", "iframes": []},
+            "with_external_format": True,
+            "provider_response_data": {},
+            "logs": [],
+        }
+
+    async def status(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        await self._latency()
+        return {
+            "result": "OK",
+            "status": "pending",
+            "details": "Transaction status: pending",
+            "amount": None,
+            "currency": None,
+            "logs": [],
+        }
+
+    async def refund(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "result": "ERROR",
+            "status": "declined",
+            "details": "Refund not supported by stub provider",
+            "amount": None,
+            "currency": None,
+            "logs": [],
+        }
+
+    async def payout(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        key = str(payload.get("_idempotency_key") or "")
+        if key and key in self._payouts:
+            return self._payouts[key]
+
+        await self._latency()
+        payment = (payload.get("params", {}).get("payment") or payload.get("payment") or {}) or {}
+        try:
+            amount = int(payment.get("amount") or 0)
+        except (TypeError, ValueError):
+            amount = 0
+        approved = amount > 0
+        result = {
+            "result": "OK" if approved else "ERROR",
+            "status": "approved" if approved else "declined",
+            "gateway_token": self._token(key or str(payment.get("token"))),
+            "details": "Payout processed by stub" if approved else "Invalid amount",
+            "amount": amount,
+            "currency": payment.get("currency"),
+            "logs": [],
+        }
+        if key:
+            self._payouts[key] = result
+        return result
@@ -0,0 +1,301 @@
+"""
+Сверка реестра провайдера (settlement-файла) с маппингами шлюза.
+
+    python -m app.reconcile brusnika-2026-10-18.csv.gz --provider Brusnika_SBP --report mismatches.ndjson
+    python -m app.reconcile forta.json --provider forta --since 2026-10-18 --until 2026-10-19 --apply
+
+Файл (CSV с заголовком, NDJSON или JSON-массив; .gz распаковывается на лету) читается потоком и пачками
+по RECONCILE_BATCH_ROWS грузится во временную таблицу. Привязка к mappings — два UPDATE внутри SQLite
+(по provider_operation_id, затем по order_number), без запроса на каждую строку. Отчёт — NDJSON по расхождениям:
+  missing         — операции нет в шлюзе;
+  status_drift    — статус провайдера (через таблицу статусов адаптера) расходится с сохранённым;
+  amount_drift    — сумма или валюта не совпадают;
+  not_in_settlement — маппинг за период --since/--until, которого нет в реестре (только если период задан).
+Сводка печатается в stdout. --apply: расхождения статуса в финальный статус провайдера исправляются одним UPDATE
+в одной транзакции, затем по каждому исправлению уходит коллбэк в RP (не больше --callback-concurrency сразу).
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import sys
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+from .settings import settings
+from .providers.registry import get_provider_by_name
+from .export import parse_time
+from .db import (
+    settlement_session,
+    load_settlement,
+    match_settlement,
+    iter_settlement_matches,
+    iter_unsettled_mappings,
+    add_settlement_corrections,
+    apply_settlement_corrections,
+    iter_settlement_corrections,
+)
+
+# Поле реестра → имена колонок/ключей у разных провайдеров (первое непустое)
+FIELD_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "op_id": ("provider_operation_id", "operation_id", "operationId", "idPlatform", "guid", "id"),
+    "order_number": ("order_number", "merchantOrderId", "idTransactionMerchant", "orderId", "order_id"),
+    "status": ("status", "state"),
+    "amount": ("amount", "sum"),
+    "currency": ("currency",),
+}
+FIELDS = tuple(FIELD_ALIASES)
+
+# Исправляем только в финальные статусы: промежуточный статус реестра не повод трогать транзакцию
+FINAL_RESULTS = ("approved", "declined", "refunded")
+
+_JSON_CHUNK = 1 << 16
+
+
+def _open_text(path: str) -> TextIO:
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, "r", encoding="utf-8-sig", newline="")
+
+
+def _iter_json_array(f: TextIO) -> Iterator[Dict[str, Any]]:
+    """Элементы JSON-массива верхнего уровня по одному, без загрузки файла целиком."""
+    decoder = json.JSONDecoder()
+    buf = f.read(_JSON_CHUNK).lstrip()
+    if not buf.startswith("["):
+        raise ValueError("JSON settlement must be an array of objects or NDJSON")
+    buf, pos, eof = buf[1:], 0, False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(_JSON_CHUNK)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield obj
+        pos = end
+        if len(buf) - pos < _JSON_CHUNK and not eof:
+            chunk = f.read(_JSON_CHUNK)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+
+class _Prepend:
+    """Возвращает уже прочитанный символ обратно в начало потока (для определения формата JSON)."""
+
+    def __init__(self, head: str, f: TextIO):
+        self.head = head
+        self.f = f
+
+    def read(self, n: int) -> str:
+        if self.head:
+            head, self.head = self.head, ""
+            return head + self.f.read(n - 1)
+        return self.f.read(n)
+
+
+def _pick(record: Dict[str, Any], keys: Sequence[str]) -> Optional[str]:
+    for k in keys:
+        v = record.get(k)
+        if v not in (None, ""):
+            return str(v)
+    return None
+
+
+def iter_settlement(f: TextIO, fmt: str, overrides: Dict[str, str]) -> Iterator[Tuple[Optional[str], ...]]:
+    """Записи реестра как (op_id, order_number, status, amount, currency), по одной."""
+    keys = [(overrides[name],) if name in overrides else aliases for name, aliases in FIELD_ALIASES.items()]
+    if fmt == "csv":
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        # колонка поля — первый из алиасов, который есть в заголовке; ищем один раз, а не в каждой строке
+        cols = [next((header.index(k) for k in ks if k in header), None) for ks in keys]
+        width = len(header)
+        for row in reader:
+            if len(row) < width:
+                row += [""] * (width - len(row))
+            yield tuple((row[i] or None) if i is not None else None for i in cols)
+        return
+
+    first = f.read(1)
+    while first and first.isspace():
+        first = f.read(1)
+    if first == "[":
+        records = _iter_json_array(_Prepend(first, f))
+    else:
+        records = _iter_ndjson(first + f.readline(), f)
+    for record in records:
+        yield tuple(_pick(record, ks) for ks in keys)
+
+
+def _iter_ndjson(line: str, f: TextIO) -> Iterator[Dict[str, Any]]:
+    while line:
+        if line.strip():
+            yield json.loads(line)
+        line = f.readline()
+
+
+def _amount(v: Any) -> Optional[Decimal]:
+    if v in (None, ""):
+        return None
+    try:
+        return Decimal(str(v))
+    except InvalidOperation:
+        return None
+
+
+def _classify(row: Sequence[Any], status_map) -> Tuple[List[Dict[str, Any]], Optional[Tuple[int, str, str]]]:
+    """Расхождения по одной строке реестра и (mapping_id, статус, результат RP) для исправления, если нужно."""
+    (line, op_id, order_number, status, amount, currency,
+     mapping_id, rp_token, _, gw_op_id, gw_status, gw_amount, gw_currency) = row
+    base = {"line": line, "provider_operation_id": op_id or gw_op_id, "order_number": order_number, "rp_token": rp_token}
+    if mapping_id is None:
+        return [{"kind": "missing", **base, "settlement_status": status, "settlement_amount": amount}], None
+
+    issues: List[Dict[str, Any]] = []
+    correction = None
+    # сравнение «как есть» отсекает подавляющее большинство строк без нормализации и Decimal
+    if status and status != gw_status:
+        result, gw_result = status_map(status), status_map(gw_status)
+        if result != gw_result:
+            issues.append({
+                "kind": "status_drift", **base,
+                "gateway_status": gw_status, "gateway_result": gw_result,
+                "settlement_status": status, "settlement_result": result,
+            })
+            if result in FINAL_RESULTS:
+                correction = (mapping_id, status, result)
+    amount_differs = (
+        amount is not None and gw_amount is not None and amount != str(gw_amount)
+        and _amount(amount) != _amount(gw_amount)
+    )
+    currency_differs = (
+        bool(currency and gw_currency) and currency != gw_currency and currency.upper() != gw_currency.upper()
+    )
+    if amount_differs or currency_differs:
+        issues.append({
+            "kind": "amount_drift", **base,
+            "gateway_amount": gw_amount, "gateway_currency": gw_currency,
+            "settlement_amount": amount, "settlement_currency": currency,
+        })
+    return issues, correction
+
+
+async def _send_corrections(db, concurrency: int) -> Dict[str, int]:
+    from .callbacks.rp_client import RPCallbackClient
+
+    client = RPCallbackClient()
+    sem = asyncio.Semaphore(max(1, concurrency))
+    sent = {"sent": 0, "failed": 0}
+
+    async def _one(result: str, url: str, op_id: Optional[str]) -> None:
+        async with sem:
+            try:
+                # тот же формат, что и у коллбэков из вебхуков провайдера
+                await client.send_callback(url, {"result": result, "gateway_token": op_id, "logs": [], "requisites": None})
+                sent["sent"] += 1
+            except Exception:
+                sent["failed"] += 1
+
+    async for page in iter_settlement_corrections(db, settings.RECONCILE_BATCH_ROWS):
+        await asyncio.gather(*(_one(result, url, op_id) for _, result, url, op_id in page if url))
+    return sent
+
+
+async def reconcile(args: argparse.Namespace, report: TextIO) -> Dict[str, Any]:
+    adapter = get_provider_by_name(args.provider)
+    if adapter is None:
+        raise SystemExit(f"unknown provider: {args.provider}")
+    overrides = dict(kv.split("=", 1) for kv in args.field)
+    batch = settings.RECONCILE_BATCH_ROWS
+    summary: Dict[str, Any] = {"provider": adapter.name, "rows": 0, "missing": 0, "status_drift": 0, "amount_drift": 0}
+
+    async with settlement_session() as db:
+        rows: List[Tuple] = []
+        with _open_text(args.file) as f:
+            for line, record in enumerate(iter_settlement(f, args.format, overrides), 1):
+                rows.append((line, *record))
+                if len(rows) >= batch:
+                    await load_settlement(db, rows)
+                    summary["rows"] = line
+                    rows = []
+            if rows:
+                await load_settlement(db, rows)
+                summary["rows"] = rows[-1][0]
+        await match_settlement(db, adapter.name)
+
+        corrections: List[Tuple[int, str, str]] = []
+        async for page in iter_settlement_matches(db, batch):
+            out = []
+            for row in page:
+                issues, correction = _classify(row, adapter._status_map)
+                for issue in issues:
+                    summary[issue["kind"]] += 1
+                    out.append(json.dumps(issue, ensure_ascii=False))
+                if correction is not None:
+                    corrections.append(correction)
+            if out:
+                report.write("\n".join(out) + "\n")
+            if args.apply and corrections:
+                await add_settlement_corrections(db, corrections)
+            corrections = []
+
+        if args.since is not None and args.until is not None:
+            summary["not_in_settlement"] = 0
+            since, until = parse_time(args.since), parse_time(args.until)
+            async for page in iter_unsettled_mappings(db, adapter.name, since, until, batch):
+                summary["not_in_settlement"] += len(page)
+                report.write("\n".join(json.dumps({
+                    "kind": "not_in_settlement", "rp_token": r[1], "order_number": r[2],
+                    "provider_operation_id": r[3], "gateway_status": r[4],
+                }, ensure_ascii=False) for r in page) + "\n")
+
+        if args.apply:
+            summary["corrected"] = await apply_settlement_corrections(db)
+            summary["callbacks"] = await _send_corrections(db, args.callback_concurrency)
+    return summary
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.reconcile", description="Reconcile a provider settlement file")
+    ap.add_argument("file", help="CSV/NDJSON/JSON реестр (.gz — сжатый, '-' — stdin)")
+    ap.add_argument("--provider", required=True, help="имя или алиас провайдера из реестра адаптеров")
+    ap.add_argument("--format", choices=("csv", "json"), help="по умолчанию — по расширению файла")
+    ap.add_argument("--field", action="append", default=[], metavar="NAME=KEY",
+                    help=f"имя колонки реестра для поля ({', '.join(FIELDS)}), например op_id=guid")
+    ap.add_argument("--since", help="с --until: искать маппинги за период, которых нет в реестре")
+    ap.add_argument("--until")
+    ap.add_argument("--report", help="NDJSON с расхождениями; по умолчанию stderr")
+    ap.add_argument("--apply", action="store_true", help="исправить статусы и отправить коллбэки в RP")
+    ap.add_argument("--callback-concurrency", type=int, default=8)
+    args = ap.parse_args()
+
+    for kv in args.field:
+        name = kv.split("=", 1)[0]
+        if "=" not in kv or name not in FIELD_ALIASES:
+            ap.error(f"--field expects NAME=KEY with NAME in {', '.join(FIELDS)}")
+    if args.format is None:
+        stem = args.file[:-3] if args.file.endswith(".gz") else args.file
+        args.format = "csv" if stem.endswith(".csv") else "json"
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report:
+            summary = asyncio.run(reconcile(args, report))
+    else:
+        summary = asyncio.run(reconcile(args, sys.stderr))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
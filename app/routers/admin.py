@@ -1,23 +1,181 @@
 from fastapi import APIRouter, HTTPException, status, Request
-from app.db import update_status_by_token_any, get_mapping_by_token_any
+from fastapi.responses import Response, StreamingResponse
+from app.db import update_status_by_token_any, get_mapping_by_token_any, bulk_update_status
 from app.settings import settings
-from app.callbacks.rp_client import send_callback_to_rp
+from app.schemas.admin import BulkStatusRequest
+from app.logstore import fetch_logs
 
 router = APIRouter()
 
 ADMIN_SECRET_HEADER = "X-Admin-Secret"
 ADMIN_SECRET = "BtdA2653"  # Задайте в .env
 
-@router.post("/admin/update_status")
-async def admin_update_status(request: Request, token: str, new_status: str):
+
+def _require_admin(request: Request) -> None:
     secret = request.headers.get(ADMIN_SECRET_HEADER)
     if secret != ADMIN_SECRET:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+
+@router.post("/admin/update_status")
+async def admin_update_status(request: Request, token: str, new_status: str):
+    _require_admin(request)
     # Обновить статус в БД
     await update_status_by_token_any(token, new_status)
     tx = await get_mapping_by_token_any(token)
     if not tx:
         raise HTTPException(status_code=404, detail="Transaction not found")
-    # Отправить коллбек в RP
+    # Отправить коллбек в RP (модуль с jwt/AES грузится только здесь)
+    from app.callbacks.rp_client import send_callback_to_rp
     await send_callback_to_rp(tx)
     return {"result": "ok", "token": token, "new_status": new_status}
+
+
+@router.post("/admin/update_status/bulk")
+async def admin_update_status_bulk(request: Request, body: BulkStatusRequest):
+    """
+    Массовая смена статусов: все UPDATE — одной транзакцией, коллбэки в RP — в фоновую очередь с ограничением темпа.
+    Ответ сразу после записи в БД; прогресс коллбэков — GET /admin/jobs/{job_id}.
+    """
+    _require_admin(request)
+    if not body.items:
+        raise HTTPException(status_code=400, detail="items must not be empty")
+    if len(body.items) > settings.ADMIN_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"too many items (max {settings.ADMIN_BULK_MAX_ITEMS})")
+
+    from app.jobs import jobs
+    from app.callbacks.queue import callback_queue
+
+    updated, not_found = await bulk_update_status([(i.token, i.new_status) for i in body.items])
+    # задание заводится после записи: упавший UPDATE не оставит в admin_jobs вечно running
+    job = await jobs.create("bulk_update_status", total=len(body.items))
+    job.inc("updated", len(updated))
+    job.inc("not_found", len(not_found))
+    queued = callback_queue.submit(job, updated if body.callbacks else ())
+    job.inc("callbacks_queued", queued)
+    return {
+        "job_id": job.id,
+        "updated": len(updated),
+        "not_found": not_found[:100],
+        "callbacks_queued": queued,
+    }
+
+
+@router.get("/admin/jobs/{job_id}")
+async def admin_job(request: Request, job_id: str):
+    _require_admin(request)
+    from app.jobs import job_status
+    job = await job_status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/admin/analytics")
+async def admin_analytics(request: Request, hours: int = 24, provider: str | None = None, method: str | None = None):
+    """
+    Конверсия, время до approved и объём по провайдеру, методу и часу за последние hours часов.
+    Читаются только часовые агрегаты (app/analytics.py) — время ответа не зависит от числа транзакций.
+    """
+    _require_admin(request)
+    if not 1 <= hours <= settings.ANALYTICS_MAX_HOURS:
+        raise HTTPException(status_code=400, detail=f"hours must be between 1 and {settings.ANALYTICS_MAX_HOURS}")
+    from app.analytics import report
+    return await report(hours, provider, method)
+
+
+@router.get("/admin/search")
+async def admin_search(
+    request: Request,
+    order_prefix: str | None = None,
+    provider: str | None = None,
+    status: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    limit: int = 50,
+    cursor: str | None = None,
+):
+    """
+    Поиск транзакций: префикс order_number, провайдер, статус (как в mappings.status), since <= created_at < until.
+    С order_prefix — по номеру заказа, иначе новые сначала. Следующая страница — с cursor=next_cursor
+    и теми же фильтрами.
+    """
+    _require_admin(request)
+    if not 1 <= limit <= settings.ADMIN_SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {settings.ADMIN_SEARCH_MAX_LIMIT}")
+    from app.export import parse_time
+    from app.search import search
+    try:
+        since_ts = parse_time(since) if since else None
+        until_ts = parse_time(until) if until else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since/until must be ISO 8601 or unix time")
+    try:
+        return await search(order_prefix, provider, status, since_ts, until_ts, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/admin/logs/{token}")
+async def admin_provider_logs(request: Request, token: str):
+    """Полные логи запросов к провайдеру по транзакции (rp_token или order_number)."""
+    _require_admin(request)
+    tx = await get_mapping_by_token_any(token)
+    if not tx:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return {"token": tx["rp_token"], "logs": await fetch_logs(tx["rp_token"])}
+
+
+@router.post("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 10.0, interval_ms: float = 5.0, format: str = "collapsed"):
+    """
+    Сэмплирующий профиль event loop этого воркера на seconds секунд (не больше 60).
+    format=collapsed — текст для flamegraph/speedscope, format=pstats — файл для pstats.Stats.
+    """
+    _require_admin(request)
+    if format not in {"collapsed", "pstats"}:
+        raise HTTPException(status_code=400, detail="format must be collapsed or pstats")
+
+    # Модуль профайлера нужен редко — импортируем по требованию
+    from app.profiler import profile_for, ProfilerBusy
+    try:
+        profiler = await profile_for(seconds, interval_ms / 1000)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+
+    headers = {
+        "X-Profile-Samples": str(profiler.total_samples),
+        "X-Profile-Duration": f"{profiler.duration:.3f}",
+    }
+    if format == "pstats":
+        headers["Content-Disposition"] = 'attachment; filename="profile.pstats"'
+        return Response(profiler.pstats_bytes(), media_type="application/octet-stream", headers=headers)
+    return Response(profiler.collapsed(), media_type="text/plain; charset=utf-8", headers=headers)
+
+
+@router.get("/admin/export")
+async def admin_export(
+    request: Request,
+    since: str,
+    until: str,
+    provider: str | None = None,
+    status: str | None = None,
+    format: str = "ndjson",
+    gzip: bool = False,
+):
+    """Потоковая выгрузка маппингов с since <= created_at < until (ISO 8601 или unix time) в NDJSON/CSV."""
+    _require_admin(request)
+    from app.export import FORMATS, export_filename, export_stream, parse_time
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    try:
+        since_ts, until_ts = parse_time(since), parse_time(until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since/until must be ISO 8601 or unix time")
+
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        export_stream(since_ts, until_ts, provider, status, format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(format, gzip)}"'},
+    )
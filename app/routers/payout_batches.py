@@ -0,0 +1,54 @@
+import json
+from typing import Any, Dict, List, Union
+
+from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi.responses import StreamingResponse
+
+from ..payouts import create_batch, batch_progress, stream_results, parse_batch_file, dispatcher
+
+router = APIRouter()
+
+
+@router.on_event("startup")
+async def _startup():
+    # Подхватываем пакеты, брошенные упавшим/перезапущенным воркером
+    dispatcher.start_resume_loop()
+
+
+@router.post("/payout/batch")
+async def payout_batch(body: Union[List[Dict[str, Any]], Dict[str, Any]]):
+    """
+    Пакет выплат: JSON-массив тел /payout или {"items": [...]}.
+    Каждая позиция может содержать idempotency_key (иначе берётся payment.token или batch_id:seq).
+    Ответ: {"batch_id": "...", "total": N}; результаты — GET /payout/batch/{batch_id}/results.
+    """
+    items = body.get("items") if isinstance(body, dict) else body
+    return await create_batch(items)
+
+
+@router.post("/payout/batch/upload")
+async def payout_batch_upload(file: UploadFile = File(...)):
+    """Тот же пакет, но файлом: JSON-массив или NDJSON."""
+    return await create_batch(parse_batch_file(await file.read()))
+
+
+@router.get("/payout/batch/{batch_id}")
+async def payout_batch_status(batch_id: str):
+    batch = await batch_progress(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+
+@router.get("/payout/batch/{batch_id}/results")
+async def payout_batch_results(batch_id: str, after: int = -1):
+    """NDJSON-стрим результатов по позициям (в порядке seq); after — продолжить с позиции после seq."""
+    batch = await batch_progress(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    async def _lines():
+        async for item in stream_results(batch_id, batch["total"], after):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
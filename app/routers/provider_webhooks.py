@@ -1,26 +1,20 @@
 from fastapi import APIRouter, Request, Header, HTTPException
-from ..db import get_mapping_by_token_any, update_status_by_token_any
+from ..txcontext import TxContext
+from ..txstatus import advance
 from ..callbacks.rp_client import RPCallbackClient
 from ..settings import settings
+from ..metrics import WEBHOOKS
 import hashlib
 
 router = APIRouter()
 
 
-def _to_rp_result(provider_status: str | None) -> str:
-    s = (provider_status or "").lower()
-    if s in {"paid", "success", "confirmed"}:
-        return "approved"
-    if s in {"cancelled", "canceled", "declined", "failed", "expired"}:
-        return "declined"
-    return "pending"
-
-
 @router.post("/provider/brusnika/webhook")
 async def brusnika_webhook(request: Request, x_signature: str | None = Header(default=None)):
     try:
         payload = await request.json()
     except Exception:
+        WEBHOOKS.labels("brusnika", "invalid").inc()
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
     order_number = payload.get("merchantOrderId") or payload.get("orderId")
@@ -28,24 +22,31 @@ async def brusnika_webhook(request: Request, x_signature: str | None = Header(de
     platform_id = payload.get("idPlatform") or payload.get("platformOperationId")
 
     if not order_number:
+        WEBHOOKS.labels("brusnika", "invalid").inc()
         raise HTTPException(status_code=400, detail="merchantOrderId is required in webhook")
 
-    mapping = await get_mapping_by_token_any(order_number)
-    if not mapping:
+    tx = await TxContext.resolve("/provider/brusnika/webhook", order_number)
+    if tx.mapping is None:
+        WEBHOOKS.labels("brusnika", "unknown_tx").inc()
         return {"ok": True}
 
-    await update_status_by_token_any(mapping["rp_token"], provider_status or "unknown")
+    # повтор, промежуточный или запоздавший статус — без записи и коллбэка
+    rp_result = await advance(tx, provider_status, "brusnika")
+    if rp_result is None:
+        WEBHOOKS.labels("brusnika", "skipped").inc()
+        return {"ok": True}
+    WEBHOOKS.labels("brusnika", rp_result).inc()
 
     callback_payload = {
-        "result": _to_rp_result(provider_status),
-        "gateway_token": str(platform_id) if platform_id else mapping.get("provider_operation_id"),
+        "result": rp_result,
+        "gateway_token": str(platform_id) if platform_id else tx.mapping.get("provider_operation_id"),
         "logs": [],
         "requisites": None
     }
 
     client = RPCallbackClient()
     try:
-        await client.send_callback(mapping["callback_url"], callback_payload)
+        await client.send_callback(tx.mapping["callback_url"], callback_payload)
     except Exception:
         pass
 
@@ -68,6 +69,7 @@ async def forta_webhook(request: Request):
     try:
         payload = await request.json()
     except Exception:
+        WEBHOOKS.labels("forta", "invalid").inc()
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
     guid = str(payload.get("guid") or "")
@@ -82,29 +84,77 @@ async def forta_webhook(request: Request):
         check_str = f"{order_id}{amount}{prov_token}"
         calc = hashlib.md5(check_str.encode("utf-8")).hexdigest()
         if calc != incoming_sign:
+            WEBHOOKS.labels("forta", "invalid").inc()
             raise HTTPException(status_code=401, detail="invalid sign")
 
     # Ищем маппинг по guid или orderId
-    mapping = None
-    if guid:
-        mapping = await get_mapping_by_token_any(guid)
-    if not mapping and order_id:
-        mapping = await get_mapping_by_token_any(order_id)
-    if not mapping:
+    tx = await TxContext.resolve("/provider/forta/webhook", guid, order_id)
+    if tx.mapping is None:
+        WEBHOOKS.labels("forta", "unknown_tx").inc()
+        return {"ok": True}
+
+    rp_result = await advance(tx, status, "forta")
+    if rp_result is None:
+        WEBHOOKS.labels("forta", "skipped").inc()
+        return {"ok": True}
+    WEBHOOKS.labels("forta", rp_result).inc()
+
+    client = RPCallbackClient()
+    callback_payload = {
+        "result": rp_result,
+        "gateway_token": guid or tx.mapping.get("provider_operation_id"),
+        "logs": [],
+        "requisites": None
+    }
+    try:
+        await client.send_callback(tx.mapping["callback_url"], callback_payload)
+    except Exception:
+        pass
+
+    return {"ok": True}
+
+
+# ---------- Sandbox webhook ----------
+async def sandbox_webhook(request: Request):
+    """
+    Вебхук песочницы; маршрут есть только с SANDBOX_ENABLED. Подписи нет, поэтому трогает только маппинги Sandbox:
+    {"operationId": "sbx-1", "orderId": "ORD123", "amount": 1000, "status": "INPROGRESS|PAID|CANCELED"}
+    """
+    try:
+        payload = await request.json()
+    except Exception:
+        WEBHOOKS.labels("sandbox", "invalid").inc()
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+
+    op_id = str(payload.get("operationId") or "")
+    order_id = str(payload.get("orderId") or "")
+    status = str(payload.get("status") or "")
+
+    tx = await TxContext.resolve("/provider/sandbox/webhook", order_id)
+    if tx.mapping is None or tx.mapping["provider"] != "Sandbox":
+        WEBHOOKS.labels("sandbox", "unknown_tx").inc()
         return {"ok": True}
 
-    await update_status_by_token_any(mapping["rp_token"], status or "unknown")
+    rp_result = await advance(tx, status, "sandbox")
+    if rp_result is None:
+        WEBHOOKS.labels("sandbox", "skipped").inc()
+        return {"ok": True}
+    WEBHOOKS.labels("sandbox", rp_result).inc()
 
     client = RPCallbackClient()
     callback_payload = {
-        "result": _to_rp_result(status),
-        "gateway_token": guid or mapping.get("provider_operation_id"),
+        "result": rp_result,
+        "gateway_token": op_id or tx.mapping.get("provider_operation_id"),
         "logs": [],
         "requisites": None
     }
     try:
-        await client.send_callback(mapping["callback_url"], callback_payload)
+        await client.send_callback(tx.mapping["callback_url"], callback_payload)
     except Exception:
         pass
 
     return {"ok": True}
+
+
+if settings.SANDBOX_ENABLED:
+    router.add_api_route("/provider/sandbox/webhook", sandbox_webhook, methods=["POST"])
@@ -1,7 +1,15 @@
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse
+from html import escape
 from typing import Optional, Dict, Any
 from ..settings import settings
 from ..db import init_db
+from ..logstore import offload_logs, resolve_verbosity
+from ..idempotency import pay_cache, pay_fingerprint
+from ..tracing import span
+from ..txcontext import TxContext
+from ..snapshots import snapshots
+from .. import capture
 from ..providers.registry import get_provider_by_name, resolve_provider_by_payment_method
 
 router = APIRouter()
@@ -9,7 +17,8 @@ router = APIRouter()
 
 @router.on_event("startup")
 async def _startup():
-    await init_db()
+    if settings.DB_INIT_ON_STARTUP:
+        await init_db()
 
 
 def _normalize_provider_name(name: Optional[str]) -> Optional[str]:
@@ -76,10 +85,18 @@ def _normalize_nested_payload(body: Dict[str, Any]) -> Dict[str, Any]:
         # флаги для QR обработки
         "wrapped_to_json": settings_in.get("wrapped_to_json") or body.get("wrapped_to_json"),
         "show_qr_on_form": settings_in.get("show_qr_on_form") or body.get("show_qr_on_form"),
+        # сколько логов провайдера отдавать в ответе: none | summary | full
+        "_logs_verbosity": resolve_verbosity(settings_in.get("logs_verbosity") or body.get("logs_verbosity")),
         "_raw": body,  # для логов
     }
 
 
+def _json_response(content: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    # Ответы адаптеров — уже чистый JSON: сериализуем сами, без jsonable_encoder, и меряем этот этап
+    with span("serialize"):
+        return JSONResponse(content=content, headers=headers)
+
+
 @router.post("/pay")
 async def pay(body: Dict[str, Any]):
     """
@@ -93,20 +110,39 @@ async def pay(body: Dict[str, Any]):
       "redirectRequest": {"url": null|..., "type": "post_iframes"|"redirect", "iframes": []},
       "with_external_format": true,
       "provider_response_data": {...},
-      "logs": [...]
+      "logs": [...]   # сводка; полные логи — GET /admin/logs/{token}
     }
+    Повтор с тем же payment.token отдаёт сохранённый ответ без логов (заголовок X-Idempotent-Replay: true).
     """
-    provider = _select_provider(
-        (body.get("settings") or {}).get("provider"),
-        (body.get("payment") or {}).get("paymentMethod"),
+    with span("select_provider"):
+        provider = _select_provider(
+            (body.get("settings") or {}).get("provider"),
+            (body.get("payment") or {}).get("paymentMethod"),
+        )
+    with span("normalize"):
+        payload = _normalize_nested_payload(body)
+    capture.bind(payload["rp_token"])
+
+    async def _pay_once() -> Dict[str, Any]:
+        # Выполняем платёж у провайдера
+        with span("provider.pay"):
+            return await provider.pay(payload)
+
+    async def _offload(result: Dict[str, Any]) -> Dict[str, Any]:
+        # Адаптер уже возвращает внешний формат — подменяем только логи
+        with span("offload_logs"):
+            result["logs"] = await offload_logs(
+                result.get("logs"),
+                rp_token=payload["rp_token"],
+                provider=provider.name,
+                verbosity=payload["_logs_verbosity"],
+            )
+        return result
+
+    result, replayed = await pay_cache.run(
+        payload["rp_token"], pay_fingerprint(provider.name, payload), _pay_once, _offload
     )
-    payload = _normalize_nested_payload(body)
-
-    # Выполняем платёж у провайдера
-    result = await provider.pay(payload)
-
-    # Адаптер уже возвращает внешний формат — просто прокидываем
-    return result
+    return _json_response(result, {"X-Idempotent-Replay": "true"} if replayed else None)
 
 
 @router.post("/status")
@@ -131,28 +167,34 @@ async def status(body: Dict[str, Any]):
             "logs": [],
         }
 
-    # Достаём провайдера по маппингу в адаптере
-    from ..db import get_mapping_by_token_any
-    mapping_key = gw or rp_token or order_number
-    mapping = await get_mapping_by_token_any(mapping_key)
-    if not mapping:
+    # Маппинг ищем один раз: адаптер получает его в контексте транзакции
+    tx = await TxContext.resolve("/status", gw or rp_token or order_number)
+    if tx.mapping is None:
         raise HTTPException(status_code=404, detail="Unknown token")
-
-    provider = get_provider_by_name(mapping["provider"])
+    mapping, provider = tx.mapping, tx.provider
     if not provider:
         raise HTTPException(status_code=400, detail="Provider missing for token")
 
-    result = await provider.status({
-        "rp_token": rp_token,
-        "order_number": order_number,
-        "gateway_token": gw
-    })
-    return result
+    with span("provider.status"):
+        result = await provider.status({
+            "rp_token": rp_token,
+            "order_number": order_number,
+            "gateway_token": gw,
+            "_tx": tx,
+        })
+    settings_in = (body.get("params", {}).get("settings") or body.get("settings") or {}) or {}
+    with span("offload_logs"):
+        result["logs"] = await offload_logs(
+            result.get("logs"),
+            rp_token=mapping["rp_token"],
+            provider=provider.name,
+            verbosity=resolve_verbosity(settings_in.get("logs_verbosity") or body.get("logs_verbosity")),
+        )
+    return _json_response(result)
 
 
 @router.post("/refund")
 async def refund(body: Dict[str, Any]):
-    from ..db import get_mapping_by_token_any
     payment = (body.get("params", {}).get("payment") or body.get("payment") or {}) or {}
     gw = payment.get("gateway_token")
     rp_token = payment.get("token")
@@ -162,15 +204,13 @@ async def refund(body: Dict[str, Any]):
     if not key:
         raise HTTPException(status_code=400, detail="gateway_token or payment.token or payment.order_number required")
 
-    mapping = await get_mapping_by_token_any(key)
-    if not mapping:
+    tx = await TxContext.resolve("/refund", key)
+    if tx.mapping is None:
         raise HTTPException(status_code=404, detail="Unknown token")
-
-    provider = get_provider_by_name(mapping["provider"])
-    if not provider:
+    if not tx.provider:
         raise HTTPException(status_code=400, detail="Provider missing for token")
 
-    return await provider.refund(body)
+    return await tx.provider.refund({**body, "_tx": tx})
 
 
 @router.post("/payout")
@@ -184,12 +224,22 @@ async def qr_form(gateway_token: str):
     """
     Простая QR форма для отображения QR кода на нашей странице
     Используется когда show_qr_on_form = true
+    Ссылка QR и реквизиты — из снимка последнего ответа провайдера, без вызова провайдера.
     """
-    from ..db import get_mapping_by_token_any
-
-    mapping = await get_mapping_by_token_any(gateway_token)
+    mapping = (await TxContext.resolve("/qr_form", gateway_token)).mapping
     if not mapping:
         raise HTTPException(status_code=404, detail="QR form not found")
+    snap = await snapshots.load(mapping["rp_token"]) or {}
+    requisites = snap.get("requisites") or {}
+    qr = snap.get("qr")
+
+    if qr:
+        qr_block = f'''<p>Scan QR code to pay:</p>
+                <p><a href="{escape(qr)}">{escape(qr)}</a></p>'''
+    else:
+        qr_block = "<p>QR code is not available yet, refresh the page later</p>"
+    recipient = " ".join(v for v in (requisites.get("holder"), requisites.get("bank_name")) if v)
+    recipient_block = f"<p><strong>Recipient:</strong> {escape(recipient)}</p>" if recipient else ""
 
     # Простая HTML форма с QR кодом
     html_content = f"""
@@ -202,7 +252,7 @@ async def qr_form(gateway_token: str):
         <style>
             body {{ font-family: Arial, sans-serif; text-align: center; padding: 20px; }}
             .qr-container {{ max-width: 400px; margin: 0 auto; }}
-            .qr-code {{ width: 300px; height: 300px; margin: 20px auto; }}
+            .qr-code {{ margin: 20px auto; word-break: break-all; }}
             .info {{ margin: 20px 0; }}
         </style>
     </head>
@@ -210,26 +260,16 @@ async def qr_form(gateway_token: str):
         <div class="qr-container">
             <h2>SBP Payment</h2>
             <div class="info">
-                <p><strong>Order:</strong> {mapping.get('order_number', 'N/A')}</p>
-                <p><strong>Status:</strong> {mapping.get('status', 'pending')}</p>
+                <p><strong>Order:</strong> {escape(str(mapping.get('order_number') or 'N/A'))}</p>
+                <p><strong>Status:</strong> {escape(str(snap.get('status') or mapping.get('status') or 'pending'))}</p>
+                {recipient_block}
             </div>
             <div class="qr-code">
-                <p>Scan QR code to pay:</p>
-                <div id="qr-placeholder">
-                    <p>Loading QR code...</p>
-                </div>
+                {qr_block}
             </div>
         </div>
-        <script>
-            // Здесь можно добавить логику для отображения QR кода
-            // или периодической проверки статуса платежа
-            setTimeout(function() {{
-                document.getElementById('qr-placeholder').innerHTML = '<p>QR code would be displayed here</p>';
-            }}, 1000);
-        </script>
     </body>
     </html>
     """
 
-    from fastapi.responses import HTMLResponse
     return HTMLResponse(content=html_content, status_code=200)
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from typing import List
+
+
+# ====== Массовые операции админки ======
+
+class BulkStatusItem(BaseModel):
+    token: str          # rp_token или order_number
+    new_status: str
+
+
+class BulkStatusRequest(BaseModel):
+    items: List[BulkStatusItem]
+    callbacks: bool = True  # false — только поменять статусы, без коллбэков в RP
@@ -0,0 +1,58 @@
+# Поиск транзакций для поддержки (GET /admin/search): префикс номера заказа, провайдер, статус, окно created_at.
+# Страницы — keyset по индексам поиска (app/db.py search_mappings): курсор несёт ключ последней строки,
+# следующая страница — короткий запрос «после ключа», без OFFSET, так что её цена не растёт с номером страницы.
+# Курсор непрозрачный (base64 JSON) и привязан к фильтрам: с другими фильтрами он отвергается.
+import base64
+import json
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+from .db import SEARCH_COLUMNS, search_mappings
+from .export import _iso
+
+_TS_COLUMNS = ("created_at", "updated_at")
+
+
+def _filters_crc(*filters: Any) -> int:
+    return zlib.crc32(json.dumps(filters, default=str).encode("utf-8"))
+
+
+def encode_cursor(key: Tuple[Any, int], crc: int) -> str:
+    raw = json.dumps([key[0], key[1], crc], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, crc: int) -> Tuple[Any, int]:
+    """Ключ последней строки; ValueError — курсор битый или от поиска с другими фильтрами (и другим порядком)."""
+    try:
+        value, row_id, cursor_crc = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("malformed cursor")
+    if cursor_crc != crc:
+        raise ValueError("cursor belongs to a search with different filters")
+    return value, int(row_id)
+
+
+async def search(
+    order_prefix: Optional[str],
+    provider: Optional[str],
+    status: Optional[str],
+    since: Optional[float],
+    until: Optional[float],
+    limit: int,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    crc = _filters_crc(order_prefix, provider, status, since, until)
+    after = decode_cursor(cursor, crc) if cursor else None
+    # строка сверх limit — признак, что следующая страница есть
+    order, rows = await search_mappings(order_prefix, provider, status, since, until, after, limit + 1)
+    page = rows[:limit]
+    items = [
+        {c: (_iso(v) if c in _TS_COLUMNS else v) for c, v in zip(SEARCH_COLUMNS, row)}
+        for row in page
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = dict(zip(SEARCH_COLUMNS, page[-1]))
+        next_cursor = encode_cursor((last[order], last["id"]), crc)
+    return {"order": order, "items": items, "next_cursor": next_cursor}
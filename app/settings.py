@@ -1,4 +1,5 @@
 import os
+from typing import Dict, List
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -8,6 +9,10 @@ class Settings(BaseSettings):
     APP_ENV: str = "dev"
     LOG_LEVEL: str = "INFO"
     PORT: int = 8080
+    HOST: str = "0.0.0.0"
+    WORKERS: int = 1                         # python -m app: число воркеров uvicorn
+    GRACEFUL_TIMEOUT_SEC: int = 30
+    PUBLIC_BASE_URL: str = ""  # внешний адрес коннектора (qr_form, returnUrl)
 
     # RP callback security
     RP_CALLBACK_SIGNING_SECRET: str = os.getenv("RP_CALLBACK_SIGNING_SECRET")
@@ -20,15 +25,133 @@ class Settings(BaseSettings):
     # Provider: Brusnika
     BRUSNIKA_BASE_URL: str = "https://api.brusnikapay.top"
     BRUSNIKA_WEBHOOK_URL: str = "shad-mighty-bluegill.ngrok-free.app/provider/brusnika/webhook"
-    # BRUSNIKA_API_KEY: str = "REPLACE"
+    BRUSNIKA_API_KEY: str = ""
+    BRUSNIKA_CALLBACK_URL: str = ""
     # BRUSNIKA_WEBHOOK_SIGNING_SECRET: str = "REPLACE"
 
     # --- Forta ---
     FORTA_BASE_URL: str = "https://pt.wallet-expert.com"
-    # FORTA_API_TOKEN: str = ""
+    FORTA_API_TOKEN: str = ""
     FORTA_WEBHOOK_URL: str = "https://shad-mighty-bluegill.ngrok-free.app/provider/forta/webhook"
 
+    # --- Stub (локальный провайдер для тестов/стендов) ---
+    STUB_PROVIDER_ENABLED: bool = False
+    STUB_PROVIDER_LATENCY_MS: int = 0
+
+    # --- Sandbox (песочница с задержками и инъекцией сбоев) ---
+    SANDBOX_ENABLED: bool = False
+    SANDBOX_SEED: int | None = None
+    SANDBOX_LATENCY_MEDIAN_MS: float = 150.0
+    SANDBOX_LATENCY_SIGMA: float = 0.5           # логнормальное распределение
+    SANDBOX_ERROR_RATE: float = 0.0              # доля вызовов с ошибкой соединения
+    SANDBOX_TIMEOUT_RATE: float = 0.0            # доля вызовов, зависающих на SANDBOX_TIMEOUT_SEC
+    SANDBOX_TIMEOUT_SEC: float = 15.0
+    SANDBOX_APPROVE_RATE: float = 0.9
+    SANDBOX_WEBHOOK_URL: str = "http://127.0.0.1:8080/provider/sandbox/webhook"
+    SANDBOX_WEBHOOK_DELAY_MS: float = 2000.0
+    SANDBOX_WEBHOOK_DUPLICATE_RATE: float = 0.0
+    SANDBOX_WEBHOOK_OUT_OF_ORDER_RATE: float = 0.0
+    SANDBOX_MAX_OPS: int = 100_000
+
     # DB
     DB_URL: str = "sqlite+aiosqlite:///./data/mappings.sqlite3"
+    DB_INIT_ON_STARTUP: bool = True          # python -m app выключает в воркерах: схему создаёт мастер
+    DB_BUSY_TIMEOUT_MS: int = 5000           # ожидание блокировки записи другим воркером вместо "database is locked"
+
+    # Provider logs store (полные логи провайдера хранятся в БД, в ответ RP — сводка)
+    PROVIDER_LOGS_VERBOSITY: str = "summary"  # none | summary | full
+    PROVIDER_LOGS_PREVIEW_CHARS: int = 256
+    PROVIDER_LOGS_RETENTION_DAYS: int = 14
+    PROVIDER_LOGS_MAX_ROWS: int = 500_000
+
+    # Идемпотентность /pay по rp_token
+    PAY_IDEMPOTENCY_TTL_SEC: int = 86400
+    PAY_IDEMPOTENCY_MAX_ENTRIES: int = 10_000
+
+    # Снимок последнего удачного ответа провайдера: /status при недоступном провайдере и /qr_form без его вызова
+    STATUS_SNAPSHOT_RETENTION_DAYS: int = 30
+    STATUS_SNAPSHOT_MAX_ENTRIES: int = 50_000  # хэшей последних снимков в памяти: неизменившийся снимок не пишем
+
+    # Операционная аналитика (GET /admin/analytics): приращения воркера копятся в памяти и сбрасываются в analytics_*
+    ANALYTICS_FLUSH_SEC: float = 10.0
+    ANALYTICS_RETENTION_DAYS: int = 90
+    ANALYTICS_MAX_HOURS: int = 24 * 31       # предел окна запроса
+
+    # Массовые операции админки
+    ADMIN_BULK_MAX_ITEMS: int = 50_000
+    CALLBACK_QUEUE_RATE_PER_SEC: float = 50.0  # темп фоновых коллбэков в RP; 0 — без ограничения
+    CALLBACK_QUEUE_CONCURRENCY: int = 4
+    JOBS_FLUSH_SEC: float = 1.0              # как часто прогресс заданий пишется в admin_jobs
+
+    # Поиск транзакций (GET /admin/search)
+    ADMIN_SEARCH_MAX_LIMIT: int = 500        # строк на страницу
+
+    # Выгрузка маппингов (GET /admin/export, python -m app.export)
+    EXPORT_PAGE_SIZE: int = 1000             # строк на страницу keyset — и на чанк ответа
+
+    # Сверка с реестрами провайдера (python -m app.reconcile)
+    RECONCILE_BATCH_ROWS: int = 10_000       # строк реестра на пачку загрузки и страницу отчёта
+
+    # Исходящий HTTP: общий пул соединений на воркер и его прогрев на старте
+    HTTP_POOL_MAX_CONNECTIONS: int = 200
+    HTTP_POOL_MAX_KEEPALIVE: int = 50
+    HTTP_POOL_KEEPALIVE_SEC: float = 60.0
+    HTTP_PREWARM_ENABLED: bool = True
+    HTTP_PREWARM_CONNECTIONS: int = 2        # соединений на хост провайдера
+    HTTP_PREWARM_TIMEOUT_SEC: float = 3.0    # общий лимит: дольше старт воркера не задерживаем
+
+    # Дедлайн запроса: бюджет из заголовка RP (мс, относительный) или по эндпоинту; 0/нет в словаре — без дедлайна
+    DEADLINE_HEADER: str = "X-Request-Timeout-Ms"
+    DEADLINE_ENDPOINT_MS: Dict[str, int] = {"/pay": 25000, "/status": 10000, "/refund": 25000, "/payout": 25000}
+    DEADLINE_DEFAULT_MS: int = 0             # для прочих путей (вебхуки, админка, пакеты)
+    DEADLINE_MAX_MS: int = 60000             # потолок для заголовка на путях без своего бюджета
+    DEADLINE_RESERVE_MS: int = 200           # оставляем на сборку ответа после вызова провайдера
+    DEADLINE_MIN_ATTEMPT_MS: int = 300       # меньше осталось — следующую попытку ретрая не начинаем
+
+    # Контроль допуска (на воркер): приоритеты webhook > pay > status > admin, лишнее — 503 + Retry-After
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_INFLIGHT: int = 256        # одновременных запросов известных классов
+    ADMISSION_SHARE: Dict[str, float] = {"webhook": 1.0, "pay": 0.9, "status": 0.6, "admin": 0.2}
+    ADMISSION_MAX_WAIT_MS: Dict[str, int] = {"webhook": 5000, "pay": 1000, "status": 250, "admin": 0}
+    ADMISSION_MAX_QUEUE: int = 1024
+    ADMISSION_LATENCY_TARGET_MS: int = 3000  # EWMA pay/status выше — лимит сжимается; 0 — только по числу запросов
+    ADMISSION_RETRY_AFTER_SEC: int = 1
+
+    # Общий для воркеров хоста кэш маппингов (mmap-файл, seqlock); источник правды — SQLite
+    SHM_CACHE_ENABLED: bool = True
+    SHM_CACHE_PATH: str = "./data/mappings.cache"
+    SHM_CACHE_SLOTS: int = 65536             # записей по 640 байт (~40 МБ); алиасы транзакции — отдельные записи
+    SHM_CACHE_TTL_SEC: float = 5.0           # старше — промах: граница устаревания для правок мимо этого хоста
+
+    # Трассировка этапов запроса (Server-Timing + сэмплированные записи в лог app.trace)
+    TRACING_ENABLED: bool = True
+    TRACING_SAMPLE_RATE: float = 0.01
+
+    # Запись трафика для офлайн-прогонов (python -m bench.replay): NDJSON-сегменты в CAPTURE_DIR
+    CAPTURE_ENABLED: bool = False
+    CAPTURE_DIR: str = "./data/capture"
+    CAPTURE_SAMPLE_RATE: float = 1.0         # доля транзакций (по crc32 rp_token — одинаково во всех воркерах)
+    CAPTURE_PATHS: List[str] = ["/pay", "/status", "/refund", "/payout", "/qr_form/", "/provider/"]  # "/x/" — префикс
+    CAPTURE_REDACT_KEYS: List[str] = [
+        "authorization_token", "authorization", "api_key", "apikey", "secret", "password", "signature", "sign",
+        "secure", "cvv", "cvc",
+    ]
+    CAPTURE_MAX_BODY_BYTES: int = 65536      # тело больше — пишется усечённым и в replay не повторяется
+    CAPTURE_SEGMENT_MAX_BYTES: int = 64 * 1024 * 1024
+    CAPTURE_SEGMENT_MAX_SEC: float = 3600.0
+    CAPTURE_MAX_SEGMENTS: int = 200          # на весь CAPTURE_DIR, старые удаляются
+
+    # Монитор event loop
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL_MS: int = 100
+    LOOP_STALL_THRESHOLD_MS: int = 200       # шаг дольше — лог со стеком; 0 — без сторожевого потока
+    LOOP_OFFLOAD_LAG_MS: int = 50            # лаг выше — CPU-хелперы уходят в пул потоков; 0 — никогда
+
+    # Пакетные выплаты
+    PAYOUT_BATCH_MAX_ITEMS: int = 50_000
+    PAYOUT_CONCURRENCY_DEFAULT: int = 8
+    PAYOUT_CONCURRENCY_PER_PROVIDER: Dict[str, int] = {}  # JSON в env: {"Brusnika_SBP": 4}
+    PAYOUT_RESUME_SCAN_SEC: int = 30
+    PAYOUT_BATCH_STALE_SEC: int = 60
 
 settings = Settings()
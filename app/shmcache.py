@@ -0,0 +1,260 @@
+# Общий для воркеров хоста кэш горячих маппингов: хэш-таблица фиксированных записей в mmap-файле.
+#
+# Ключ — любой алиас транзакции (rp_token, order_number, provider_operation_id): одна запись кладётся
+# под каждым алиасом. Значение — provider, operation id, статус и callback_url в полях фиксированной длины.
+# Читатели не берут блокировок: seqlock на слот (seq нечётный — запись идёт; seq до и после копии
+# различается — читаем заново). Писатели разных процессов сериализуются flock на файле кэша и пишут
+# seq+1 → тело → seq+2. Источник правды — SQLite (app/db.py): кэш заполняется после чтения из БД,
+# а записи маппинга в этом хосте инвалидируют алиасы. Запись старше SHM_CACHE_TTL_SEC считается промахом —
+# это и есть граница устаревания для изменений, о которых кэш не узнал (другой хост, CLI, вытесненный алиас).
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from .settings import settings
+from .metrics import Counter
+
+ENABLED = settings.SHM_CACHE_ENABLED
+
+_MAGIC = b"GWMAPC01"
+_HEADER = struct.Struct("<8sII")  # magic, slots, slot_size
+_HEADER_SIZE = 64
+
+# seq, presence-биты полей, хэш ключа, время записи, затем поля (NUL-дополненные)
+_FIELDS = (
+    ("rp_token", 64),
+    ("order_number", 64),
+    ("provider", 32),
+    ("provider_operation_id", 64),
+    ("callback_url", 256),
+    ("status", 32),
+)
+_KEY_LEN = 64
+_SLOT = struct.Struct("<IIQd%ds" % _KEY_LEN + "".join("%ds" % n for _, n in _FIELDS))
+_SLOT_SIZE = (_SLOT.size + 63) // 64 * 64  # слот по границе кэш-линии
+_SEQ = struct.Struct("<I")
+_PROBE = 4              # слотов на ключ (открытая адресация, линейный проход)
+_READ_RETRIES = 3
+
+SHM_CACHE = Counter("gateway_shm_cache_total", "Shared mapping cache lookups", ("result",))
+
+
+def _hash(key: bytes) -> int:
+    # hash() в Python рандомизирован по процессам — нужен одинаковый во всех воркерах
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+
+
+class SharedMappingCache:
+    def __init__(self, path: str, slots: int, ttl_sec: float):
+        self.path = path
+        self.slots = slots
+        self.ttl = ttl_sec
+        self._mm: Optional[mmap.mmap] = None
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+
+    # ---- файл ----
+    def _open(self) -> mmap.mmap:
+        # после fork (воркеры uvicorn) у каждого процесса — своё отображение того же файла
+        if self._mm is not None and self._pid == os.getpid():
+            return self._mm
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        size = _HEADER_SIZE + self.slots * _SLOT_SIZE
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                ready = self._prepare(fd, size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            if ready:
+                break
+            os.close(fd)
+        self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._fd = fd
+        self._pid = os.getpid()
+        return self._mm
+
+    def _prepare(self, fd: int, size: int) -> bool:
+        """Под flock: True — fd это текущий файл кэша с нашей геометрией; False — открыть файл заново."""
+        header = _HEADER.pack(_MAGIC, self.slots, _SLOT_SIZE)
+        st = os.fstat(fd)
+        if st.st_ino != os.stat(self.path).st_ino:
+            # пока ждали блокировку, файл подменили — размечать надо уже новый
+            return False
+        if st.st_size == size and os.pread(fd, _HEADER.size, 0) == header:
+            return True
+        if st.st_size == 0:
+            # только что созданный файл: отобразить пустой файл нельзя, значит, его ещё никто не держит
+            os.ftruncate(fd, size)
+            os.pwrite(fd, header, 0)
+            return True
+        # другая геометрия (поменяли SHM_CACHE_SLOTS): старый файл могут держать отображённым воркеры прежней
+        # версии — усечение уронило бы их SIGBUS. Размечаем новый файл и подменяем им старый: прежние воркеры
+        # дорабатывают на своём (уже отвязанном) отображении, а расхождение кэшей ограничено SHM_CACHE_TTL_SEC.
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        tfd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(tfd, size)
+            os.pwrite(tfd, header, 0)
+        finally:
+            os.close(tfd)
+        os.replace(tmp, self.path)
+        return False
+
+    def _offsets(self, h: int) -> Iterable[int]:
+        base = h % self.slots
+        for i in range(_PROBE):
+            yield _HEADER_SIZE + ((base + i) % self.slots) * _SLOT_SIZE
+
+    # ---- чтение (без блокировок) ----
+    def _read_slot(self, mm: mmap.mmap, off: int):
+        for _ in range(_READ_RETRIES):
+            seq = _SEQ.unpack_from(mm, off)[0]
+            if seq & 1:
+                continue
+            raw = mm[off:off + _SLOT.size]
+            if _SEQ.unpack_from(mm, off)[0] == seq:
+                return _SLOT.unpack(raw)
+        return None
+
+    def _lookup(self, key: str):
+        """(результат, запись) без учёта в метриках: hit | stale | miss | race."""
+        kb = key.encode("utf-8")
+        if len(kb) > _KEY_LEN:
+            return "miss", None
+        h = _hash(kb)
+        mm = self._open()
+        for off in self._offsets(h):
+            rec = self._read_slot(mm, off)
+            if rec is None:
+                return "race", None
+            _, _, slot_hash, written_at, slot_key = rec[:5]
+            if slot_hash != h or slot_key.rstrip(b"\0") != kb:
+                continue
+            return ("stale" if time.time() - written_at > self.ttl else "hit"), rec
+        return "miss", None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result, rec = self._lookup(key)
+        SHM_CACHE.labels(result).inc()
+        return _decode(rec) if result == "hit" else None
+
+    # ---- запись (flock между процессами + seqlock для читателей) ----
+    def _write_slot(self, mm: mmap.mmap, off: int, body: Optional[bytes]) -> None:
+        seq = _SEQ.unpack_from(mm, off)[0]
+        _SEQ.pack_into(mm, off, (seq + 1) & 0xFFFFFFFF | 1)
+        if body is None:
+            mm[off + _SEQ.size:off + _SLOT.size] = bytes(_SLOT.size - _SEQ.size)
+        else:
+            mm[off + _SEQ.size:off + _SLOT.size] = body
+        _SEQ.pack_into(mm, off, (seq + 2) & 0xFFFFFFFE)
+
+    def _pick_slot(self, mm: mmap.mmap, h: int, kb: bytes) -> int:
+        # свой ключ → пустой слот → самый старый
+        oldest, oldest_at = None, None
+        for off in self._offsets(h):
+            _, _, slot_hash, written_at, slot_key = _SLOT.unpack_from(mm, off)[:5]
+            if slot_hash == h and slot_key.rstrip(b"\0") == kb:
+                return off
+            if slot_hash == 0:
+                return off
+            if oldest_at is None or written_at < oldest_at:
+                oldest, oldest_at = off, written_at
+        return oldest
+
+    def put(self, mapping: Dict[str, Any]) -> None:
+        values, present = [], 0
+        for i, (name, limit) in enumerate(_FIELDS):
+            v = mapping.get(name)
+            if v is None:
+                values.append(b"")
+                continue
+            vb = str(v).encode("utf-8")
+            if len(vb) > limit:
+                return  # не влезает в фиксированную запись — такие маппинги просто не кэшируем
+            values.append(vb)
+            present |= 1 << i
+        now = time.time()
+        mm = self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for alias in _aliases(mapping):
+                kb = alias.encode("utf-8")
+                if len(kb) > _KEY_LEN:
+                    continue
+                h = _hash(kb)
+                body = _SLOT.pack(0, present, h, now, kb, *values)[_SEQ.size:]
+                self._write_slot(mm, self._pick_slot(mm, h, kb), body)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def invalidate(self, *keys: Optional[str]) -> None:
+        """Стирает записи под ключами и под всеми алиасами найденной по ключу записи."""
+        aliases = set()
+        for key in keys:
+            if not key:
+                continue
+            aliases.add(key)
+            # устаревшая запись тоже стирается под всеми алиасами; промахи и попадания здесь — не поиск
+            _, rec = self._lookup(key)
+            if rec is not None:
+                aliases.update(_aliases(_decode(rec)))
+        self._erase(aliases)
+
+    def forget(self, mappings: Iterable[Dict[str, Any]]) -> None:
+        """Стирает записи под алиасами маппингов, прочитанных из БД (одной блокировкой на весь пакет)."""
+        self._erase({a for m in mappings for a in _aliases(m)})
+
+    def _erase(self, aliases: Iterable[str]) -> None:
+        aliases = [a.encode("utf-8") for a in aliases]
+        if not aliases:
+            return
+        mm = self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for kb in aliases:
+                h = _hash(kb)
+                for off in self._offsets(h):
+                    _, _, slot_hash, _, slot_key = _SLOT.unpack_from(mm, off)[:5]
+                    if slot_hash == h and slot_key.rstrip(b"\0") == kb:
+                        self._write_slot(mm, off, None)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+def _decode(rec) -> Dict[str, Any]:
+    present = rec[1]
+    return {
+        name: (value.rstrip(b"\0").decode("utf-8") if present & (1 << i) else None)
+        for i, ((name, _), value) in enumerate(zip(_FIELDS, rec[5:]))
+    }
+
+
+def _aliases(mapping: Dict[str, Any]) -> Iterable[str]:
+    return {str(v) for v in (mapping.get("rp_token"), mapping.get("order_number"), mapping.get("provider_operation_id")) if v}
+
+
+class _DisabledCache:
+    def get(self, key: str) -> None:
+        return None
+
+    def put(self, mapping: Dict[str, Any]) -> None:
+        return None
+
+    def invalidate(self, *keys: Optional[str]) -> None:
+        return None
+
+    def forget(self, mappings: Iterable[Dict[str, Any]]) -> None:
+        return None
+
+
+cache = (
+    SharedMappingCache(settings.SHM_CACHE_PATH, settings.SHM_CACHE_SLOTS, settings.SHM_CACHE_TTL_SEC)
+    if ENABLED else _DisabledCache()
+)
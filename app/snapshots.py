@@ -0,0 +1,175 @@
+# Снимок последнего удачного ответа провайдера по транзакции: статус (наш и провайдера), сумма, валюта, реквизиты, QR.
+# Пишется адаптером после успешных pay/status в status_snapshots: скаляры и ссылка QR колонками, реквизиты —
+# zlib(JSON); ответ без реквизитов или без QR (типичный status) прежние из pay не затирает. Неизменившийся снимок не пишется —
+# воркер помнит crc последних STATUS_SNAPSHOT_MAX_ENTRIES. Запись идёт фоновой задачей — /pay и /status её не
+# ждут; запоздавшая запись более старый снимок поверх нового не кладёт (captured_at). Читается, когда провайдер недоступен: /status отвечает
+# из снимка с пометкой stale вместо голого pending без реквизитов, а /qr_form рисует QR без вызова провайдера.
+import asyncio
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from .settings import settings
+from .metrics import Counter
+from .deadline import DeadlineExceeded, detach
+from .db import get_status_snapshot, save_status_snapshot, prune_status_snapshots
+
+logger = logging.getLogger(__name__)
+
+# Чистим таблицу раз в N записей
+_PRUNE_EVERY = 500
+
+STATUS_SNAPSHOTS = Counter(
+    "gateway_status_snapshots_total",
+    "Status snapshot writes and degraded reads",
+    ("result",),  # saved | unchanged | failed | served | missing
+)
+
+
+class _SnapshotStore:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._crc: "OrderedDict[str, int]" = OrderedDict()
+        self._saved_since_prune = 0
+        self._prune_task: Optional[asyncio.Task] = None
+        self._writes: Set[asyncio.Task] = set()
+
+    async def capture(
+        self,
+        rp_token: Optional[str],
+        provider: str,
+        *,
+        status: str,
+        provider_status: Optional[str],
+        amount: Any,
+        currency: Optional[str],
+        requisites: Optional[Dict[str, Any]],
+        provider_response_data: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Ставит запись снимка в фон и сразу возвращается: ответ провайдера уже получен, и ни задержка записи
+        под конкуренцией за SQLite, ни её ошибка (только логируется) не должны доставаться запросу.
+        """
+        if not rp_token:
+            return
+        qr = _qr_link(requisites, provider_response_data)
+        blob = None
+        if requisites:
+            blob = json.dumps({"requisites": requisites},
+                              ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        crc = zlib.crc32(blob or b"", zlib.crc32(f"{status}|{provider_status}|{amount}|{currency}|{qr}".encode("utf-8")))
+        if self._crc.get(rp_token) == crc:
+            self._crc.move_to_end(rp_token)
+            STATUS_SNAPSHOTS.labels("unchanged").inc()
+            return
+        # crc запоминается сразу, чтобы такой же снимок не ставился в очередь повторно; неудачная запись его снимает
+        self._crc[rp_token] = crc
+        self._crc.move_to_end(rp_token)
+        while len(self._crc) > self.max_entries:
+            self._crc.popitem(last=False)
+        task = asyncio.ensure_future(self._save(
+            rp_token, provider, time.time(), str(status), provider_status, amount, currency, blob, qr, crc,
+        ))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _save(
+        self,
+        rp_token: str,
+        provider: str,
+        now: float,
+        status: str,
+        provider_status: Optional[str],
+        amount: Any,
+        currency: Optional[str],
+        blob: Optional[bytes],
+        qr: Optional[str],
+        crc: int,
+    ) -> None:
+        detach()
+        try:
+            await save_status_snapshot(
+                rp_token, provider, now, status, provider_status, amount, currency,
+                zlib.compress(blob) if blob is not None else None, qr,
+            )
+        except Exception as e:
+            STATUS_SNAPSHOTS.labels("failed").inc()
+            logger.warning("status snapshot for %s not saved: %s", rp_token, e)
+            if self._crc.get(rp_token) == crc:
+                del self._crc[rp_token]
+            return
+        STATUS_SNAPSHOTS.labels("saved").inc()
+
+        self._saved_since_prune += 1
+        if self._saved_since_prune >= _PRUNE_EVERY and (self._prune_task is None or self._prune_task.done()):
+            self._saved_since_prune = 0
+            self._prune_task = asyncio.ensure_future(self._prune(now - settings.STATUS_SNAPSHOT_RETENTION_DAYS * 86400))
+
+    @staticmethod
+    async def _prune(older_than: float) -> None:
+        detach()
+        try:
+            await prune_status_snapshots(older_than)
+        except Exception as e:
+            logger.warning("status snapshots prune failed: %s", e)
+
+    async def load(self, rp_token: Optional[str]) -> Optional[Dict[str, Any]]:
+        row = await get_status_snapshot(rp_token) if rp_token else None
+        if row is None:
+            return None
+        blob = row.pop("requisites")
+        extra = json.loads(zlib.decompress(blob).decode("utf-8")) if blob is not None else {}
+        row["requisites"] = extra.get("requisites") or {}
+        # снимки до колонки qr держали ссылку в блобе
+        row["qr"] = row["qr"] or extra.get("qr")
+        return row
+
+
+snapshots = _SnapshotStore(settings.STATUS_SNAPSHOT_MAX_ENTRIES)
+
+
+async def degraded_status(rp_token: Optional[str], details: str, logs: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Ответ /status из снимка, когда провайдер недоступен; None — снимка нет."""
+    try:
+        snap = await snapshots.load(rp_token)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning("status snapshot for %s not loaded: %s", rp_token, e)
+        snap = None
+    if snap is None:
+        STATUS_SNAPSHOTS.labels("missing").inc()
+        return None
+    STATUS_SNAPSHOTS.labels("served").inc()
+    age = max(0.0, time.time() - snap["captured_at"])
+    return {
+        "result": "OK",
+        "status": snap["status"],
+        "details": f"{details}; last known status from {age:.0f}s ago",
+        "amount": snap["amount"],
+        "currency": snap["currency"],
+        "logs": logs,
+        "with_external_format": True,
+        "provider_response_data": {"status": snap["provider_status"]},
+        "requisites": snap["requisites"],
+        # пометка устаревания: ответ не от провайдера, а из снимка captured_at
+        "stale": True,
+        "snapshot_at": snap["captured_at"],
+        "snapshot_age_sec": round(age, 1),
+    }
+
+
+def _qr_link(requisites: Optional[Dict[str, Any]], provider_response_data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Ссылка QR/оплаты: LINK или H2H qr_data в реквизитах, иначе qr/qrCodeLink из ответа провайдера."""
+    req, prd = requisites or {}, provider_response_data or {}
+    link = req.get("link")
+    return (
+        (link.get("url") if isinstance(link, dict) else link)
+        or (req.get("qr_data") or {}).get("qr_url")
+        or prd.get("qr")
+        or prd.get("qrCodeLink")
+        or None
+    )
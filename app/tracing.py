@@ -0,0 +1,134 @@
+# Разбивка времени запроса по этапам: заголовок Server-Timing + сэмплированная JSON-запись в лог "app.trace".
+# При TRACING_ENABLED=false мидлварь не ставится, span() отдаёт общий no-op, а traced() не оборачивает функции.
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, List, Optional, Tuple
+
+from .settings import settings
+
+ENABLED = settings.TRACING_ENABLED
+
+logger = logging.getLogger("app.trace")
+
+# (имя, длительность в секундах) для текущего запроса; None — трассировка не идёт
+_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("trace_spans", default=None)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("name", "spans", "t0")
+
+    def __init__(self, name: str, spans: List[Tuple[str, float]]):
+        self.name = name
+        self.spans = spans
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.spans.append((self.name, time.perf_counter() - self.t0))
+        return False
+
+
+if ENABLED:
+    def span(name: str):
+        spans = _spans.get()
+        if spans is None:
+            return _NOOP
+        return _Span(name, spans)
+
+    def add_span(name: str, duration: float) -> None:
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((name, duration))
+
+    def traced(name: str) -> Callable:
+        def decorator(fn):
+            @wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return wrapper
+        return decorator
+else:
+    def span(name: str):
+        return _NOOP
+
+    def add_span(name: str, duration: float) -> None:
+        return None
+
+    def traced(name: str) -> Callable:
+        return lambda fn: fn
+
+
+def _server_timing(spans: List[Tuple[str, float]], total: float) -> str:
+    # Одноимённые этапы (например, несколько db.*) складываем, в desc — число вызовов
+    agg = {}
+    for name, dur in spans:
+        acc = agg.get(name)
+        agg[name] = (dur, 1) if acc is None else (acc[0] + dur, acc[1] + 1)
+    parts = []
+    for name, (dur, n) in agg.items():
+        item = f"{name};dur={dur * 1000:.2f}"
+        if n > 1:
+            item += f';desc="x{n}"'
+        parts.append(item)
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class TracingMiddleware:
+    """ASGI-мидлварь: собирает спаны запроса, пишет Server-Timing и (с вероятностью TRACING_SAMPLE_RATE) trace-запись."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        spans: List[Tuple[str, float]] = []
+        token = _spans.set(spans)
+        t0 = time.perf_counter()
+        status_holder = [None]
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+                headers = list(message.get("headers") or [])
+                headers.append((b"server-timing", _server_timing(spans, time.perf_counter() - t0).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _spans.reset(token)
+            if random.random() < settings.TRACING_SAMPLE_RATE:
+                route = scope.get("route")
+                logger.info(json.dumps({
+                    "ts": time.time(),
+                    "method": scope["method"],
+                    "route": getattr(route, "path", None) or scope.get("path"),
+                    "status": status_holder[0],
+                    "total_ms": round((time.perf_counter() - t0) * 1000, 3),
+                    "spans": [{"name": n, "ms": round(d * 1000, 3)} for n, d in spans],
+                }, ensure_ascii=False))
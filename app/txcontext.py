@@ -0,0 +1,92 @@
+# Контекст транзакции запроса: маппинг ищется один раз на входе (роутер /status, /refund, /qr_form, вебхук)
+# и дальше передаётся адаптеру (payload["_tx"]), машине состояний и коллбэку вместо повторного поиска по ключу.
+# Что ещё ищется по ключу внутри того же запроса (lookup), отдаёт мемо контекста: контекст текущей задачи
+# лежит в contextvar, а фоновые задачи, унаследовавшие его копию, мемо не видят (сверка по asyncio.current_task).
+# gateway_tx_lookups_total{endpoint,result=query|saved}: поиски, дошедшие до get_mapping_by_token_any,
+# и поиски, которые закрыл контекст.
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from .db import get_mapping_by_token_any
+from .metrics import Counter
+from . import capture
+
+TX_LOOKUPS = Counter(
+    "gateway_tx_lookups_total",
+    "Mapping lookups per endpoint: sent to the DB layer (query) or served by the request context (saved)",
+    ("endpoint", "result"),
+)
+
+_current: ContextVar[Optional["TxContext"]] = ContextVar("tx_context", default=None)
+
+
+class TxContext:
+    __slots__ = ("endpoint", "mapping", "provider", "_task")
+
+    def __init__(self, endpoint: str, mapping: Optional[Dict[str, Any]]):
+        self.endpoint = endpoint
+        self.mapping = mapping
+        self.provider = None
+        self._task = asyncio.current_task()
+
+    @classmethod
+    async def resolve(cls, endpoint: str, *keys: Optional[str]) -> "TxContext":
+        """Маппинг по первому найденному ключу (пустые пропускаются); контекст становится текущим для запроса."""
+        mapping = None
+        for key in keys:
+            if key:
+                TX_LOOKUPS.labels(endpoint, "query").inc()
+                mapping = await get_mapping_by_token_any(key)
+                if mapping is not None:
+                    break
+        ctx = cls(endpoint, mapping)
+        if mapping is not None:
+            from .providers.registry import get_provider_by_name  # реестр → адаптеры → этот модуль
+
+            ctx.provider = get_provider_by_name(mapping["provider"])
+            capture.bind(mapping["rp_token"])
+        _current.set(ctx)
+        return ctx
+
+    def matches(self, key: Optional[str]) -> bool:
+        m = self.mapping
+        return m is not None and bool(key) and key in (m["rp_token"], m["order_number"], m["provider_operation_id"])
+
+    def saved(self) -> None:
+        TX_LOOKUPS.labels(self.endpoint, "saved").inc()
+
+    async def refresh(self) -> Optional[Dict[str, Any]]:
+        """Перечитать маппинг (после проигранной гонки за статус)."""
+        if self.mapping is not None:
+            TX_LOOKUPS.labels(self.endpoint, "query").inc()
+            self.mapping = await get_mapping_by_token_any(self.mapping["rp_token"])
+        return self.mapping
+
+
+def current() -> Optional[TxContext]:
+    ctx = _current.get()
+    if ctx is not None and ctx._task is not asyncio.current_task():
+        return None
+    return ctx
+
+
+async def lookup(key: str) -> Optional[Dict[str, Any]]:
+    """get_mapping_by_token_any с мемо текущего запроса."""
+    ctx = current()
+    if ctx is not None and ctx.matches(key):
+        ctx.saved()
+        return ctx.mapping
+    if ctx is not None:
+        TX_LOOKUPS.labels(ctx.endpoint, "query").inc()
+    return await get_mapping_by_token_any(key)
+
+
+async def mapping_for(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Маппинг для адаптера: из payload["_tx"], если роутер его уже нашёл, иначе — по ключам payload."""
+    ctx = payload.get("_tx")
+    if ctx is not None:
+        ctx.saved()
+        return ctx.mapping
+    key = payload.get("gateway_token") or payload.get("rp_token") or payload.get("order_number")
+    return await lookup(key) if key else None
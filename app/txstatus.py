@@ -0,0 +1,112 @@
+# Машина состояний транзакции: единый словарь результатов RP и допустимые переходы между ними.
+#
+# Провайдеры шлют свои строки (PAID, INPROGRESS, succeeded, ...); в mappings.status они хранятся как есть, а
+# в состояние TxState переводятся таблицей статусов адаптера (StatusTable: dict «строка в нижнем регистре →
+# состояние», O(1)). Переходы только вперёд: pending → approved | declined | refunded, approved → refunded.
+# Переход в то же состояние (INIT → INPROGRESS) и назад (поздний INPROGRESS после PAID) пропускается до записи
+# в БД и коллбэка в RP — это считает gateway_status_transitions_total{provider,outcome}.
+# Записанный переход попадает в операционную аналитику (app/analytics.py).
+# Админка (/admin/update_status) правит статус мимо машины состояний — это ручное исправление.
+from enum import Enum
+from typing import Dict, FrozenSet, Iterable, Optional
+
+from .metrics import Counter
+from .db import compare_and_set_status
+from .txcontext import TxContext
+from .analytics import analytics
+
+
+class TxState(str, Enum):
+    PENDING = "pending"
+    APPROVED = "approved"
+    DECLINED = "declined"
+    REFUNDED = "refunded"
+
+    def __str__(self) -> str:
+        return self.value
+
+
+_NEXT: Dict[TxState, FrozenSet[TxState]] = {
+    TxState.PENDING: frozenset((TxState.APPROVED, TxState.DECLINED, TxState.REFUNDED)),
+    TxState.APPROVED: frozenset((TxState.REFUNDED,)),
+    TxState.DECLINED: frozenset(),
+    TxState.REFUNDED: frozenset(),
+}
+FINAL_STATES = frozenset(s for s, nxt in _NEXT.items() if not nxt)
+
+# applied — записан; noop — то же состояние; regress — назад или из финального; conflict — статус в БД
+# успел смениться между чтением и записью (проиграли конкурентному вебхуку)
+STATUS_TRANSITIONS = Counter(
+    "gateway_status_transitions_total",
+    "Provider status transitions by outcome",
+    ("provider", "outcome"),
+)
+
+
+class StatusTable:
+    """{"approved": ("paid", ...), ...} → вызываемая таблица: статус провайдера → TxState (без учёта регистра)."""
+
+    __slots__ = ("_lookup", "default")
+
+    def __init__(self, table: Dict[str, Iterable[str]], default: TxState = TxState.PENDING):
+        lookup: Dict[str, TxState] = {}
+        for result, values in table.items():
+            state = TxState(result)
+            for v in values:
+                lookup.setdefault(v.lower(), state)
+        self._lookup = lookup
+        self.default = default
+
+    def __call__(self, s: Optional[str]) -> TxState:
+        return self._lookup.get(s.lower(), self.default) if s else self.default
+
+
+# Для маппингов, чей провайдер уже не зарегистрирован: общий словарь, как был у вебхуков
+DEFAULT_TABLE = StatusTable({
+    "approved": ("paid", "success", "confirmed"),
+    "declined": ("cancelled", "canceled", "declined", "failed", "expired"),
+})
+
+
+def transition(current: TxState, new: TxState) -> str:
+    """Исход перехода current → new: applied | noop | regress."""
+    if new is current:
+        return "noop"
+    if new in _NEXT[current]:
+        return "applied"
+    return "regress"
+
+
+def table_for(provider: Optional[str]) -> StatusTable:
+    from .providers.registry import get_provider_by_name  # реестр импортирует адаптеры, а они — этот модуль
+
+    adapter = get_provider_by_name(provider)
+    table = getattr(adapter, "_status_map", None)
+    return table if isinstance(table, StatusTable) else DEFAULT_TABLE
+
+
+async def advance(ctx: TxContext, raw: Optional[str], provider: Optional[str] = None) -> Optional[TxState]:
+    """
+    Применяет статус провайдера raw к маппингу контекста: новое состояние, если переход вперёд записан, иначе None
+    (то же состояние, откат или проигранная гонка — ни записи в БД, ни коллбэка). ctx.mapping остаётся актуальным.
+    """
+    mapping = ctx.mapping
+    provider = mapping.get("provider") or provider
+    table = table_for(provider)
+    new = table(raw)
+    for _ in range(2):
+        outcome = transition(table(mapping.get("status")), new)
+        if outcome != "applied":
+            break
+        row = await compare_and_set_status(mapping["rp_token"], mapping.get("status"), raw)
+        if row is not None:
+            ctx.mapping = {**mapping, "status": raw}
+            analytics.record_transition(provider or "unknown", new, row)
+            break
+        # статус в БД не тот, что мы видели (кэш отстал или конкурентный вебхук) — перечитываем один раз
+        outcome = "conflict"
+        mapping = await ctx.refresh()
+        if mapping is None:
+            break
+    STATUS_TRANSITIONS.labels(provider or "unknown", outcome).inc()
+    return new if outcome == "applied" else None
@@ -1,12 +1,83 @@
+import asyncio
+import logging
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+
 import httpx
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from ..settings import settings
+from ..tracing import add_span
+from ..deadline import stop_at_deadline
+
+logger = logging.getLogger(__name__)
+
+# Один пул соединений на процесс: keep-alive к провайдерам и RP вместо TLS-рукопожатия на каждый вызов
+_shared: Optional[httpx.AsyncClient] = None
+_shared_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def shared_client() -> httpx.AsyncClient:
+    """Общий AsyncClient воркера. Не закрывать после запроса; таймаут — параметром timeout= у вызова."""
+    global _shared, _shared_loop
+    loop = asyncio.get_running_loop()
+    if _shared is None or _shared.is_closed or _shared_loop is not loop:
+        # соединения пула привязаны к loop; новый loop (тесты, перезапуск lifespan) — новый пул
+        _shared = httpx.AsyncClient(
+            timeout=15,
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=settings.HTTP_POOL_KEEPALIVE_SEC,
+            ),
+        )
+        _shared_loop = loop
+    return _shared
+
+
+async def close_shared_client() -> None:
+    global _shared, _shared_loop
+    if _shared is not None and _shared_loop is asyncio.get_running_loop():
+        await _shared.aclose()
+    _shared = None
+    _shared_loop = None
+
+
+async def prewarm(base_urls: Iterable[str], connections: int, timeout_sec: float) -> None:
+    """
+    Резолвит хосты провайдеров и открывает по connections соединений к каждому (HEAD на base_url),
+    чтобы первые /pay после рестарта не платили DNS + TLS. Ошибки и коды ответа не важны — нужен только сокет в пуле.
+    """
+    c = shared_client()
+    loop = asyncio.get_running_loop()
+
+    async def _warm(url: str) -> None:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        try:
+            await loop.getaddrinfo(parts.hostname, port)
+            await asyncio.gather(*(c.head(url, timeout=timeout_sec) for _ in range(connections)))
+        except (OSError, httpx.HTTPError) as e:
+            logger.warning("prewarm %s failed: %s", url, e)
+
+    urls = {u for u in base_urls if u}
+    try:
+        await asyncio.wait_for(asyncio.gather(*(_warm(u) for u in urls)), timeout_sec)
+    except asyncio.TimeoutError:
+        logger.warning("prewarm did not finish in %.1fs", timeout_sec)
+
 
-def client(timeout_sec: int = 15) -> httpx.AsyncClient:
-    return httpx.AsyncClient(timeout=timeout_sec)
+def retry_policy(max_attempts: int = 4, before_sleep=None):
+    def _before_sleep(retry_state):
+        # пауза перед следующей попыткой — отдельный этап в Server-Timing
+        add_span("backoff", retry_state.next_action.sleep)
+        if before_sleep:
+            before_sleep(retry_state)
 
-def retry_policy(max_attempts: int = 4):
+    wait = wait_exponential(multiplier=0.5, min=0.5, max=8)
     return retry(
-        stop=stop_after_attempt(max_attempts),
-        wait=wait_exponential(multiplier=0.5, min=0.5, max=8),
-        retry=retry_if_exception_type(httpx.HTTPError)
+        # попытки кончаются раньше max_attempts, если пауза + попытка не влезают в дедлайн запроса
+        stop=stop_after_attempt(max_attempts) | stop_at_deadline(wait, "retry"),
+        wait=wait,
+        retry=retry_if_exception_type(httpx.HTTPError),
+        before_sleep=_before_sleep,
     )
@@ -0,0 +1,271 @@
+"""
+Сквозной нагрузочный прогон: шлюз под uvicorn + локальные моки провайдеров (bench.mock_providers).
+
+    python -m bench.load --duration 30 --concurrency 50 --mix brusnika=0.7,forta=0.3 --out result.json
+    python -m bench.load ... --baseline baseline.json --max-regression 0.15
+
+Сценарий виртуального пользователя: /pay → N опросов /status → ожидание вебхука провайдера и коллбэка в RP.
+Отчёт (JSON): throughput, p50/p95/p99 и ошибки по операциям + задержка pay → RP callback.
+С --baseline сравнивает отчёт с прошлым и завершается с кодом 1 при регрессии.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def summarize(samples: List[float], errors: int, duration: float) -> Dict[str, Any]:
+    s = sorted(samples)
+    return {
+        "count": len(s),
+        "errors": errors,
+        "throughput_rps": round(len(s) / duration, 2) if duration else 0.0,
+        "p50_ms": round(percentile(s, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(s, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(s, 0.99) * 1000, 2),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def ok(self, op: str, seconds: float) -> None:
+        self.samples.setdefault(op, []).append(seconds)
+
+    def fail(self, op: str) -> None:
+        self.errors[op] = self.errors.get(op, 0) + 1
+        self.samples.setdefault(op, [])
+
+
+def _pay_body(provider: str, callback_url: str) -> Dict[str, Any]:
+    token = uuid.uuid4().hex
+    return {
+        "settings": {"provider": provider, "authorization_token": "bench-token"},
+        "payment": {
+            "token": token,
+            "order_number": f"bench-{token[:16]}",
+            "amount": random.choice([10000, 50000, 150000]),
+            "currency": "RUB",
+            "redirect_success_url": "https://merchant.example/ok",
+        },
+        "params": {"customer": {"client_id": f"c-{random.randint(1, 10_000)}", "client_ip": "10.0.0.1"}},
+        "callback_url": callback_url,
+        "processing_url": "https://merchant.example/processing",
+    }
+
+
+async def _timed(c: httpx.AsyncClient, rec: Recorder, op: str, url: str, body: Dict[str, Any]):
+    t0 = time.perf_counter()
+    try:
+        resp = await c.post(url, json=body)
+    except httpx.HTTPError:
+        rec.fail(op)
+        return None
+    if resp.status_code >= 400:
+        rec.fail(op)
+        return None
+    rec.ok(op, time.perf_counter() - t0)
+    return resp.json()
+
+
+async def virtual_user(
+    c: httpx.AsyncClient,
+    rec: Recorder,
+    args: argparse.Namespace,
+    mix: List[tuple],
+    deadline: float,
+    started: Dict[str, float],
+) -> None:
+    providers, weights = zip(*mix)
+    while time.perf_counter() < deadline:
+        provider = random.choices(providers, weights)[0]
+        body = _pay_body(provider, f"{args.mock_url}/rp/callback")
+        t_pay = time.time()
+        res = await _timed(c, rec, "pay", "/pay", body)
+        if not res or not res.get("gateway_token"):
+            continue
+        started[str(res["gateway_token"])] = t_pay
+        for _ in range(args.status_polls):
+            await asyncio.sleep(args.poll_interval)
+            await _timed(c, rec, "status", "/status", {"settings": body["settings"], "payment": {"token": body["payment"]["token"]}})
+        if args.think_time:
+            await asyncio.sleep(args.think_time)
+
+
+async def drive(args: argparse.Namespace) -> Dict[str, Any]:
+    mix = []
+    for part in args.mix.split(","):
+        name, _, weight = part.partition("=")
+        mix.append((name.strip(), float(weight or 1)))
+
+    rec = Recorder()
+    started: Dict[str, float] = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.gateway_url, timeout=60, limits=limits) as c:
+        t0 = time.perf_counter()
+        deadline = t0 + args.duration
+        await asyncio.gather(*(virtual_user(c, rec, args, mix, deadline, started) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - t0
+
+        # даём вебхукам и коллбэкам долететь
+        await asyncio.sleep(args.drain)
+        async with httpx.AsyncClient(base_url=args.mock_url, timeout=30) as mc:
+            arrived = (await mc.get("/rp/callbacks")).json()
+        metrics_text = (await c.get("/metrics")).text if args.scrape_metrics else None
+
+    e2e = [arrived[tok] - t for tok, t in started.items() if tok in arrived]
+    report = {
+        "config": {
+            "duration_sec": args.duration,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "status_polls": args.status_polls,
+            "poll_interval_sec": args.poll_interval,
+            "provider_latency_ms": args.latency_ms,
+            "webhook_delay_ms": args.webhook_delay_ms,
+        },
+        "elapsed_sec": round(elapsed, 3),
+        "operations": {op: summarize(samples, rec.errors.get(op, 0), elapsed) for op, samples in rec.samples.items()},
+        "callbacks": {
+            **summarize(e2e, len(started) - len(e2e), elapsed),
+            "expected": len(started),
+        },
+    }
+    if metrics_text is not None:
+        report["gateway_metrics"] = metrics_text
+    return report
+
+
+def _wait_http(url: str, timeout: float = 20.0) -> None:
+    t_end = time.time() + timeout
+    while time.time() < t_end:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_stack(args: argparse.Namespace, workdir: Path) -> List[subprocess.Popen]:
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(REPO_ROOT) + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "BRUSNIKA_BASE_URL": args.mock_url,
+        "FORTA_BASE_URL": args.mock_url,
+        "FORTA_WEBHOOK_URL": f"{args.gateway_url}/provider/forta/webhook",
+        "PUBLIC_BASE_URL": args.gateway_url,
+        "RP_CALLBACK_SIGNING_SECRET": os.environ.get("RP_CALLBACK_SIGNING_SECRET", "bench-secret"),
+        "TRACING_SAMPLE_RATE": "0",
+    }
+    mock_port = args.mock_url.rsplit(":", 1)[1]
+    gw_port = args.gateway_url.rsplit(":", 1)[1]
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "bench.mock_providers", "--port", mock_port, "--gateway", args.gateway_url,
+             "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+             "--webhook-delay-ms", str(args.webhook_delay_ms)],
+            cwd=REPO_ROOT, env=env,
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", gw_port, "--log-level", "warning",
+             *args.gateway_args.split()],
+            cwd=workdir, env=env,  # отдельный cwd → отдельная ./data/mappings.sqlite3
+        ),
+    ]
+    _wait_http(f"{args.mock_url}/rp/callbacks")
+    _wait_http(f"{args.gateway_url}/health")
+    return procs
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Регрессия: throughput упал или p95/p99 выросли больше чем на max_regression (доля)."""
+    problems = []
+    sections = {**report["operations"], "callbacks": report["callbacks"]}
+    base_sections = {**baseline.get("operations", {}), "callbacks": baseline.get("callbacks", {})}
+    for op, cur in sections.items():
+        base = base_sections.get(op)
+        if not base:
+            continue
+        if base.get("throughput_rps") and cur["throughput_rps"] < base["throughput_rps"] * (1 - max_regression):
+            problems.append(f"{op}: throughput {cur['throughput_rps']} < baseline {base['throughput_rps']}")
+        for key in ("p95_ms", "p99_ms"):
+            if base.get(key) and cur[key] > base[key] * (1 + max_regression):
+                problems.append(f"{op}: {key} {cur[key]} > baseline {base[key]}")
+        if cur["errors"] > base.get("errors", 0):
+            problems.append(f"{op}: errors {cur['errors']} > baseline {base.get('errors', 0)}")
+    return problems
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="End-to-end load benchmark against local mock providers")
+    ap.add_argument("--duration", type=float, default=30.0)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--mix", default="brusnika=0.7,forta=0.3", help="веса провайдеров для /pay")
+    ap.add_argument("--status-polls", type=int, default=3)
+    ap.add_argument("--poll-interval", type=float, default=0.2)
+    ap.add_argument("--think-time", type=float, default=0.0)
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="латентность моков провайдера")
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--webhook-delay-ms", type=float, default=500.0)
+    ap.add_argument("--drain", type=float, default=3.0, help="сколько ждать вебхуки/коллбэки после нагрузки")
+    ap.add_argument("--gateway-url", default="http://127.0.0.1:18080")
+    ap.add_argument("--mock-url", default="http://127.0.0.1:19100")
+    ap.add_argument("--gateway-args", default="", help="доп. аргументы uvicorn для шлюза (например --workers 4)")
+    ap.add_argument("--no-start", action="store_true", help="не поднимать процессы, бить в уже запущенные")
+    ap.add_argument("--scrape-metrics", action="store_true", help="приложить /metrics шлюза к отчёту")
+    ap.add_argument("--out", help="куда сохранить JSON-отчёт")
+    ap.add_argument("--baseline", help="JSON-отчёт для сравнения")
+    ap.add_argument("--max-regression", type=float, default=0.15)
+    args = ap.parse_args()
+
+    procs: List[subprocess.Popen] = []
+    workdir = Path(tempfile.mkdtemp(prefix="gw-bench-"))
+    try:
+        if not args.no_start:
+            procs = start_stack(args, workdir)
+        report = asyncio.run(drive(args))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    print(text)
+
+    if args.baseline:
+        problems = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.max_regression)
+        for p in problems:
+            print(f"REGRESSION {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
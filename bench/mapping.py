@@ -0,0 +1,260 @@
+"""
+Стоимость разбора одного ответа провайдера: адаптеры на спецификациях (app.providers.framework)
+против прежних ручных цепочек .get() (копия ниже, _legacy_*).
+
+    python -m bench.mapping --number 20000 --repeat 15
+
+Для каждого фикстурного ответа (pay/status Brusnika и Forta) меряется путь
+«ответ → блок данных → поля → статус RP → реквизиты/provider_response_data»,
+сетевые вызовы и БД не участвуют. Перед замером результаты обеих реализаций сверяются.
+
+speedup = legacy_ns / spec_ns: ниже 1 — спецификации медленнее ручного кода. Спецификации не ускоряют
+разбор (на этой машине 0.53-0.85x, т.е. +0.5-2.5 мкс на ответ); цена — против миллисекунд HTTP-вызова
+провайдера. Замер нужен как регрессионный: сверка результатов и порядок стоимости.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+os.environ.setdefault("RP_CALLBACK_SIGNING_SECRET", "bench-secret")
+
+from app.providers.brusnika.adapter import BrusnikaAdapter  # noqa: E402
+from app.providers.forta.adapter import FortaAdapter  # noqa: E402
+
+
+# ---- прежняя реализация (до перевода адаптеров на ProviderSpec) ----
+def _legacy_brusnika_status_map(s: Optional[str]) -> str:
+    sl = (s or "").lower()
+    if sl in {"approved", "success", "succeeded", "completed", "paid", "confirmed"}:
+        return "approved"
+    if sl in {"declined", "failed", "error", "canceled", "cancelled", "expired"}:
+        return "declined"
+    if sl in {"refunded", "refund", "reversed"}:
+        return "refunded"
+    return "pending"
+
+
+def _legacy_digits(v: Any) -> str:
+    s = str(v or "")
+    return "".join(ch for ch in s if ch.isdigit())
+
+
+def _legacy_brusnika_requisites(payment_details: Dict[str, Any], deeplink: Optional[str]) -> Dict[str, Any]:
+    provider_response: Dict[str, Any] = {}
+    requisites: Optional[Dict[str, Any]] = None
+
+    if not isinstance(payment_details, dict):
+        if deeplink:
+            requisites = {"link": {"url": deeplink}, "holder": "", "bank_name": ""}
+            provider_response = {"link": deeplink}
+        return {"requisites": requisites, "provider_response_data": provider_response}
+
+    method = (payment_details.get("paymentMethod") or "").lower()
+    bank_name = payment_details.get("bankName") or ""
+    holder = payment_details.get("nameMediator") or payment_details.get("holder") or ""
+    number = payment_details.get("number") or ""
+    number_add = payment_details.get("numberAdditional") or ""
+    qr = payment_details.get("qRcode") or payment_details.get("qrCode") or ""
+
+    digits = _legacy_digits(number or number_add)
+    is_card = bool(digits) and 13 <= len(digits) <= 19
+    is_account = bool(digits) and len(digits) >= 20
+    is_phone = bool(digits) and (len(digits) in (10, 11) or digits.startswith("7"))
+
+    if method in {"sbp", "tophone", "to_phone"} or (qr and is_phone):
+        requisites = {"pan": digits or number or number_add, "holder": holder, "bank_name": bank_name}
+        provider_response = {
+            "qr": qr or "", "pan": digits or number, "phone": digits or number, "holder": holder, "bank_name": bank_name,
+        }
+    elif method in {"tocard", "to_card"} or is_card:
+        requisites = {"card": digits or number, "holder": holder, "bank_name": bank_name}
+        provider_response = {"qr": qr or "", "card": digits or number, "holder": holder, "bank_name": bank_name}
+    elif method in {"toaccount", "to_account"} or is_account:
+        requisites = {"account": digits or number, "holder": holder, "bank_name": bank_name}
+        provider_response = {"qr": qr or "", "account": digits or number, "holder": holder, "bank_name": bank_name}
+    elif deeplink:
+        requisites = {"link": {"url": deeplink}, "holder": holder, "bank_name": bank_name}
+        provider_response = {"qr": qr or "", "link": deeplink, "holder": holder, "bank_name": bank_name}
+    else:
+        provider_response = {"qr": qr or "", "holder": holder, "bank_name": bank_name}
+    return {"requisites": requisites, "provider_response_data": provider_response}
+
+
+def _legacy_brusnika_pay(js: Dict[str, Any], payload: Dict[str, Any]) -> Tuple:
+    data_block = js.get("data") or {}
+    result_block = js.get("result") or {}
+    gateway_token = str(data_block.get("id") or data_block.get("idPlatform") or "")
+    provider_status = (data_block.get("status") or result_block.get("status") or "pending")
+    result_norm = _legacy_brusnika_status_map(provider_status)
+    payment_details = data_block.get("paymentDetailsData") or {}
+    deeplink = data_block.get("deeplink") or None
+    built = _legacy_brusnika_requisites(payment_details, deeplink)
+    return gateway_token, provider_status, result_norm, built.get("requisites") or {}, built.get("provider_response_data") or {}
+
+
+def _legacy_brusnika_status(js: Dict[str, Any], payload: Dict[str, Any]) -> Tuple:
+    data_block = js.get("data") or js
+    provider_status = data_block.get("status") or (js.get("result") or {}).get("status")
+    status_norm = _legacy_brusnika_status_map(provider_status)
+    payment_details = data_block.get("paymentDetailsData") or {}
+    deeplink = data_block.get("deeplink") or None
+    built = _legacy_brusnika_requisites(payment_details, deeplink)
+    amount = data_block.get("amount") or data_block.get("amountInitial")
+    currency = data_block.get("currency")
+    if isinstance(currency, str) and currency.upper() == "NOTSET":
+        currency = None
+    return status_norm, amount, currency, built.get("requisites") or {}, built.get("provider_response_data") or {}
+
+
+def _legacy_forta_status_map(s: Optional[str]) -> str:
+    sl = (s or "").upper()
+    if sl in {"PAID", "SUCCESS", "CONFIRMED"}:
+        return "approved"
+    if sl in {"CANCELED", "CANCELLED", "FAILED", "DECLINED", "ERROR"}:
+        return "declined"
+    return "pending"
+
+
+def _legacy_forta_output(data_block: Dict[str, Any], payload: Dict[str, Any] = None) -> Dict[str, Any]:
+    link = data_block.get("qrCodeLink") or data_block.get("link") or None
+    holder = data_block.get("receiverName") or ""
+    bank_name = data_block.get("receiverBank") or ""
+    phone = str(data_block.get("receiverPhone") or "")
+    wrapped_to_json = payload and payload.get("wrapped_to_json") == True
+    if link:
+        if wrapped_to_json:
+            requisites = {
+                "qr_data": {"type": "sbp_ecom", "qr_url": link, "embedded_json": True},
+                "holder": holder, "bank_name": bank_name, "phone": phone,
+            }
+        else:
+            requisites = {"link": {"url": link}, "holder": holder, "bank_name": bank_name}
+    else:
+        requisites = {"pan": phone, "holder": holder, "bank_name": bank_name} if phone else {}
+    provider_response_data = {
+        "guid": data_block.get("guid"), "orderId": data_block.get("orderId"), "amount": data_block.get("amount"),
+        "bank": data_block.get("bank"), "status": data_block.get("status"), "qrCodeLink": link,
+        "receiverName": holder, "receiverBank": bank_name, "receiverPhone": phone, "wrapped_to_json": wrapped_to_json,
+    }
+    return {"requisites": requisites, "provider_response_data": provider_response_data}
+
+
+def _legacy_forta_pay(js: Dict[str, Any], payload: Dict[str, Any]) -> Tuple:
+    data_block = js.get("data") or {}
+    provider_status = data_block.get("status") or (js.get("result") or {}).get("status")
+    result_norm = _legacy_forta_status_map(provider_status)
+    gateway_token = str(data_block.get("guid") or "")
+    built = _legacy_forta_output(data_block, payload)
+    return gateway_token, provider_status, result_norm, built["requisites"], built["provider_response_data"]
+
+
+def _legacy_forta_status(js: Dict[str, Any], payload: Dict[str, Any]) -> Tuple:
+    data_block = js.get("data") or {}
+    provider_status = data_block.get("status") or (js.get("result") or {}).get("status")
+    status_norm = _legacy_forta_status_map(provider_status)
+    built = _legacy_forta_output(data_block, payload)
+    return (status_norm, data_block.get("amount"), data_block.get("currency") or "RUB",
+            built["requisites"], built["provider_response_data"])
+
+
+# ---- новая реализация: тот же путь через ProviderSpec ----
+def _spec_pay(adapter) -> Callable[[Dict[str, Any], Dict[str, Any]], Tuple]:
+    extract, status_map, output = adapter.spec.pay.extract, adapter._status_map, adapter._output
+
+    def run(js, payload):
+        block, f = extract(js)
+        built = output(block, f, payload)
+        return (str(f["token"] or ""), f["status"], status_map(f["status"]),
+                built.get("requisites") or {}, built.get("provider_response_data") or {})
+    return run
+
+
+def _spec_status(adapter) -> Callable[[Dict[str, Any], Dict[str, Any]], Tuple]:
+    spec = adapter.spec
+    extract, status_map, output = spec.status.extract, adapter._status_map, adapter._output
+
+    def run(js, payload):
+        block, f = extract(js)
+        built = output(block, f, payload)
+        currency = f["currency"]
+        if spec.null_currencies and isinstance(currency, str) and currency.upper() in spec.null_currencies:
+            currency = None
+        return (status_map(f["status"]), f["amount"], currency,
+                built.get("requisites") or {}, built.get("provider_response_data") or {})
+    return run
+
+
+# ---- фикстуры: ответы в форме моков bench.mock_providers ----
+_BRUSNIKA_PAY = {
+    "result": {"status": "success"},
+    "data": {
+        "id": "1000001", "status": "INPROGRESS", "amount": 50000, "currency": "RUB",
+        "paymentDetailsData": {"paymentMethod": "SBP", "bankName": "Mock Bank", "nameMediator": "Ivan I.",
+                               "number": "+7 999 000-11-22", "qRcode": "https://qr.nspk.ru/mock/1000001"},
+    },
+}
+_BRUSNIKA_PAY_CARD = {
+    "data": {"idPlatform": "1000002", "status": "created",
+             "paymentDetailsData": {"paymentMethod": "toCard", "bankName": "Bank", "holder": "P. P.",
+                                    "number": "2200 1234 5678 9012"}},
+}
+_BRUSNIKA_STATUS = {"data": {"id": "1000001", "status": "PAID", "amountInitial": 50000, "currency": "NOTSET"}}
+_FORTA_PAY = {
+    "data": {"guid": "6f1c6f0e-8a9b-4c55-9f0e-3f1b2b8e2d10", "orderId": "bench-1", "amount": 50000,
+             "bank": "SBP_ECOM", "status": "INIT", "qrCodeLink": "https://qr.nspk.ru/mock/6f1c",
+             "receiverName": "Petr P.", "receiverBank": "Mock Bank", "receiverPhone": "79990001122"},
+}
+_FORTA_STATUS = {"data": {"guid": "6f1c6f0e-8a9b-4c55-9f0e-3f1b2b8e2d10", "orderId": "bench-1", "amount": 50000,
+                          "status": "PAID"}}
+
+
+def cases() -> List[Tuple[str, Callable, Callable, Dict[str, Any], Dict[str, Any]]]:
+    b, f = BrusnikaAdapter(), FortaAdapter()
+    return [
+        ("brusnika.pay.sbp", _legacy_brusnika_pay, _spec_pay(b), _BRUSNIKA_PAY, {}),
+        ("brusnika.pay.card", _legacy_brusnika_pay, _spec_pay(b), _BRUSNIKA_PAY_CARD, {}),
+        ("brusnika.status", _legacy_brusnika_status, _spec_status(b), _BRUSNIKA_STATUS, {}),
+        ("forta.pay", _legacy_forta_pay, _spec_pay(f), _FORTA_PAY, {}),
+        ("forta.pay.wrapped", _legacy_forta_pay, _spec_pay(f), _FORTA_PAY, {"wrapped_to_json": True}),
+        ("forta.status", _legacy_forta_status, _spec_status(f), _FORTA_STATUS, {}),
+    ]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Per-response provider mapping cost: ProviderSpec vs legacy adapters")
+    ap.add_argument("--number", type=int, default=20_000, help="вызовов на замер")
+    ap.add_argument("--repeat", type=int, default=15, help="замеров (берётся лучший)")
+    ap.add_argument("--out", help="куда сохранить JSON-отчёт")
+    args = ap.parse_args()
+
+    report: Dict[str, Any] = {"number": args.number, "repeat": args.repeat, "cases": {}}
+    for name, legacy, spec, js, payload in cases():
+        if legacy(js, payload) != spec(js, payload):
+            print(f"MISMATCH {name}:\n  legacy={legacy(js, payload)}\n  spec={spec(js, payload)}", file=sys.stderr)
+            return 1
+        # замеры чередуются, чтобы обе реализации видели одинаковый фон машины; берётся лучший
+        best = {"legacy": float("inf"), "spec": float("inf")}
+        for _ in range(args.repeat):
+            for label, fn in (("legacy", legacy), ("spec", spec)):
+                t = timeit.timeit(lambda: fn(js, payload), number=args.number)
+                best[label] = min(best[label], t / args.number * 1e9)  # нс на ответ
+        best = {k: round(v, 1) for k, v in best.items()}
+        report["cases"][name] = {
+            "legacy_ns": best["legacy"],
+            "spec_ns": best["spec"],
+            "speedup": round(best["legacy"] / best["spec"], 2) if best["spec"] else None,
+        }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+Микробенчмарки чистых функций горячего пути (без сети и БД): разбор запроса RP, реквизиты Brusnika/Forta,
+шифрование secure-блока, JWT и HMAC-подпись коллбэка.
+
+    python -m bench.micro                                   # замер + сравнение с bench/micro_baseline.json
+    python -m bench.micro --save-baseline                   # перезаписать базовую линию
+    python -m bench.micro --baseline other.json --max-regression 0.2 --filter brusnika --out result.json
+
+Каждый кейс — лучший из --repeat замеров (нс на вызов); число вызовов на замер подбирается так, чтобы замер
+длился около --min-time секунд (или задаётся --number). Вперемешку с кейсом меряется эталонная нагрузка, и
+с базовой линией сравниваются и нс, и время в её единицах (rel): код 1, если кейс стал медленнее больше чем
+на --max-regression (доля) по обеим мерам. Фикстуры — в форме реальных ответов провайдеров и вложенного запроса RP.
+Базовая линия всё равно зависит от версии Python и CPU — при расхождении окружения печатается предупреждение.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+os.environ.setdefault("RP_CALLBACK_SIGNING_SECRET", "bench-secret")
+
+from app.routers.rp_endpoints import _normalize_nested_payload  # noqa: E402
+from app.providers.brusnika.adapter import BrusnikaAdapter  # noqa: E402
+from app.providers.forta.adapter import FortaAdapter  # noqa: E402
+from app.callbacks.rp_client import encrypt_secure_block, make_jwt, RPCallbackClient  # noqa: E402
+from app.utils.security import hmac_sha256_b64  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "micro_baseline.json"
+_SECRET = "0f3c1a9e7b2d4c6e8a0b1c2d3e4f5a6b"
+
+# ---- фикстуры ----
+_PAY_BODY = {
+    "callback_url": "https://rp.example.com/api/v1/gateways/callback/8f14e45f",
+    "processing_url": "https://rp.example.com/processing/8f14e45f",
+    "method_name": "sbp",
+    "params": {
+        "settings": {"provider": "brusnika", "authorization_token": "bk_live_5c0a1d", "payment_method": "SBP",
+                     "logs_verbosity": "summary", "wrapped_to_json": False, "show_qr_on_form": True},
+        "customer": {"client_id": "c-7731", "client_ip": "185.12.64.10", "email": "user@example.com"},
+        "payment": {"token": "8f14e45fceea167a5a36dedd4bea2543", "order_number": "ORD-2026-10-19-000184",
+                    "amount": 150000, "currency": "RUB", "redirect_success_url": "https://shop.example.com/ok",
+                    "redirect_fail_url": "https://shop.example.com/fail", "paymentMethod": "SBP"},
+    },
+}
+_BRUSNIKA_DETAILS = {
+    "sbp_phone": ({"paymentMethod": "SBP", "bankName": "Т-Банк", "nameMediator": "Иван Иванович И.",
+                   "number": "+7 (999) 000-11-22", "qRcode": "https://qr.nspk.ru/AS1000QWERTY0001"}, None),
+    "card": ({"paymentMethod": "toCard", "bankName": "Сбербанк", "holder": "PETR PETROV",
+              "number": "2200 1234 5678 9012"}, None),
+    "account": ({"paymentMethod": "toAccount", "bankName": "ВТБ", "holder": "ООО Ромашка",
+                 "number": "40817810099910004312", "numberAdditional": "044525225"}, None),
+    "deeplink": ("", "https://pay.brusnikapay.top/deeplink/1000001"),
+    "empty": ({}, None),
+}
+_FORTA_BLOCKS = {
+    "link": ({"guid": "6f1c6f0e-8a9b-4c55-9f0e-3f1b2b8e2d10", "orderId": "ORD-2026-10-19-000184", "amount": 150000,
+              "bank": "SBP_ECOM", "status": "INIT", "qrCodeLink": "https://qr.nspk.ru/BD1000ABCDEF0002",
+              "receiverName": "Петр П.", "receiverBank": "Альфа-Банк", "receiverPhone": "79990001122"}, {}),
+    "wrapped": None,  # тот же блок с wrapped_to_json
+    "phone_only": ({"guid": "0a7d", "orderId": "ORD-2", "amount": 1000, "bank": "SBP_ECOM", "status": "INPROGRESS",
+                    "receiverName": "Анна А.", "receiverBank": "Райффайзен", "receiverPhone": "79161234567"}, {}),
+}
+_FORTA_BLOCKS["wrapped"] = (_FORTA_BLOCKS["link"][0], {"wrapped_to_json": True})
+_SECURE_BLOCK = {"status": "PAID", "amount": 150000, "currency": "RUB"}
+_CALLBACK = {
+    "token": "8f14e45fceea167a5a36dedd4bea2543",
+    "gateway_token": "1000001",
+    "status": "PAID",
+    "currency": "RUB",
+    "amount": 150000,
+    "secure": encrypt_secure_block(_SECURE_BLOCK, _SECRET),
+}
+_WEBHOOK_CALLBACK = {"result": "approved", "gateway_token": "1000001", "logs": [], "requisites": None}
+
+
+def cases() -> List[Tuple[str, Callable[[], Any]]]:
+    b, f = BrusnikaAdapter(), FortaAdapter()
+    out: List[Tuple[str, Callable[[], Any]]] = [("rp.normalize_nested_payload", lambda: _normalize_nested_payload(_PAY_BODY))]
+    for name, (details, deeplink) in _BRUSNIKA_DETAILS.items():
+        out.append((f"brusnika.requisites.{name}",
+                    lambda d=details, l=deeplink: b._build_requisites_and_provider_data(d, l)))
+    out.append(("brusnika.digits", lambda: b._digits("+7 (999) 000-11-22")))
+    for name, (block, payload) in _FORTA_BLOCKS.items():
+        out.append((f"forta.build_output.{name}", lambda bl=block, p=payload: f._build_output(bl, p)))
+    body, _ = RPCallbackClient._encode(_WEBHOOK_CALLBACK)
+    out += [
+        ("callback.encrypt_secure_block", lambda: encrypt_secure_block(_SECURE_BLOCK, _SECRET)),
+        ("callback.make_jwt", lambda: make_jwt(_CALLBACK, _SECRET)),
+        ("callback.hmac_sha256_b64", lambda: hmac_sha256_b64(_SECRET, body)),
+    ]
+    return out
+
+
+def _reference() -> int:
+    # эталонная нагрузка из того же интерпретатора: dict/str/int операции, как у функций горячего пути
+    d = {"a": 1, "b": "x", "c": None}
+    n = 0
+    for i in range(50):
+        n += len(str(i)) + (d.get("a") or 0) + (1 if d.get("c") is None else 0)
+    return n
+
+
+def _number_for(timer: timeit.Timer, min_time: float) -> int:
+    per_call = timer.timeit(number=100) / 100
+    return max(100, int(min_time / max(per_call, 1e-9)))
+
+
+def measure(fn: Callable[[], Any], number: int, repeat: int, min_time: float) -> Tuple[float, float, int]:
+    """
+    Лучшее время одного вызова в нс, оно же в единицах эталонной нагрузки и число вызовов на замер.
+    Эталон меряется вперемешку с кейсом: фон машины и частота CPU одинаково влияют на оба.
+    """
+    timer, ref = timeit.Timer(fn), timeit.Timer(_reference)
+    number = number or _number_for(timer, min_time)
+    ref_number = _number_for(ref, min_time / 2)
+    best, best_ref = float("inf"), float("inf")
+    for _ in range(repeat):
+        best_ref = min(best_ref, ref.timeit(number=ref_number) / ref_number)
+        best = min(best, timer.timeit(number=number) / number)
+    return best * 1e9, best / best_ref, number
+
+
+def environment() -> Dict[str, str]:
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "machine": platform.machine(), "processor": platform.processor() or platform.machine()}
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """
+    Регрессия: кейс медленнее базовой линии больше чем на max_regression (доля) и в нс, и в единицах эталона
+    (rel). Шум загрузки машины сдвигает одно из двух, настоящее замедление кода — оба.
+    """
+    problems = []
+    base_cases = baseline.get("cases", {})
+    for name, cur in report["cases"].items():
+        base = base_cases.get(name)
+        if not base or not base.get("rel") or not base.get("ns"):
+            continue
+        ratio, ratio_ns = cur["rel"] / base["rel"], cur["ns"] / base["ns"]
+        cur["vs_baseline"] = round(ratio, 3)
+        if min(ratio, ratio_ns) > 1 + max_regression:
+            problems.append(f"{name}: {cur['ns']} ns vs baseline {base['ns']} ns "
+                            f"(x{ratio_ns:.2f}, x{ratio:.2f} normalized)")
+    return problems
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.micro", description="Hot-path helper microbenchmarks")
+    ap.add_argument("--number", type=int, default=0, help="вызовов на замер (0 — подобрать по --min-time)")
+    ap.add_argument("--repeat", type=int, default=9, help="замеров (берётся лучший)")
+    ap.add_argument("--min-time", type=float, default=0.03, help="секунд на замер при подборе --number")
+    ap.add_argument("--filter", help="только кейсы, в имени которых есть подстрока")
+    ap.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="JSON базовой линии для сравнения")
+    ap.add_argument("--max-regression", type=float, default=0.25)
+    ap.add_argument("--save-baseline", action="store_true", help="записать результат в --baseline вместо сравнения")
+    ap.add_argument("--out", help="куда сохранить JSON-отчёт")
+    args = ap.parse_args()
+
+    report: Dict[str, Any] = {"env": environment(), "repeat": args.repeat, "cases": {}}
+    for name, fn in cases():
+        if args.filter and args.filter not in name:
+            continue
+        ns, rel, number = measure(fn, args.number, args.repeat, args.min_time)
+        report["cases"][name] = {"ns": round(ns, 1), "rel": round(rel, 4), "number": number}
+
+    problems: List[str] = []
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        if args.filter and baseline_path.exists():
+            # частичный прогон обновляет только свои кейсы
+            saved = json.loads(baseline_path.read_text(encoding="utf-8"))
+            report = {**report, "cases": {**saved.get("cases", {}), **report["cases"]}}
+        baseline_path.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        if baseline.get("env") != report["env"]:
+            print(f"WARNING baseline env {baseline.get('env')} differs from {report['env']}", file=sys.stderr)
+        problems = compare(report, baseline, args.max_regression)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    print(text)
+    for p in problems:
+        print(f"REGRESSION {p}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
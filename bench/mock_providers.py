@@ -0,0 +1,173 @@
+"""
+Локальные моки Brusnika и Forta + приёмник RP-коллбэков для нагрузочных прогонов.
+
+    python -m bench.mock_providers --port 9100 --gateway http://127.0.0.1:8080 --latency-ms 50
+
+Brusnika:  POST /host2host/payin, GET /operation/operation/platform/{id}
+Forta:     POST /merchantApic2c/invoice, GET /merchantApic2c/invoice?id=...
+RP:        POST /rp/callback (приёмник), GET /rp/callbacks (время прихода коллбэков по gateway_token)
+
+После создания операции мок через --webhook-delay-ms шлёт в шлюз вебхук с финальным статусом.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+
+
+class MockConfig:
+    def __init__(
+        self,
+        gateway_url: str = "http://127.0.0.1:8080",
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        webhook_delay_ms: float = 500.0,
+        approve_ratio: float = 0.9,
+    ):
+        self.gateway_url = gateway_url.rstrip("/")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.webhook_delay_ms = webhook_delay_ms
+        self.approve_ratio = approve_ratio
+
+
+def create_app(cfg: MockConfig) -> FastAPI:
+    app = FastAPI(title="MockProviders")
+    ids = itertools.count(1_000_000)
+    # id операции → {"status", "amount", "order"}
+    brusnika_ops: Dict[str, Dict[str, Any]] = {}
+    forta_ops: Dict[str, Dict[str, Any]] = {}
+    # gateway_token → время прихода коллбэка (time.time())
+    callbacks: Dict[str, float] = {}
+    state: Dict[str, Optional[httpx.AsyncClient]] = {"client": None}
+
+    async def _latency() -> None:
+        delay = random.gauss(cfg.latency_ms, cfg.jitter_ms) if cfg.jitter_ms else cfg.latency_ms
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    def _final_status(approved: str, declined: str) -> str:
+        return approved if random.random() < cfg.approve_ratio else declined
+
+    async def _send_webhook(path: str, body: Dict[str, Any], ops: Dict[str, Dict[str, Any]], op_id: str) -> None:
+        await asyncio.sleep(cfg.webhook_delay_ms / 1000)
+        ops[op_id]["status"] = body["status"]
+        if state["client"] is None:
+            state["client"] = httpx.AsyncClient(timeout=15)
+        try:
+            await state["client"].post(f"{cfg.gateway_url}{path}", json=body)
+        except httpx.HTTPError:
+            pass
+
+    # ---- Brusnika ----
+    @app.post("/host2host/payin")
+    async def brusnika_payin(body: Dict[str, Any]):
+        await _latency()
+        op_id = str(next(ids))
+        order = body.get("idTransactionMerchant")
+        brusnika_ops[op_id] = {"status": "INPROGRESS", "amount": body.get("amount"), "order": order}
+        final = _final_status("PAID", "CANCELLED")
+        asyncio.ensure_future(_send_webhook(
+            "/provider/brusnika/webhook",
+            {"merchantOrderId": order, "idPlatform": op_id, "status": final},
+            brusnika_ops, op_id,
+        ))
+        return {
+            "result": {"status": "success"},
+            "data": {
+                "id": op_id,
+                "status": "INPROGRESS",
+                "amount": body.get("amount"),
+                "currency": "RUB",
+                "paymentDetailsData": {
+                    "paymentMethod": "SBP",
+                    "bankName": "Mock Bank",
+                    "nameMediator": "Ivan I.",
+                    "number": "+7 999 000-11-22",
+                    "qRcode": f"https://qr.nspk.ru/mock/{op_id}",
+                },
+            },
+        }
+
+    @app.get("/operation/operation/platform/{op_id}")
+    async def brusnika_status(op_id: str):
+        await _latency()
+        op = brusnika_ops.get(op_id)
+        if not op:
+            return {"result": {"status": "error"}, "data": None}
+        return {"data": {"id": op_id, "status": op["status"], "amount": op["amount"], "currency": "RUB"}}
+
+    # ---- Forta ----
+    @app.post("/merchantApic2c/invoice")
+    async def forta_invoice(body: Dict[str, Any]):
+        await _latency()
+        guid = str(uuid.uuid4())
+        order = body.get("orderId")
+        forta_ops[guid] = {"status": "INIT", "amount": body.get("amount"), "order": order}
+        final = _final_status("PAID", "CANCELED")
+        asyncio.ensure_future(_send_webhook(
+            "/provider/forta/webhook",
+            {"guid": guid, "orderId": order, "amount": body.get("amount"), "status": final},
+            forta_ops, guid,
+        ))
+        return {
+            "data": {
+                "guid": guid,
+                "orderId": order,
+                "amount": body.get("amount"),
+                "bank": "SBP_ECOM",
+                "status": "INIT",
+                "qrCodeLink": f"https://qr.nspk.ru/mock/{guid}",
+                "receiverName": "Petr P.",
+                "receiverBank": "Mock Bank",
+                "receiverPhone": "79990001122",
+            }
+        }
+
+    @app.get("/merchantApic2c/invoice")
+    async def forta_status(id: str):
+        await _latency()
+        op = forta_ops.get(id)
+        if not op:
+            return {"data": None}
+        return {"data": {"guid": id, "orderId": op["order"], "amount": op["amount"], "status": op["status"]}}
+
+    # ---- RP ----
+    @app.post("/rp/callback")
+    async def rp_callback(request: Request):
+        body = await request.json()
+        callbacks.setdefault(str(body.get("gateway_token")), time.time())
+        return {"ok": True}
+
+    @app.get("/rp/callbacks")
+    async def rp_callbacks():
+        return callbacks
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    ap = argparse.ArgumentParser(description="Mock Brusnika/Forta providers and RP callback receiver")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--gateway", default="http://127.0.0.1:8080", help="base URL шлюза для вебхуков")
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--webhook-delay-ms", type=float, default=500.0)
+    ap.add_argument("--approve-ratio", type=float, default=0.9)
+    args = ap.parse_args()
+
+    cfg = MockConfig(args.gateway, args.latency_ms, args.jitter_ms, args.webhook_delay_ms, args.approve_ratio)
+    uvicorn.run(create_app(cfg), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Проверка идемпотентности /pay при сбое после ответа провайдера: запись маппинга падает («database is locked»),
+RP повторяет /pay с тем же payment.token — провайдер должен получить ровно один вызов, повтор — сохранённый ответ.
+
+    python -m bench.pay_retry
+
+Всё в одном процессе: шлюз — через ASGITransport, провайдер (Brusnika) — httpx.MockTransport в общем клиенте
+шлюза, БД — во временном каталоге. Код выхода 1 — провайдер вызван не один раз или повтор не из кэша.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+from typing import Any, Dict
+
+os.environ.setdefault("RP_CALLBACK_SIGNING_SECRET", "bench-secret")
+os.environ["BRUSNIKA_BASE_URL"] = "http://provider.invalid"
+os.environ["SHM_CACHE_ENABLED"] = "false"
+# data/mappings.sqlite3 — относительно cwd: работаем в чистом временном каталоге
+os.chdir(tempfile.mkdtemp(prefix="pay-retry-"))
+
+import httpx  # noqa: E402
+
+from app import db  # noqa: E402
+from app.main import app  # noqa: E402
+from app.providers import framework  # noqa: E402
+from app.utils import http as gateway_http  # noqa: E402
+
+
+def _pay_body(token: str) -> Dict[str, Any]:
+    return {
+        "settings": {"provider": "Brusnika_SBP", "authorization_token": "bench-token"},
+        "payment": {"token": token, "order_number": f"retry-{token[:12]}", "amount": 10000, "currency": "RUB"},
+        "callback_url": "http://rp.invalid/callback",
+        "processing_url": "http://rp.invalid/processing",
+    }
+
+
+async def main() -> int:
+    provider_posts = []
+
+    def provider(request: httpx.Request) -> httpx.Response:
+        provider_posts.append(request.url.path)
+        return httpx.Response(200, json={
+            "result": {"status": "success"},
+            "data": {
+                "id": f"op-{len(provider_posts)}",
+                "status": "INPROGRESS",
+                "paymentDetailsData": {"paymentMethod": "SBP", "qRcode": "https://qr.nspk.ru/retry"},
+            },
+        })
+
+    await db.init_db()
+    gateway_http._shared = httpx.AsyncClient(transport=httpx.MockTransport(provider))
+    gateway_http._shared_loop = asyncio.get_running_loop()
+
+    failures = [1]
+    upsert = framework.upsert_mapping
+
+    async def flaky_upsert(**fields):
+        if failures[0]:
+            failures[0] -= 1
+            raise RuntimeError("database is locked")
+        return await upsert(**fields)
+
+    framework.upsert_mapping = flaky_upsert
+    body = _pay_body(uuid.uuid4().hex)
+    # raise_app_exceptions=False: 500 шлюза — ответ, а не исключение в проверке
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as c:
+        first = await c.post("/pay", json=body)
+        retry = await c.post("/pay", json=body)
+
+    # маппинг, не записанный на /pay, дописывает фоновый повтор
+    await asyncio.gather(*framework._mapping_retries)
+    mapping = await db.get_mapping_by_token_any(body["payment"]["token"])
+
+    replayed = retry.headers.get("X-Idempotent-Replay") == "true"
+    same = first.status_code == 200 and retry.status_code == 200 and \
+        retry.json().get("gateway_token") == first.json().get("gateway_token")
+    print(f"first: {first.status_code}, retry: {retry.status_code} replay={replayed}, "
+          f"provider calls: {len(provider_posts)}, mapping saved: {mapping is not None}")
+    ok = len(provider_posts) == 1 and replayed and same and mapping is not None
+    print("OK" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
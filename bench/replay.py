@@ -0,0 +1,371 @@
+"""
+Повтор записанного трафика (CAPTURE_ENABLED, app/capture.py) против локального шлюза: входящие запросы RP и
+вебхуки провайдеров уходят в шлюз в записанном темпе или ускоренно, а ответы провайдеров отдаёт лента из той же
+записи — без сети и без настоящих провайдеров.
+
+    python -m bench.replay data/capture                          # 1x: поднимает ленту провайдеров и шлюз
+    python -m bench.replay data/capture --speed 10 --out replay.json
+    python -m bench.replay capture-*.ndjson --baseline replay.json --max-regression 0.15
+    python -m bench.replay data/capture --tape-only --port 19200 # только лента: шлюз запущен вручную
+                                                                 # с BRUSNIKA_BASE_URL / FORTA_BASE_URL на неё
+
+Запросы одной транзакции идут строго в порядке записи (следующий — не раньше ответа на предыдущий), разные
+транзакции — независимо, каждая по своему времени. callback_url в телах RP подменяется на приёмник ленты, чтобы
+коллбэки не ушли настоящему мерчанту. Ответ провайдера ищется по (метод, путь, тело без URL), а если тело
+отличается (другой callback_url или PUBLIC_BASE_URL) — по (метод, путь) в порядке записи. Записанный обрыв
+(таймаут, сброс соединения) лента воспроизводит обрывом соединения, и ретраи шлюза повторяются; латентность
+провайдера — записанная (--no-provider-latency — без неё). Песочница (SANDBOX_ENABLED) отвечает сама, её вызовы
+лента не подменяет. Отчёт: задержки и коды по маршрутам (и расхождения кодов с записью), опоздание отправки
+от расписания, попадания ленты и число коллбэков в RP.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from bench.load import REPO_ROOT, percentile, summarize, _wait_http
+from app.capture import REDACTED, redact
+
+SANDBOX_BASE_URL = "https://sandbox.local"
+
+
+# ---- запись ----
+def load_capture(paths: List[str]) -> List[Dict[str, Any]]:
+    """Записи всех сегментов (каталог — все capture-*.ndjson в нём) по времени прихода."""
+    files: List[Path] = []
+    for p in map(Path, paths):
+        files += sorted(p.glob("capture-*.ndjson")) if p.is_dir() else [p]
+    records = []
+    for f in files:
+        with open(f, encoding="utf-8") as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # недописанная строка сегмента упавшего воркера
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+def _without_urls(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _without_urls(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_without_urls(v) for v in value]
+    if isinstance(value, str) and value.startswith(("http://", "https://")):
+        return "<url>"
+    return value
+
+
+def _fingerprint(body: Any) -> str:
+    # URL в теле провайдеру (вебхук, returnUrl) зависят от окружения шлюза — в сравнении их не учитываем
+    return hashlib.sha1(json.dumps(_without_urls(body), sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _rewrite_callbacks(value: Any, callback_url: str) -> Any:
+    if isinstance(value, dict):
+        return {k: (callback_url if k == "callback_url" else _rewrite_callbacks(v, callback_url)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rewrite_callbacks(v, callback_url) for v in value]
+    return value
+
+
+# ---- лента провайдеров ----
+class ProviderTape:
+    def __init__(self, records: List[Dict[str, Any]]):
+        self._exact: Dict[Tuple[str, str, str], Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._loose: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = defaultdict(deque)
+        self.stats: Counter = Counter()
+        calls = sorted((c for r in records for c in r.get("provider_calls") or ()), key=lambda c: c["t"])
+        for call in calls:
+            if call.get("base_url") == SANDBOX_BASE_URL:
+                continue
+            entry = {"call": call, "used": False}
+            self._exact[(call["method"], call["path"], _fingerprint(call.get("request")))].append(entry)
+            self._loose[(call["method"], call["path"])].append(entry)
+        self.stats["recorded"] = sum(len(q) for q in self._loose.values())
+
+    def take(self, method: str, path: str, body: Any) -> Optional[Dict[str, Any]]:
+        for kind, queue in (
+            ("exact", self._exact.get((method, path, _fingerprint(body)))),
+            ("loose", self._loose.get((method, path))),
+        ):
+            while queue and queue[0]["used"]:
+                queue.popleft()
+            if queue:
+                entry = queue.popleft()
+                entry["used"] = True
+                self.stats[kind] += 1
+                return entry["call"]
+        self.stats["miss"] += 1
+        return None
+
+
+async def _abort():
+    # обрыв после заголовков: uvicorn закрывает соединение, у шлюза — httpx.RemoteProtocolError и ретрай
+    raise ConnectionAbortedError("recorded provider error")
+    yield b""
+
+
+def create_tape_app(tape: ProviderTape, provider_latency: bool = True) -> FastAPI:
+    app = FastAPI(title="ReplayTape")
+    callbacks = {"received": 0}
+
+    @app.post("/rp/callback")
+    async def rp_callback(request: Request):
+        await request.body()
+        callbacks["received"] += 1
+        return {"ok": True}
+
+    @app.get("/replay/stats")
+    async def replay_stats():
+        return {**tape.stats, "callbacks": callbacks["received"]}
+
+    @app.api_route("/{path:path}", methods=["GET", "POST"])
+    async def provider(request: Request):
+        raw = await request.body()
+        try:
+            body = redact(json.loads(raw)) if raw else None
+        except ValueError:
+            body = raw.decode("utf-8", "replace")
+        path = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        call = tape.take(request.method, path, body)
+        if call is None:
+            return JSONResponse({"error": "not in capture"}, status_code=502)
+        if provider_latency and call.get("duration_ms"):
+            await asyncio.sleep(call["duration_ms"] / 1000)
+        if call.get("error"):
+            return StreamingResponse(_abort(), headers={"content-length": "1"})
+        payload = call.get("body")
+        if isinstance(payload, (dict, list)):
+            return JSONResponse(payload, status_code=call["status"])
+        return Response(payload or "", status_code=call["status"])
+
+    return app
+
+
+# ---- прогон ----
+class Results:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.codes: Dict[str, Counter] = defaultdict(Counter)
+        self.mismatch: Counter = Counter()
+        self.lags: List[float] = []
+
+    def done(self, route: str, seconds: float, code: int, recorded: Optional[int]) -> None:
+        self.samples[route].append(seconds)
+        self.codes[route][str(code)] += 1
+        if recorded is not None and code != recorded:
+            self.mismatch[route] += 1
+
+    def fail(self, route: str) -> None:
+        self.errors[route] += 1
+        self.samples.setdefault(route, [])
+
+
+async def _replay_one(
+    c: httpx.AsyncClient,
+    rec: Dict[str, Any],
+    scheduled: float,
+    before: Optional[asyncio.Task],
+    res: Results,
+    callback_url: str,
+) -> None:
+    if before is not None:
+        await before
+    res.lags.append(max(0.0, time.perf_counter() - scheduled))
+    route = f"{rec['method']} {rec.get('route') or rec['path']}"
+    headers = {k: v for k, v in (rec.get("headers") or {}).items() if v != REDACTED}
+    body = rec.get("body")
+    if isinstance(body, (dict, list)):
+        content = json.dumps(_rewrite_callbacks(body, callback_url), ensure_ascii=False).encode("utf-8")
+    else:
+        content = body.encode("utf-8") if body else None
+    url = rec["path"] + (f"?{rec['query']}" if rec.get("query") else "")
+    t0 = time.perf_counter()
+    try:
+        resp = await c.request(rec["method"], url, headers=headers, content=content)
+    except httpx.HTTPError:
+        res.fail(route)
+        return
+    res.done(route, time.perf_counter() - t0, resp.status_code, rec.get("status"))
+
+
+async def drive(records: List[Dict[str, Any]], args: argparse.Namespace) -> Dict[str, Any]:
+    usable = [r for r in records if not r.get("body_truncated")]
+    res = Results()
+    callback_url = f"{args.tape_url}/rp/callback"
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.gateway_url, timeout=60, limits=limits) as c:
+        tasks: List[asyncio.Task] = []
+        last: Dict[str, asyncio.Task] = {}
+        t_first = usable[0]["t"] if usable else 0.0
+        start = time.perf_counter()
+        for i, rec in enumerate(usable):
+            scheduled = start + ((rec["t"] - t_first) / args.speed if args.speed > 0 else 0.0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            key = rec.get("tx") or f"#{i}"
+            task = asyncio.ensure_future(_replay_one(c, rec, scheduled, last.get(key), res, callback_url))
+            last[key] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+        # даём вебхукам и коллбэкам долететь
+        await asyncio.sleep(args.drain)
+        async with httpx.AsyncClient(base_url=args.tape_url, timeout=30) as tc:
+            tape_stats = (await tc.get("/replay/stats")).json()
+
+    lags = sorted(res.lags)
+    return {
+        "config": {
+            "capture": args.capture,
+            "speed": args.speed,
+            "provider_latency": not args.no_provider_latency,
+        },
+        "records": len(records),
+        "skipped_truncated": len(records) - len(usable),
+        "recorded_span_sec": round(usable[-1]["t"] - t_first, 3) if usable else 0.0,
+        "elapsed_sec": round(elapsed, 3),
+        "operations": {
+            route: {
+                **summarize(samples, res.errors[route], elapsed),
+                "status_mismatch": res.mismatch[route],
+                "codes": dict(res.codes[route]),
+            }
+            for route, samples in sorted(res.samples.items())
+        },
+        "schedule_lag_ms": {
+            "p50": round(percentile(lags, 0.50) * 1000, 2),
+            "p99": round(percentile(lags, 0.99) * 1000, 2),
+            "max": round(lags[-1] * 1000, 2) if lags else 0.0,
+        },
+        "tape": tape_stats,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Регрессия: p95/p99 маршрута выросли больше чем на max_regression (доля) или стало больше ошибок/расхождений."""
+    problems = []
+    for route, cur in report["operations"].items():
+        base = baseline.get("operations", {}).get(route)
+        if not base:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if base.get(key) and cur[key] > base[key] * (1 + max_regression):
+                problems.append(f"{route}: {key} {cur[key]} > baseline {base[key]}")
+        for key in ("errors", "status_mismatch"):
+            if cur[key] > base.get(key, 0):
+                problems.append(f"{route}: {key} {cur[key]} > baseline {base.get(key, 0)}")
+    return problems
+
+
+def start_stack(args: argparse.Namespace, workdir: Path) -> List[subprocess.Popen]:
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(REPO_ROOT) + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "BRUSNIKA_BASE_URL": args.tape_url,
+        "FORTA_BASE_URL": args.tape_url,
+        "FORTA_WEBHOOK_URL": f"{args.gateway_url}/provider/forta/webhook",
+        # sign вебхуков Forta в записи вырезан (CAPTURE_REDACT_KEYS) — без токена шлюз подпись не проверяет
+        "FORTA_API_TOKEN": "",
+        "PUBLIC_BASE_URL": args.gateway_url,
+        "RP_CALLBACK_SIGNING_SECRET": os.environ.get("RP_CALLBACK_SIGNING_SECRET", "bench-secret"),
+        "TRACING_SAMPLE_RATE": "0",
+        "CAPTURE_ENABLED": "false",
+    }
+    tape_port = args.tape_url.rsplit(":", 1)[1]
+    gw_port = args.gateway_url.rsplit(":", 1)[1]
+    tape_cmd = [sys.executable, "-m", "bench.replay", *args.capture, "--tape-only", "--port", tape_port]
+    if args.no_provider_latency:
+        tape_cmd.append("--no-provider-latency")
+    procs = [
+        subprocess.Popen(tape_cmd, cwd=REPO_ROOT, env=env),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", gw_port, "--log-level", "warning",
+             *args.gateway_args.split()],
+            cwd=workdir, env=env,  # отдельный cwd → чистая ./data/mappings.sqlite3: /pay из записи не упрётся в идемпотентность
+        ),
+    ]
+    _wait_http(f"{args.tape_url}/replay/stats")
+    _wait_http(f"{args.gateway_url}/health")
+    return procs
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.replay", description="Replay captured traffic against a local gateway")
+    ap.add_argument("capture", nargs="+", help="сегменты capture-*.ndjson или каталоги с ними")
+    ap.add_argument("--speed", type=float, default=1.0, help="ускорение относительно записи; 0 — без пауз")
+    ap.add_argument("--no-provider-latency", action="store_true", help="лента отвечает сразу, без записанной латентности")
+    ap.add_argument("--max-connections", type=int, default=200, help="соединений к шлюзу")
+    ap.add_argument("--drain", type=float, default=3.0, help="сколько ждать вебхуки/коллбэки после прогона")
+    ap.add_argument("--gateway-url", default="http://127.0.0.1:18080")
+    ap.add_argument("--tape-url", default="http://127.0.0.1:19200")
+    ap.add_argument("--gateway-args", default="", help="доп. аргументы uvicorn для шлюза (например --workers 4)")
+    ap.add_argument("--no-start", action="store_true", help="не поднимать процессы, бить в уже запущенные")
+    ap.add_argument("--tape-only", action="store_true", help="только отдавать ответы провайдеров из записи")
+    ap.add_argument("--port", type=int, default=19200, help="порт ленты для --tape-only")
+    ap.add_argument("--out", help="куда сохранить JSON-отчёт")
+    ap.add_argument("--baseline", help="JSON-отчёт прошлого прогона той же записи для сравнения")
+    ap.add_argument("--max-regression", type=float, default=0.15)
+    args = ap.parse_args()
+
+    records = load_capture(args.capture)
+    if args.tape_only:
+        import uvicorn
+
+        # обрывы по записанным ошибкам uvicorn логирует как исключения приложения — их не показываем
+        uvicorn.run(create_tape_app(ProviderTape(records), not args.no_provider_latency),
+                    host="127.0.0.1", port=args.port, log_level="critical")
+        return 0
+    if not records:
+        print("no captured requests found", file=sys.stderr)
+        return 2
+
+    procs: List[subprocess.Popen] = []
+    workdir = Path(tempfile.mkdtemp(prefix="gw-replay-"))
+    try:
+        if not args.no_start:
+            procs = start_stack(args, workdir)
+        report = asyncio.run(drive(records, args))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    print(text)
+
+    if args.baseline:
+        problems = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.max_regression)
+        for p in problems:
+            print(f"REGRESSION {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Холодный старт шлюза: время импорта app.main и латентность первых /pay после рестарта против установившейся.
+
+    python -m bench.startup --runs 5 --out startup.json
+    python -m bench.startup --no-prewarm            # то же с HTTP_PREWARM_ENABLED=false для сравнения
+
+Отчёт (JSON):
+  import      — медиана/максимум времени `import app.main` в свежем процессе и какие тяжёлые модули он подтянул;
+  cold_start  — по каждому прогону: время до готовности /health и латентность первых --first-requests /pay;
+  steady      — p50/p99 /pay после прогрева (тот же процесс, --steady-requests запросов).
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+from .load import REPO_ROOT, _pay_body, _wait_http, percentile
+
+_IMPORT_PROBE = (
+    "import sys, time; t = time.perf_counter(); import app.main; dt = time.perf_counter() - t; "
+    "import json; print(json.dumps({'seconds': dt, 'loaded': [m for m in %r if m in sys.modules]}))"
+)
+_HEAVY = ("jwt", "Crypto.Cipher.AES", "app.profiler", "app.callbacks.rp_client")
+
+
+def _env(args: argparse.Namespace, prewarm: bool) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "PYTHONPATH": str(REPO_ROOT) + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "BRUSNIKA_BASE_URL": args.mock_url,
+        "FORTA_BASE_URL": args.mock_url,
+        "PUBLIC_BASE_URL": args.gateway_url,
+        "RP_CALLBACK_SIGNING_SECRET": os.environ.get("RP_CALLBACK_SIGNING_SECRET", "bench-secret"),
+        "TRACING_SAMPLE_RATE": "0",
+        "HTTP_PREWARM_ENABLED": "true" if prewarm else "false",
+    }
+
+
+def measure_import(args: argparse.Namespace, workdir: Path) -> Dict[str, Any]:
+    times: List[float] = []
+    loaded: List[str] = []
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _IMPORT_PROBE % (_HEAVY,)],
+            cwd=workdir, env=_env(args, True), capture_output=True, text=True, check=True,
+        )
+        probe = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(probe["seconds"])
+        loaded = probe["loaded"]
+    return {
+        "median_ms": round(statistics.median(times) * 1000, 2),
+        "max_ms": round(max(times) * 1000, 2),
+        "heavy_modules_loaded": loaded,
+    }
+
+
+async def _pay_latencies(args: argparse.Namespace, n: int) -> List[float]:
+    out = []
+    async with httpx.AsyncClient(base_url=args.gateway_url, timeout=30) as c:
+        for _ in range(n):
+            body = _pay_body(args.provider, f"{args.mock_url}/rp/callback")
+            t0 = time.perf_counter()
+            resp = await c.post("/pay", json=body)
+            resp.raise_for_status()
+            out.append(time.perf_counter() - t0)
+    return out
+
+
+def measure_cold_start(args: argparse.Namespace, workdir: Path, prewarm: bool) -> Dict[str, Any]:
+    env = _env(args, prewarm)
+    gw_port = args.gateway_url.rsplit(":", 1)[1]
+    runs = []
+    steady: List[float] = []
+    for i in range(args.runs):
+        t0 = time.perf_counter()
+        gw = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", gw_port, "--log-level", "warning"],
+            cwd=workdir, env=env,
+        )
+        try:
+            _wait_http(f"{args.gateway_url}/health", timeout=30)
+            ready = time.perf_counter() - t0
+            first = asyncio.run(_pay_latencies(args, args.first_requests))
+            if i == args.runs - 1:
+                steady = asyncio.run(_pay_latencies(args, args.steady_requests))
+        finally:
+            gw.terminate()
+            gw.wait(timeout=10)
+        runs.append({
+            "ready_ms": round(ready * 1000, 2),
+            "first_pay_ms": [round(x * 1000, 2) for x in first],
+        })
+    s = sorted(steady)
+    return {
+        "runs": runs,
+        "first_pay_median_ms": round(statistics.median(r["first_pay_ms"][0] for r in runs), 2),
+        "steady": {"p50_ms": round(percentile(s, 0.5) * 1000, 2), "p99_ms": round(percentile(s, 0.99) * 1000, 2)},
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Gateway cold-start benchmark")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--first-requests", type=int, default=3, help="сколько первых /pay мерить после старта")
+    ap.add_argument("--steady-requests", type=int, default=100)
+    ap.add_argument("--provider", default="brusnika")
+    ap.add_argument("--latency-ms", type=float, default=20.0, help="латентность моков провайдера")
+    ap.add_argument("--gateway-url", default="http://127.0.0.1:18081")
+    ap.add_argument("--mock-url", default="http://127.0.0.1:19101")
+    ap.add_argument("--no-prewarm", action="store_true", help="стартовать шлюз с HTTP_PREWARM_ENABLED=false")
+    ap.add_argument("--out", help="куда сохранить JSON-отчёт")
+    args = ap.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="gw-startup-"))
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "bench.mock_providers", "--port", args.mock_url.rsplit(":", 1)[1],
+         "--gateway", args.gateway_url, "--latency-ms", str(args.latency_ms), "--webhook-delay-ms", "60000"],
+        cwd=REPO_ROOT, env=_env(args, True),
+    )
+    try:
+        _wait_http(f"{args.mock_url}/rp/callbacks")
+        report = {
+            "config": {"runs": args.runs, "provider": args.provider, "latency_ms": args.latency_ms,
+                       "prewarm": not args.no_prewarm},
+            "import": measure_import(args, workdir),
+            "cold_start": measure_cold_start(args, workdir, prewarm=not args.no_prewarm),
+        }
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())